@@ -1,6 +1,16 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # 只有真正处理请求的 runserver 进程才预热模型 (自动重载的监视进程和其他管理命令不加载)
+        if len(sys.argv) > 1 and sys.argv[1] == 'runserver':
+            if os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv:
+                from .model_manager import warm_up_on_start
+                warm_up_on_start()
@@ -0,0 +1,95 @@
+# async_utils.py
+# 异步视图支持：CPU 密集的识别工作交给有界线程池执行，
+# 一个 uvicorn 工作进程可以保持大量连接，而推理并发数不超过 CPU 核数
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from django.conf import settings
+
+
+class InferenceExecutorSaturated(Exception):
+    """推理线程池的等待队列已满"""
+
+
+class BoundedInferenceExecutor:
+    """线程池 + 容量信号量：正在执行和排队的任务总数超过上限时立即拒绝"""
+
+    def __init__(self, max_workers, queue_size):
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recognition-inference')
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务；容量已满时抛出 InferenceExecutorSaturated"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise InferenceExecutorSaturated()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'queue_size': self.queue_size,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor():
+    """获取全局推理线程池 (默认大小为 CPU 核数)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, 'RECOGNITION_INFERENCE_WORKERS', None) or os.cpu_count() or 1
+                queue_size = getattr(settings, 'RECOGNITION_INFERENCE_QUEUE_SIZE', None)
+                if queue_size is None:
+                    queue_size = workers * 2
+                _executor = BoundedInferenceExecutor(workers, queue_size)
+                print(f"✅ 推理线程池: {workers} 个线程, 等待队列 {queue_size}")
+    return _executor
+
+
+async def run_inference(fn, *args, **kwargs):
+    """在推理线程池中执行 fn 并等待结果 (不阻塞事件循环)"""
+    future = get_inference_executor().submit(fn, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+
+def async_csrf_exempt(view_func):
+    """适用于 async 视图的 csrf_exempt (Django 4.x 的 csrf_exempt 会把协程函数包装成同步函数)"""
+    @wraps(view_func)
+    async def wrapper_view(*args, **kwargs):
+        return await view_func(*args, **kwargs)
+
+    wrapper_view.csrf_exempt = True
+    return wrapper_view
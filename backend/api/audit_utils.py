@@ -1,39 +1,225 @@
 # audit_utils.py
+# 审计日志写入管道：请求线程只把日志放入队列，后台线程按条数或时间批量 bulk_create，
+# 审计写入不再占用识别请求的数据库往返
 
-import sqlite3
-from datetime import datetime
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.conf import settings
-from .db_utils import is_admin_user
-
-# 使用Django配置的数据库路径
-DB_PATH = settings.DATABASES['default']['NAME']
-
-def get_db_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-def init_audit_table():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # 创建时包含 image_path 列
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS audit_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT NOT NULL,
-        username TEXT NOT NULL,
-        action TEXT NOT NULL,
-        liveness_status TEXT,
-        compare_result TEXT,
-        score REAL,
-        image_path TEXT
-    );
-    """)
-    # 如果旧表缺少 image_path，则添加
-    cursor.execute("PRAGMA table_info(audit_logs);")
-    cols = [r[1] for r in cursor.fetchall()]
-    if "image_path" not in cols:
-        cursor.execute("ALTER TABLE audit_logs ADD COLUMN image_path TEXT;")
-    conn.commit()
-    conn.close()
+from django.contrib.auth.models import User
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AuditLog, AuditLogRollup
+from .rollup_utils import record_rollups, rollup_stats
+
+
+class _Flush:
+    """队列中的刷新标记：写入线程写完之前的日志后设置事件"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AuditLogWriter:
+    """缓冲的审计日志写入器 (线程安全)
+
+    - 日志条数达到 batch_size 或距第一条超过 flush_interval 秒时批量写入
+    - 用户名到 (用户 ID, 是否管理员) 的映射在进程内缓存，一批日志只查询一次缺失的用户
+    - 队列已满时调用方最多等待 enqueue_timeout 秒，仍然满则在调用线程中同步写入 (背压，不丢日志)
+    - 进程退出时写完队列中剩余的日志；fork 出的子进程首次写入时重新创建队列和线程
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, queue_size=10000, enqueue_timeout=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self._lock = threading.Lock()
+        self._user_ids = {}
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._closed = False
+        self._written = 0
+        self._batches = 0
+        self._sync_writes = 0
+        self._failed = 0
+        self._unknown_users = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, username, action, status, compare_result=None, score=0.0, image_path=None, skip_admin=False):
+        """放入一条审计日志 (时间戳取提交时刻)，立即返回；skip_admin 为 True 时不记录管理员账号"""
+        entry = (username, timezone.now(), action, status, compare_result, score, image_path, skip_admin)
+        if self._closed:
+            self._write([entry])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put(entry, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self._sync_writes += 1
+            print(f"⚠️ 审计日志队列已满 ({self.queue_size} 条)，在请求线程中同步写入")
+            self._write([entry])
+
+    def flush(self, timeout=5.0):
+        """等待提交之前的日志全部写入数据库，超时返回 False"""
+        if self._queue is None or self._pid != os.getpid():
+            return True
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """写完剩余日志并停止后台线程 (进程退出时调用)，之后的日志同步写入"""
+        flushed = self.flush(timeout)
+        self._closed = True
+        if not flushed:
+            print(f"⚠️ 退出时仍有约 {self._queue.qsize()} 条审计日志未写入")
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Flush):
+                self._write(pending)
+                pending, deadline = [], None
+                item.done.set()
+                continue
+            if item is not None:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(pending)
+                pending, deadline = [], None
+
+    def _resolve_user_ids(self, usernames):
+        missing = [name for name in usernames if name not in self._user_ids]
+        if missing:
+            found = User.objects.filter(username__in=missing).values_list('username', 'id', 'is_superuser')
+            with self._lock:
+                self._user_ids.update((name, (user_id, is_superuser)) for name, user_id, is_superuser in found)
+        return {name: self._user_ids[name] for name in usernames if name in self._user_ids}
+
+    def _write(self, entries):
+        if not entries:
+            return
+        close_old_connections()
+        for attempt in range(2):
+            try:
+                user_ids = self._resolve_user_ids({entry[0] for entry in entries})
+                logs = []
+                for username, timestamp, action, status, compare_result, score, image_path, skip_admin in entries:
+                    if username not in user_ids:
+                        with self._lock:
+                            self._unknown_users += 1
+                        print(f"用户 {username} 不存在，无法记录审计日志")
+                        continue
+                    user_id, is_superuser = user_ids[username]
+                    if skip_admin and is_superuser:
+                        continue
+                    logs.append(AuditLog(
+                        user_id=user_id,
+                        timestamp=timestamp,
+                        action=action,
+                        liveness_status=status,
+                        compare_result=compare_result,
+                        score=score,
+                        image_path=image_path
+                    ))
+                # 日志和预聚合计数在同一个事务中写入，统计与日志保持一致
+                with transaction.atomic():
+                    AuditLog.objects.bulk_create(logs, batch_size=self.batch_size)
+                    if getattr(settings, 'AUDIT_ROLLUP_ENABLED', True):
+                        record_rollups(logs)
+                with self._lock:
+                    self._written += len(logs)
+                    self._batches += 1
+                return
+            except IntegrityError as e:
+                # 缓存的用户 ID 可能对应已删除的用户，清空缓存后重试一次
+                with self._lock:
+                    self._user_ids.clear()
+                if attempt:
+                    self._record_failure(entries, e)
+            except Exception as e:
+                self._record_failure(entries, e)
+                return
+
+    def _record_failure(self, entries, error):
+        with self._lock:
+            self._failed += len(entries)
+        print(f"记录审计日志失败: {error}")
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize() if self._queue is not None else 0,
+                'queue_size': self.queue_size,
+                'batch_size': self.batch_size,
+                'written': self._written,
+                'batches': self._batches,
+                'sync_writes': self._sync_writes,
+                'failed': self._failed,
+                'unknown_users': self._unknown_users,
+                'cached_users': len(self._user_ids),
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_log_writer():
+    """获取进程内唯一的审计日志写入器"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditLogWriter(
+                    batch_size=getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 200),
+                    flush_interval=getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL', 1.0),
+                    queue_size=getattr(settings, 'AUDIT_LOG_QUEUE_SIZE', 10000),
+                    enqueue_timeout=getattr(settings, 'AUDIT_LOG_ENQUEUE_TIMEOUT', 0.5),
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def add_audit_log_entry(username, action, status, compare_result=None, score=0.0, image_path=None,
+                        skip_admin=False):
+    """添加审计日志条目 (AUDIT_LOG_ASYNC 为 False 时同步写入)"""
+    writer = get_audit_log_writer()
+    if getattr(settings, 'AUDIT_LOG_ASYNC', True):
+        writer.submit(username, action, status, compare_result, score, image_path, skip_admin)
+    else:
+        writer._write([(username, timezone.now(), action, status, compare_result, score, image_path, skip_admin)])
+
 
 def add_audit_log(username: str,
                   action: str,
@@ -43,20 +229,120 @@ def add_audit_log(username: str,
                   image_path: str = None):
     """
     插入一条审计日志，记录可选的 image_path。
+    与 add_audit_log_entry 走同一个写入队列；管理员账号不记录 (与旧版 audit_logs 表的行为一致)。
+    """
+    add_audit_log_entry(username, action, liveness_status, compare_result, score, image_path, skip_admin=True)
+
+
+# ---------- 查询 (键集分页) ----------
+
+ALERT_STATUSES = ('FAIL', 'ERROR')
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_audit_cursor(log):
+    """把日志的 (timestamp, id) 编码为分页游标 '<微秒时间戳>,<id>'"""
+    delta = log.timestamp - _EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return f"{micros},{log.id}"
+
+
+def decode_audit_cursor(cursor):
+    """解析分页游标，返回 (timestamp, id)；格式错误时抛出 ValueError"""
+    try:
+        micros, log_id = cursor.split(',')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(log_id)
+    except (ValueError, OverflowError):
+        raise ValueError(f'无效的分页游标: {cursor}')
+
+
+def _parse_time(value, end=False):
+    """解析日期或日期时间；只有日期时 end=True 表示当天结束 (不含次日 0 点)"""
+    try:
+        day = parse_date(value)
+        if day is not None:
+            parsed = datetime(day.year, day.month, day.day) + (timedelta(days=1) if end else timedelta())
+        else:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError
+    except ValueError:
+        raise ValueError(f'无效的日期: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def query_audit_logs(params, statuses=None, default_limit=50):
+    """按查询参数读取一页审计日志，按 (timestamp, id) 倒序，返回 (日志列表, next_cursor)
+
+    参数: limit, before (上一页的 next_cursor), user, action, status (逗号分隔), start, end (日期或日期时间)。
+    statuses 限定可查询的状态 (警报日志为 FAIL/ERROR)。参数无效时抛出 ValueError。
+    每页只沿索引读取 limit+1 行，耗时与表的大小无关。
     """
-    # 如果是管理员账号，不记录
-    if is_admin_user(username):
-        return
-
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT INTO audit_logs
-    (timestamp, username, action, liveness_status, compare_result, score, image_path)
-    VALUES (?, ?, ?, ?, ?, ?, ?);
-    """, (ts, username, action, liveness_status, compare_result, score, image_path))
-    conn.commit()
-    conn.close()
+    try:
+        limit = int(params.get('limit') or default_limit)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError(f"无效的 limit: {params.get('limit')}")
+    limit = min(limit, getattr(settings, 'AUDIT_LOG_PAGE_MAX', 500))
+
+    queryset = AuditLog.objects.all()
+    username = params.get('user')
+    if username:
+        user_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+        if user_id is None:
+            return [], None
+        queryset = queryset.filter(user_id=user_id)
+    if params.get('action'):
+        queryset = queryset.filter(action=params['action'])
+    if params.get('start'):
+        queryset = queryset.filter(timestamp__gte=_parse_time(params['start']))
+    if params.get('end'):
+        queryset = queryset.filter(timestamp__lt=_parse_time(params['end'], end=True))
+    if params.get('before'):
+        timestamp, log_id = decode_audit_cursor(params['before'])
+        # 写成 timestamp <= t 的范围条件加排除，而不是 OR，数据库才能沿时间索引扫描
+        queryset = queryset.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=log_id)
 
+    requested = [status.strip() for status in (params.get('status') or '').split(',') if status.strip()]
+    if statuses is not None:
+        requested = [status for status in (requested or statuses) if status in statuses]
+        if not requested:
+            return [], None
+    # IN 条件不能按 (状态, 时间) 索引的顺序读取，每个状态各取一页后归并
+    querysets = [queryset.filter(liveness_status=status) for status in requested] or [queryset]
+
+    rows = []
+    for status_queryset in querysets:
+        rows.extend(status_queryset.select_related('user').order_by('-timestamp', '-id')[:limit + 1])
+    rows.sort(key=lambda log: (log.timestamp, log.id), reverse=True)
+    page = rows[:limit]
+    next_cursor = encode_audit_cursor(page[-1]) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def query_audit_stats(params):
+    """按查询参数从预聚合表读取统计
+
+    参数: period (hour/day，默认 day), start, end (默认最近 24 小时 / 30 天), user, action。参数无效时抛出 ValueError。
+    """
+    period = params.get('period') or AuditLogRollup.PERIOD_DAY
+    if period not in (AuditLogRollup.PERIOD_HOUR, AuditLogRollup.PERIOD_DAY):
+        raise ValueError(f'无效的统计周期: {period}')
+    end = _parse_time(params['end'], end=True) if params.get('end') else timezone.now()
+    if params.get('start'):
+        start = _parse_time(params['start'])
+    else:
+        start = end - (timedelta(hours=24) if period == AuditLogRollup.PERIOD_HOUR else timedelta(days=30))
 
+    user_id = None
+    if params.get('user'):
+        user_id = User.objects.filter(username=params['user']).values_list('id', flat=True).first()
+        if user_id is None:
+            raise ValueError(f"用户不存在: {params['user']}")
+    stats = rollup_stats(period, start, end, user_id=user_id, action=params.get('action'))
+    stats.update(start=timezone.localtime(start).strftime('%Y-%m-%d %H:%M:%S'),
+                 end=timezone.localtime(end).strftime('%Y-%m-%d %H:%M:%S'))
+    return stats
@@ -0,0 +1,243 @@
+# detector_utils.py
+# 人脸检测器注册表：启动时预热，每个工作线程持有一个独立实例
+# (OpenCV 的 CascadeClassifier / FaceDetectorYN 不能跨线程共享)
+
+import os
+import threading
+from django.conf import settings
+
+try:
+    import numpy as np
+    import cv2
+    OPENCV_AVAILABLE = True
+except ImportError:
+    OPENCV_AVAILABLE = False
+
+SUPPORTED_BACKENDS = ('haar', 'lbp', 'yunet')
+
+_thread_local = threading.local()
+
+
+def get_detector_config():
+    """读取人脸检测相关配置"""
+    backend = getattr(settings, 'FACE_DETECTOR_BACKEND', None)
+    cascade_path = getattr(settings, 'FACE_CASCADE_PATH', None)
+    if not backend:
+        # 未显式指定后端时，根据 FACE_CASCADE_PATH 推断
+        backend = 'lbp' if cascade_path and 'lbp' in os.path.basename(cascade_path).lower() else 'haar'
+
+    return {
+        'backend': backend,
+        'cascade_path': cascade_path,
+        'lbp_cascade_path': getattr(settings, 'FACE_LBP_CASCADE_PATH', None),
+        'yunet_model_path': getattr(settings, 'FACE_YUNET_MODEL_PATH', None),
+        'max_side': getattr(settings, 'FACE_DETECT_MAX_SIDE', 640),
+        'scale_factor': getattr(settings, 'FACE_DETECT_SCALE_FACTOR', 1.1),
+        'min_neighbors': getattr(settings, 'FACE_DETECT_MIN_NEIGHBORS', 4),
+        'min_size': getattr(settings, 'FACE_DETECT_MIN_SIZE', 30),
+        'yunet_score_threshold': getattr(settings, 'FACE_YUNET_SCORE_THRESHOLD', 0.8),
+    }
+
+
+class CascadeFaceDetector:
+    """Haar / LBP 级联分类器，在灰度图上检测"""
+    needs_color = False
+
+    def __init__(self, backend, cascade_path, scale_factor, min_neighbors):
+        self.backend = backend
+        self.path = cascade_path
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.classifier = cv2.CascadeClassifier(cascade_path)
+        if self.classifier.empty():
+            raise ValueError(f"无法加载级联文件: {cascade_path}")
+        # 级联分类器的检测窗口 (Haar 默认 24x24)，缩小后比它还小的人脸检测不到
+        self.window = min(self.classifier.getOriginalWindowSize()) or 24
+
+    def detect(self, image, min_size, max_size=None):
+        faces = self.classifier.detectMultiScale(
+            image, self.scale_factor, self.min_neighbors, minSize=(min_size, min_size),
+            maxSize=(max_size, max_size) if max_size else (0, 0)
+        )
+        return np.asarray(faces, dtype=np.float32).reshape(-1, 4)
+
+
+class YuNetFaceDetector:
+    """cv2.FaceDetectorYN (YuNet ONNX 模型)，在彩色图上检测"""
+    needs_color = True
+    window = 10  # 能稳定检测的最小人脸尺寸
+
+    def __init__(self, model_path, score_threshold):
+        self.backend = 'yunet'
+        self.path = model_path
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold)
+        self.input_size = (320, 320)
+
+    def detect(self, image, min_size, max_size=None):
+        h, w = image.shape[:2]
+        if (w, h) != self.input_size:
+            self.detector.setInputSize((w, h))
+            self.input_size = (w, h)
+        _, faces = self.detector.detect(image)
+        if faces is None:
+            return np.empty((0, 4), dtype=np.float32)
+        boxes = faces[:, :4]
+        keep = (boxes[:, 2] >= min_size) & (boxes[:, 3] >= min_size)
+        if max_size:
+            keep &= (boxes[:, 2] <= max_size) & (boxes[:, 3] <= max_size)
+        return boxes[keep]
+
+
+def _default_cascade_path(filename):
+    return os.path.join(cv2.data.haarcascades, filename)
+
+
+def build_face_detector(config=None):
+    """按配置创建检测器；所需模型文件缺失时回退到 Haar 级联"""
+    config = config or get_detector_config()
+    backend = config['backend']
+
+    if backend not in SUPPORTED_BACKENDS:
+        print(f"⚠️ 未知的人脸检测后端 {backend}，使用 haar")
+        backend = 'haar'
+
+    if backend == 'yunet':
+        model_path = config['yunet_model_path']
+        if model_path and os.path.exists(model_path) and hasattr(cv2, 'FaceDetectorYN'):
+            return YuNetFaceDetector(model_path, config['yunet_score_threshold'])
+        print(f"⚠️ YuNet 模型不可用 ({model_path})，回退到 haar")
+        backend = 'haar'
+
+    if backend == 'lbp':
+        lbp_path = config['lbp_cascade_path']
+        if not lbp_path and config['cascade_path'] and 'lbp' in os.path.basename(config['cascade_path']).lower():
+            lbp_path = config['cascade_path']
+        if lbp_path and os.path.exists(lbp_path):
+            return CascadeFaceDetector('lbp', lbp_path, config['scale_factor'], config['min_neighbors'])
+        print(f"⚠️ LBP 级联文件不存在 ({lbp_path})，回退到 haar")
+        backend = 'haar'
+
+    cascade_path = config['cascade_path']
+    if not cascade_path or 'lbp' in os.path.basename(cascade_path).lower():
+        cascade_path = _default_cascade_path('haarcascade_frontalface_default.xml')
+    return CascadeFaceDetector('haar', cascade_path, config['scale_factor'], config['min_neighbors'])
+
+
+def get_face_detector():
+    """获取当前线程的检测器实例（首次调用时创建，之后复用）"""
+    detector = getattr(_thread_local, 'detector', None)
+    if detector is None:
+        detector = build_face_detector()
+        _thread_local.detector = detector
+    return detector
+
+
+def warm_up_face_detector():
+    """启动时预热：在当前线程加载检测器并执行一次空检测"""
+    if not OPENCV_AVAILABLE:
+        return False
+    try:
+        detector = get_face_detector()
+        config = get_detector_config()
+        side = config['max_side'] or 320
+        blank = np.zeros((side, side, 3) if detector.needs_color else (side, side), dtype=np.uint8)
+        detector.detect(blank, config['min_size'])
+        print(f"✅ 人脸检测器预热完成: {detector.backend} ({detector.path})")
+        return True
+    except Exception as e:
+        print(f"❌ 人脸检测器预热失败: {e}")
+        return False
+
+
+def prepare_detection_image(frame, needs_color, max_side, min_scale=0.0):
+    """生成用于检测的缩小图像，返回 (图像, 缩放比例)；缩放比例不低于 min_scale"""
+    h, w = frame.shape[:2]
+    scale = 1.0
+    if max_side and max(h, w) > max_side:
+        scale = min(1.0, max(max_side / float(max(h, w)), min_scale))
+
+    if needs_color:
+        image = frame
+    else:
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return image, scale
+
+
+def detect_faces(frame):
+    """在缩小的灰度图上检测人脸，返回原图坐标下的 (x, y, w, h) 整数数组
+
+    缩小后 FACE_DETECT_MIN_SIZE 大小的人脸不能小于检测器的检测窗口，否则会漏检；
+    大分辨率帧要检测得更快，应同时调大 FACE_DETECT_MIN_SIZE
+    """
+    config = get_detector_config()
+    detector = get_face_detector()
+    min_scale = detector.window / float(max(1, config['min_size']))
+    image, scale = prepare_detection_image(frame, detector.needs_color, config['max_side'], min_scale)
+
+    # 最小人脸尺寸按缩放比例换算，保证与原图检测一致
+    min_size = max(1, int(round(config['min_size'] * scale)))
+    boxes = detector.detect(image, min_size)
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.round(np.asarray(boxes, dtype=np.float32) / scale).astype(np.int32)
+
+
+def detect_faces_near(frame, box, padding=0.5, size_range=(0.7, 1.4)):
+    """只在上一帧人脸框周围 (四周各扩展 padding 倍宽高) 的区域内检测，返回原图坐标
+
+    区域已经很小，按原分辨率检测 (不再缩小到 max_side)；人脸尺寸限制在上一帧的
+    size_range 倍之间，级联分类器只需扫描很少的几个尺度
+    """
+    h, w = frame.shape[:2]
+    x, y, bw, bh = [int(v) for v in box]
+    pad_x, pad_y = int(bw * padding), int(bh * padding)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(w, x + bw + pad_x), min(h, y + bh + pad_y)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return np.empty((0, 4), dtype=np.int32)
+
+    detector = get_face_detector()
+    roi = frame[y0:y1, x0:x1]
+    if not detector.needs_color and roi.ndim == 3:
+        roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    min_size = max(1, int(min(bw, bh) * size_range[0]))
+    max_size = max(min_size + 1, int(np.ceil(max(bw, bh) * size_range[1])))
+    boxes = detector.detect(roi, min_size, max_size)
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    faces = np.round(np.asarray(boxes, dtype=np.float32)).astype(np.int32)
+    faces[:, 0] += x0
+    faces[:, 1] += y0
+    return faces
+
+
+def detect_faces_tracked(frame, previous_box=None, padding=0.5):
+    """优先在上一帧人脸附近检测，丢失时回退到整帧检测，返回 (人脸框, 是否命中跟踪区域)"""
+    if previous_box is not None:
+        faces = detect_faces_near(frame, previous_box, padding)
+        if len(faces):
+            return faces, True
+    return detect_faces(frame), False
+
+
+def largest_face(faces):
+    """返回面积最大的人脸框 (x, y, w, h)"""
+    areas = faces[:, 2].astype(np.int64) * faces[:, 3]
+    return faces[int(np.argmax(areas))]
+
+
+def crop_face(frame, box, size, margin=0.2, dst=None):
+    """按人脸框加边距裁剪并缩放到 size (宽, 高)；dst 可传入预分配的缓冲区"""
+    h, w = frame.shape[:2]
+    x, y, bw, bh = [int(v) for v in box]
+    pad_x, pad_y = int(bw * margin), int(bh * margin)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(w, x + bw + pad_x), min(h, y + bh + pad_y)
+    roi = frame[y0:y1, x0:x1]
+    if dst is not None:
+        return cv2.resize(roi, size, dst=dst, interpolation=cv2.INTER_AREA)
+    return cv2.resize(roi, size, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,294 @@
+# embedding_utils.py
+# 身份照片特征向量：注册时计算一次，以紧凑的二进制文件保存在照片旁边
+
+import os
+import re
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .model_server import get_model_server_client
+from .model_manager import get_model_manager
+
+# 文件格式: 魔数 | 格式版本 | 模型名长度 | 模型版本长度 | 模型名 | 模型版本 | 维度 | float32 向量
+EMBEDDING_MAGIC = b'CSEM'
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_SUFFIX = '.emb'
+_HEADER = struct.Struct('<4sBBH')
+_DIM = struct.Struct('<I')
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def embedding_config_from_manifest(manifest):
+    """把模型注册表中的清单转换为特征模型配置"""
+    return {
+        'version': manifest['version'],
+        'model_name': manifest['model_name'],
+        'model_version': str(manifest['embedding_version']),
+        'distance_metric': manifest['thresholds']['distance_metric'],
+        'threshold': manifest['thresholds']['match'],
+    }
+
+
+def get_embedding_config(version=None):
+    """读取人脸特征模型配置；version 为会话固定的注册表版本，默认使用当前版本
+
+    注册表为空时等同于 settings 中的 FACE_MODEL_NAME / FACE_EMBEDDING_VERSION 等配置
+    """
+    return embedding_config_from_manifest(get_model_manager().embedding_manifest(version))
+
+
+def embedding_file_suffix(config=None):
+    """特征文件名后缀，如 '.Facenet-1.emb'：每个特征模型版本一个文件，
+    会话固定旧版本时生成的特征不会覆盖当前版本的特征 (模型标签中不含 '.')
+    """
+    config = config or get_embedding_config()
+    tag = re.sub(r'[^0-9A-Za-z_-]+', '_', f"{config['model_name']}-{config['model_version']}")
+    return f".{tag}{EMBEDDING_SUFFIX}"
+
+
+def embedding_path(username, config=None):
+    """用户在 config (默认当前版本) 的特征模型下的特征文件路径 (与身份照片同目录)"""
+    return os.path.join(settings.FACES_DATABASE_PATH, f"{username}{embedding_file_suffix(config)}")
+
+
+def legacy_embedding_path(username):
+    """旧版不区分模型版本的特征文件路径，只读"""
+    return os.path.join(settings.FACES_DATABASE_PATH, f"{username}{EMBEDDING_SUFFIX}")
+
+
+def compute_embedding(img, config=None):
+    """用 DeepFace 计算人脸特征向量，img 可以是图片路径或 BGR 数组
+
+    模型服务模式下由推理进程用 config 指定的版本计算 (推理进程无法使用该版本时报错)，本进程不导入 DeepFace
+    """
+    config = config or get_embedding_config()
+    client = get_model_server_client()
+    if client is not None:
+        return np.asarray(client.compute_embedding(img, config['version']), dtype=np.float32)
+
+    from deepface import DeepFace
+
+    result = DeepFace.represent(
+        img_path=img,
+        model_name=config['model_name'],
+        enforce_detection=False
+    )
+    # 新版 DeepFace 返回 [{'embedding': [...], ...}]，旧版直接返回向量
+    if isinstance(result, list) and result and isinstance(result[0], dict):
+        result = result[0]['embedding']
+    return np.asarray(result, dtype=np.float32)
+
+
+def encode_embedding(embedding, model_name, model_version):
+    """把特征向量编码为带模型标签的二进制数据"""
+    name = model_name.encode('utf-8')
+    version = model_version.encode('utf-8')
+    vector = np.asarray(embedding, dtype='<f4').ravel()
+    return (_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, len(name), len(version))
+            + name + version + _DIM.pack(vector.size) + vector.tobytes())
+
+
+def decode_embedding(data):
+    """解析二进制特征数据，返回 (向量, 模型名, 模型版本)"""
+    magic, fmt_version, name_len, version_len = _HEADER.unpack_from(data, 0)
+    if magic != EMBEDDING_MAGIC or fmt_version != EMBEDDING_FORMAT_VERSION:
+        raise ValueError('无效的特征文件')
+    offset = _HEADER.size
+    model_name = data[offset:offset + name_len].decode('utf-8')
+    offset += name_len
+    model_version = data[offset:offset + version_len].decode('utf-8')
+    offset += version_len
+    (dim,) = _DIM.unpack_from(data, offset)
+    offset += _DIM.size
+    vector = np.frombuffer(data, dtype='<f4', count=dim, offset=offset).astype(np.float32)
+    return vector, model_name, model_version
+
+
+def save_identity_embedding(username, embedding, config=None):
+    """保存用户特征向量 (先写临时文件再原子替换)"""
+    config = config or get_embedding_config()
+    path = embedding_path(username, config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_embedding(embedding, config['model_name'], config['model_version']))
+    os.replace(tmp_path, path)
+
+    with _cache_lock:
+        _cache[path] = (os.path.getmtime(path), config['model_name'], config['model_version'],
+                        np.asarray(embedding, dtype=np.float32))
+    return path
+
+
+def load_identity_embedding(username, config=None):
+    """读取用户在 config 的特征模型下的特征向量；文件不存在或模型标签不匹配时返回 None"""
+    config = config or get_embedding_config()
+    path = embedding_path(username, config)
+    if not os.path.exists(path):
+        path = legacy_embedding_path(username)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        if cached[1:3] == (config['model_name'], config['model_version']):
+            return cached[3]
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            vector, model_name, model_version = decode_embedding(f.read())
+    except Exception as e:
+        print(f"读取特征文件失败 {path}: {e}")
+        return None
+
+    with _cache_lock:
+        _cache[path] = (mtime, model_name, model_version, vector)
+    if model_name != config['model_name'] or model_version != config['model_version']:
+        if path != legacy_embedding_path(username):
+            print(f"⚠️ 特征文件模型不匹配 {path}: {model_name}/{model_version}")
+        return None
+    return vector
+
+
+def get_or_create_identity_embedding(username, photo_path, config=None):
+    """读取用户特征；该模型版本的特征缺失时 (如旧用户、切换了特征模型) 从身份照片计算一次，
+    保存为该版本自己的特征文件，不影响其他版本
+    """
+    config = config or get_embedding_config()
+    embedding = load_identity_embedding(username, config)
+    if embedding is None:
+        embedding = compute_embedding(photo_path, config)
+        save_identity_embedding(username, embedding, config)
+        print(f"✅ 已为用户 {username} 生成身份特征")
+    return embedding
+
+
+def _is_versioned_file_of(path, username):
+    """文件名是否为 username 加上文件内模型标签对应的后缀"""
+    try:
+        with open(path, 'rb') as f:
+            _, model_name, model_version = decode_embedding(f.read())
+    except Exception:
+        return False
+    suffix = embedding_file_suffix({'model_name': model_name, 'model_version': model_version})
+    return os.path.basename(path) == f"{username}{suffix}"
+
+
+def delete_identity_embedding(username):
+    """删除用户所有模型版本的特征文件"""
+    faces_dir = settings.FACES_DATABASE_PATH
+    if not os.path.isdir(faces_dir):
+        return
+    prefix = f"{username}."
+    for filename in os.listdir(faces_dir):
+        if not (filename.startswith(prefix) and filename.endswith(EMBEDDING_SUFFIX)):
+            continue
+        path = os.path.join(faces_dir, filename)
+        if filename != f"{username}{EMBEDDING_SUFFIX}" and not _is_versioned_file_of(path, username):
+            continue  # 其他用户 (如 alice.b) 的文件
+        with _cache_lock:
+            _cache.pop(path, None)
+        os.remove(path)
+
+
+def embedding_distance(a, b, metric='cosine'):
+    """计算两个特征向量之间的距离 (与 DeepFace.verify 的度量一致)"""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if metric == 'cosine':
+        return float(1.0 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    if metric == 'euclidean_l2':
+        a = a / np.linalg.norm(a)
+        b = b / np.linalg.norm(b)
+    return float(np.linalg.norm(a - b))
+
+
+# ---------- 投票期间的增量特征累积 ----------
+
+_embedding_executor = None
+_executor_lock = threading.Lock()
+_pending = {}  # 会话ID -> 本进程中尚未完成的任务 (会话过期或删除时取消)
+_pending_lock = threading.Lock()
+
+
+def incremental_embedding_enabled():
+    """是否在投票阶段逐帧提取特征"""
+    return getattr(settings, 'RECOGNITION_INCREMENTAL_EMBEDDING', False)
+
+
+def _get_embedding_executor():
+    global _embedding_executor
+    if _embedding_executor is None:
+        with _executor_lock:
+            if _embedding_executor is None:
+                _embedding_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'RECOGNITION_EMBEDDING_WORKERS', 1),
+                    thread_name_prefix='face-embedding'
+                )
+    return _embedding_executor
+
+
+def update_running_mean(session_data, embedding):
+    """把一帧的 (归一化) 特征并入会话的特征均值"""
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    count = session_data.get('embedding_count', 0) + 1
+    mean = session_data.get('embedding_mean')
+    if mean is None:
+        mean = vector
+    else:
+        mean = np.asarray(mean, dtype=np.float32)
+        mean = mean + (vector - mean) / count
+    session_data['embedding_mean'] = mean.tolist()
+    session_data['embedding_count'] = count
+
+
+def submit_session_embedding(session_id, face, on_embedding, config=None):
+    """在后台线程提取一帧特征，完成后调用 on_embedding(session_id, embedding)，提取失败时 embedding 为 None
+
+    config 为会话固定版本的特征模型配置；完成情况由 on_embedding 记录在会话中，
+    识别阶段 (可能在其他进程) 据此等待
+    """
+    def task():
+        try:
+            embedding = compute_embedding(face, config)
+        except Exception as e:
+            print(f"会话 {session_id} 的特征提取失败: {e}")
+            embedding = None
+        on_embedding(session_id, embedding)
+
+    def forget(future):
+        with _pending_lock:
+            futures = _pending.get(session_id)
+            if futures and future in futures:
+                futures.remove(future)
+                if not futures:
+                    del _pending[session_id]
+
+    future = _get_embedding_executor().submit(task)
+    with _pending_lock:
+        _pending.setdefault(session_id, []).append(future)
+    future.add_done_callback(forget)
+    return future
+
+
+def discard_session_embeddings(session_id):
+    """丢弃会话的待处理任务 (会话过期或删除时调用)"""
+    with _pending_lock:
+        futures = _pending.pop(session_id, [])
+    for future in futures:
+        future.cancel()
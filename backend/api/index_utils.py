@@ -0,0 +1,475 @@
+# index_utils.py
+# 1:N 人脸检索索引：所有已注册用户的特征向量保存在内存映射矩阵中
+# 检索时一次矩阵-向量乘积得到全部相似度，再做 top-k 选择；
+# 用户数很大时可启用 IVF 粗量化，只在最近的若干个聚类中心里搜索
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能保证进程内互斥
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .embedding_utils import (
+    embedding_file_suffix, get_embedding_config, load_identity_embedding, get_or_create_identity_embedding,
+)
+
+VECTORS_FILE = 'vectors.f32'
+ASSIGN_FILE = 'assign.i32'
+CENTROIDS_FILE = 'centroids.npy'
+META_FILE = 'meta.json'
+LOCK_FILE = 'index.lock'
+# 用户名按行追加记录 [行号, 用户名] (null 表示清空该行)，meta.json 只记录已提交的字节数
+USERNAMES_FILE = 'usernames.jsonl'
+
+
+def get_index_config():
+    """读取检索索引配置"""
+    return {
+        'path': getattr(settings, 'FACE_INDEX_PATH', os.path.join(settings.FACES_DATABASE_PATH, 'index')),
+        'ivf_enabled': getattr(settings, 'FACE_INDEX_IVF_ENABLED', False),
+        'ivf_min_size': getattr(settings, 'FACE_INDEX_IVF_MIN_SIZE', 100000),
+        'ivf_nlist': getattr(settings, 'FACE_INDEX_IVF_NLIST', None),
+        'ivf_nprobe': getattr(settings, 'FACE_INDEX_IVF_NPROBE', 16),
+        'top_k': getattr(settings, 'FACE_IDENTIFY_TOP_K', 5),
+    }
+
+
+def metric_distance(cosine_distance, metric):
+    """把检索返回的余弦距离换算为 metric 下的距离 (行已归一化，euclidean_l2 = sqrt(2 * 余弦距离))；
+    无法换算的度量 (未归一化的 euclidean) 返回 None
+    """
+    if metric == 'cosine':
+        return cosine_distance
+    if metric == 'euclidean_l2':
+        return float(np.sqrt(max(2.0 * cosine_distance, 0.0)))
+    return None
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class EmbeddingIndex:
+    """基于 numpy.memmap 的特征矩阵 (行已 L2 归一化，点积即余弦相似度)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._meta_mtime = None
+        self.meta = None
+        self.vectors = None
+        self.assignments = None
+        self.centroids = None
+        self._training = False
+        self._lock_depth = 0
+        self._rows = []  # 行号 -> 用户名
+        self._row_of = {}  # 用户名 -> 行号
+        self._journal_offset = 0
+        self._generation = None
+        self._array_key = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        """进程内 RLock + 跨进程 flock：修改索引用排它锁，检索用共享锁
+
+        多个工作进程同时注册/删除用户时不会占用同一行或互相覆盖 meta.json；
+        同一线程内嵌套调用只在最外层加文件锁 (flock 对同一进程的不同文件描述符也会互斥)
+        """
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(LOCK_FILE), 'a+') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------- 持久化 ----------
+
+    def _write_meta(self):
+        tmp_path = self._file(META_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._file(META_FILE))
+        self._meta_mtime = os.stat(self._file(META_FILE)).st_mtime_ns
+
+    def _open_arrays(self):
+        self._array_key = (self.meta.get('generation', 0), self.meta['capacity'], self.meta['ivf_trained'])
+        capacity, dim = self.meta['capacity'], self.meta['dim']
+        self.vectors = np.memmap(self._file(VECTORS_FILE), dtype=np.float32, mode='r+', shape=(capacity, dim))
+        self.assignments = np.memmap(self._file(ASSIGN_FILE), dtype=np.int32, mode='r+', shape=(capacity,))
+        centroids_path = self._file(CENTROIDS_FILE)
+        self.centroids = np.load(centroids_path) if self.meta.get('ivf_trained') and os.path.exists(centroids_path) else None
+
+    def _create(self, dim, capacity=1024, config=None):
+        config = config or get_embedding_config()
+        os.makedirs(self.path, exist_ok=True)
+        generation = (self.meta or {}).get('generation', 0)
+        self.meta = {
+            'dim': dim,
+            'count': 0,
+            'capacity': capacity,
+            'model_name': config['model_name'],
+            'model_version': config['model_version'],
+            'ivf_trained': False,
+            'generation': generation,
+            'journal_size': 0,
+            'journal_records': 0,
+        }
+        np.memmap(self._file(VECTORS_FILE), dtype=np.float32, mode='w+', shape=(capacity, dim)).flush()
+        np.memmap(self._file(ASSIGN_FILE), dtype=np.int32, mode='w+', shape=(capacity,)).flush()
+        self._open_arrays()
+        self._rows, self._row_of = [], {}
+        self._rewrite_journal()
+
+    def _maybe_reload(self, force=False):
+        """其他进程修改索引后重新映射文件，只读取用户名记录新增的部分；
+        force 为 True 时总是重新读取 meta.json (持有排它锁修改之前)
+        """
+        meta_path = self._file(META_FILE)
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except OSError:
+            return False
+        if force or mtime != self._meta_mtime:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            self._meta_mtime = mtime
+            if self._array_key != (self.meta.get('generation', 0), self.meta['capacity'], self.meta['ivf_trained']):
+                self._open_arrays()
+            self._read_journal()
+        return True
+
+    def _model_matches(self, config):
+        return (self.meta.get('model_name'), self.meta.get('model_version')) == (
+            config['model_name'], config['model_version'])
+
+    def matches(self, config=None):
+        """索引是否由 config (默认当前版本) 对应的特征模型构建"""
+        config = config or get_embedding_config()
+        with self._locked(exclusive=False):
+            return self._maybe_reload() and self._model_matches(config)
+
+    # ---------- 用户名记录 ----------
+
+    def _set_row(self, row, username):
+        while len(self._rows) <= row:
+            self._rows.append(None)
+        previous = self._rows[row]
+        if previous is not None and self._row_of.get(previous) == row:
+            del self._row_of[previous]
+        self._rows[row] = username
+        if username is not None:
+            self._row_of[username] = row
+
+    def _read_journal(self):
+        if 'usernames' in self.meta:
+            # 旧版索引把全部用户名保存在 meta.json 中
+            self._rows = list(self.meta['usernames'])
+            self._row_of = {username: row for row, username in enumerate(self._rows)}
+            self._generation, self._journal_offset = None, 0
+            return
+        size = self.meta['journal_size']
+        if self.meta['generation'] != self._generation or size < self._journal_offset:
+            self._rows, self._row_of = [], {}
+            self._generation, self._journal_offset = self.meta['generation'], 0
+        if size > self._journal_offset:
+            with open(self._file(USERNAMES_FILE), 'rb') as f:
+                f.seek(self._journal_offset)
+                data = f.read(size - self._journal_offset)
+            for line in data.splitlines():
+                row, username = json.loads(line)
+                self._set_row(row, username)
+            self._journal_offset = size
+
+    def _append_journal(self, records):
+        """追加 [(行号, 用户名), ...] 并写入 meta.json (调用方持有排它锁)"""
+        if 'usernames' in self.meta:
+            self.meta.pop('usernames')
+            self._rewrite_journal()
+        data = b''.join(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in records)
+        with open(self._file(USERNAMES_FILE), 'ab') as f:
+            f.truncate(self.meta['journal_size'])  # 丢弃上次写入中断时未提交的部分
+            f.write(data)
+        for row, username in records:
+            self._set_row(row, username)
+        self.meta['journal_size'] += len(data)
+        self.meta['journal_records'] += len(records)
+        self._journal_offset = self.meta['journal_size']
+        if self.meta['journal_records'] > 2 * self.meta['count'] + 1024:
+            self._rewrite_journal()
+        else:
+            self._write_meta()
+
+    def _rewrite_journal(self):
+        """按当前的行重写用户名记录 (重建索引或删除过多时压缩)，并写入 meta.json"""
+        count = min(self.meta['count'], len(self._rows))
+        records = [[row, self._rows[row]] for row in range(count)]
+        data = b''.join(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in records)
+        tmp_path = self._file(USERNAMES_FILE + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._file(USERNAMES_FILE))
+        del self._rows[count:]
+        self.meta['generation'] = self.meta.get('generation', 0) + 1
+        self.meta['journal_size'] = len(data)
+        self.meta['journal_records'] = len(records)
+        self._generation, self._journal_offset = self.meta['generation'], len(data)
+        self._array_key = (self.meta['generation'],) + self._array_key[1:]
+        self._write_meta()
+
+    def _grow(self):
+        old_capacity, dim = self.meta['capacity'], self.meta['dim']
+        capacity = old_capacity * 2
+        count = self.meta['count']
+        for name, dtype, shape in ((VECTORS_FILE, np.float32, (capacity, dim)), (ASSIGN_FILE, np.int32, (capacity,))):
+            tmp_path = self._file(name + '.tmp')
+            grown = np.memmap(tmp_path, dtype=dtype, mode='w+', shape=shape)
+            source = self.vectors if name == VECTORS_FILE else self.assignments
+            grown[:count] = source[:count]
+            grown.flush()
+            del grown
+            os.replace(tmp_path, self._file(name))
+        self.meta['capacity'] = capacity
+        self._open_arrays()
+
+    # ---------- 增量更新 ----------
+
+    def add(self, username, embedding, config=None):
+        """添加或更新一个用户的特征；embedding 由 config (默认当前版本) 的特征模型计算"""
+        config = config or get_embedding_config()
+        vector = _normalize(embedding)
+        with self._locked():
+            if not self._maybe_reload(force=True):
+                self._create(vector.size, config=config)
+            if self.meta['count'] == 0 and (vector.size != self.meta['dim'] or not self._model_matches(config)):
+                self._create(vector.size, self.meta['capacity'], config)
+            if not self._model_matches(config):
+                raise ValueError(f"检索索引的特征模型 {self.meta['model_name']}/{self.meta['model_version']} "
+                                 f"与 {config['model_name']}/{config['model_version']} 不一致")
+            if vector.size != self.meta['dim']:
+                raise ValueError(f"特征维度不匹配: {vector.size} != {self.meta['dim']}")
+
+            row = self._row_of.get(username)
+            is_new = row is None
+            if is_new:
+                if self.meta['count'] >= self.meta['capacity']:
+                    self._grow()
+                row = self.meta['count']
+                self.meta['count'] += 1
+
+            self.vectors[row] = vector
+            if self.centroids is not None:
+                self.assignments[row] = int(np.argmax(self.centroids @ vector))
+            self.vectors.flush()
+            self.assignments.flush()
+            if is_new:
+                self._append_journal([(row, username)])
+        self._maybe_train_ivf()
+
+    def remove(self, username):
+        """删除一个用户 (用最后一行填补空位)"""
+        with self._locked():
+            if not self._maybe_reload(force=True):
+                return False
+            row = self._row_of.get(username)
+            if row is None:
+                return False
+            last = self.meta['count'] - 1
+            records = [(last, None)]
+            if row != last:
+                self.vectors[row] = self.vectors[last]
+                self.assignments[row] = self.assignments[last]
+                records.insert(0, (row, self._rows[last]))
+            self.meta['count'] = last
+            self.vectors.flush()
+            self.assignments.flush()
+            self._append_journal(records)
+            return True
+
+    def rebuild(self, faces_dir=None, config=None, compute_missing=False):
+        """用 config (默认当前版本) 的特征模型重建索引
+
+        默认只读取已有的 .emb 特征文件 (包括旧版不区分模型版本的文件)；
+        compute_missing 为 True 时 (切换特征模型版本) 为缺少该版本特征的用户从身份照片计算一次
+        """
+        faces_dir = faces_dir or settings.FACES_DATABASE_PATH
+        config = config or get_embedding_config()
+        suffix = embedding_file_suffix(config)
+        entries = []
+        if os.path.isdir(faces_dir):
+            filenames = set(os.listdir(faces_dir))
+            usernames = {name[:-len(suffix)] for name in filenames if name.endswith(suffix)}
+            usernames.update(name[:-len('.jpg')] for name in filenames if name.endswith('.jpg'))
+            for username in sorted(usernames):
+                embedding = load_identity_embedding(username, config)
+                photo_path = os.path.join(faces_dir, f"{username}.jpg")
+                if embedding is None and compute_missing and os.path.exists(photo_path):
+                    try:
+                        embedding = get_or_create_identity_embedding(username, photo_path, config)
+                    except Exception as e:
+                        print(f"计算身份特征失败 {username}: {e}")
+                if embedding is not None:
+                    entries.append((username, _normalize(embedding)))
+
+        with self._locked():
+            self._maybe_reload(force=True)
+            dim = entries[0][1].size if entries else 128
+            capacity = 1024
+            while capacity < len(entries):
+                capacity *= 2
+            for name in (VECTORS_FILE, ASSIGN_FILE, CENTROIDS_FILE):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            self._create(dim, capacity, config)
+            for row, (username, vector) in enumerate(entries):
+                self.vectors[row] = vector
+                self._set_row(row, username)
+            self.meta['count'] = len(entries)
+            self.vectors.flush()
+            self._rewrite_journal()
+        print(f"✅ 人脸检索索引重建完成: {len(entries)} 个用户 ({config['model_name']}/{config['model_version']})")
+        self._maybe_train_ivf()
+        return len(entries)
+
+    # ---------- IVF 粗量化 ----------
+
+    def _maybe_train_ivf(self):
+        config = get_index_config()
+        with self._lock:
+            if (not config['ivf_enabled'] or self._training or self.meta['ivf_trained']
+                    or self.meta['count'] < config['ivf_min_size']):
+                return
+            self._training = True
+        threading.Thread(target=self.train_ivf, name='face-index-ivf', daemon=True).start()
+
+    def train_ivf(self, nlist=None, iterations=10, sample_size=50000):
+        """用 k-means 训练聚类中心，并为每一行分配所属列表"""
+        try:
+            with self._locked(exclusive=False):
+                self._maybe_reload()
+                count = self.meta['count']
+                rng = np.random.default_rng(0)
+                sample_rows = np.sort(rng.choice(count, size=min(count, sample_size), replace=False))
+                sample = np.array(self.vectors[sample_rows])
+
+            nlist = nlist or get_index_config()['ivf_nlist'] or max(1, int(4 * np.sqrt(count)))
+            nlist = min(nlist, len(sample))
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                counts = np.bincount(labels, minlength=nlist)
+                nonempty = counts > 0
+                centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+                norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+                centroids = centroids / np.maximum(norms, 1e-12)
+
+            with self._locked():
+                self._maybe_reload(force=True)
+                count = self.meta['count']
+                for start in range(0, count, 65536):
+                    block = self.vectors[start:min(count, start + 65536)]
+                    self.assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+                self.assignments.flush()
+                np.save(self._file(CENTROIDS_FILE), centroids)
+                self.centroids = centroids
+                self.meta['ivf_trained'] = True
+                self.meta['ivf_nlist'] = nlist
+                self._write_meta()
+            print(f"✅ IVF 索引训练完成: {count} 个用户, {nlist} 个聚类")
+        finally:
+            self._training = False
+
+    # ---------- 检索 ----------
+
+    def search(self, embedding, top_k=None, embedding_config=None):
+        """返回 [(用户名, 余弦距离), ...]，按距离从小到大排列
+
+        embedding 由 embedding_config (默认当前版本) 的特征模型计算；
+        索引由其他模型版本构建时抛出 ValueError，不在不同模型的特征之间比较
+        """
+        config = get_index_config()
+        embedding_config = embedding_config or get_embedding_config()
+        top_k = top_k or config['top_k']
+        query = _normalize(embedding)
+        with self._locked(exclusive=False):
+            if not self._maybe_reload() or self.meta['count'] == 0:
+                return []
+            if not self._model_matches(embedding_config):
+                raise ValueError(f"检索索引的特征模型 {self.meta['model_name']}/{self.meta['model_version']} "
+                                 f"与 {embedding_config['model_name']}/{embedding_config['model_version']} 不一致，"
+                                 f"请等待索引重建")
+            count = self.meta['count']
+            use_ivf = (config['ivf_enabled'] and self.centroids is not None
+                       and count >= config['ivf_min_size'])
+            if use_ivf:
+                nprobe = min(config['ivf_nprobe'], len(self.centroids))
+                probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+                rows = np.flatnonzero(np.isin(self.assignments[:count], probes))
+                scores = self.vectors[rows] @ query
+            else:
+                rows = None
+                scores = self.vectors[:count] @ query
+
+            if len(scores) == 0:
+                return []
+            k = min(top_k, len(scores))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(self._rows[rows[i] if rows is not None else i], float(1.0 - scores[i])) for i in best]
+
+    def stats(self):
+        with self._locked(exclusive=False):
+            if not self._maybe_reload():
+                return {'count': 0}
+            return {
+                'count': self.meta['count'],
+                'capacity': self.meta['capacity'],
+                'dim': self.meta['dim'],
+                'ivf_trained': self.meta['ivf_trained'],
+                'model_name': self.meta['model_name'],
+                'model_version': self.meta['model_version'],
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_embedding_index():
+    """获取全局检索索引；索引文件不存在或由其他特征模型版本构建时从特征文件重建"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = EmbeddingIndex(get_index_config()['path'])
+                if not index.matches():
+                    index.rebuild()
+                _index = index
+    return _index
@@ -0,0 +1,323 @@
+# inference_utils.py
+# 活体检测推理调度：把并发会话的人脸张量合并成一个批次送入模型
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from django.conf import settings
+
+try:
+    import numpy as np
+    import cv2
+except ImportError:
+    np = None
+
+from .detector_utils import crop_face
+
+
+LIVENESS_INPUT_SIZE = (128, 128)
+
+
+def preprocess_liveness_frame(frame):
+    """把 BGR 图像缩放并归一化为模型输入 (1, 128, 128, 3) float32"""
+    resized = cv2.resize(frame, LIVENESS_INPUT_SIZE)
+    tensor = resized.astype(np.float32) / 255.0
+    return np.expand_dims(tensor, axis=0)
+
+
+_preprocess_local = threading.local()
+
+
+def _thread_buffers():
+    """当前线程复用的缩放缓冲区 (uint8) 和模型输入缓冲区 (float32)"""
+    buffers = getattr(_preprocess_local, 'buffers', None)
+    if buffers is None:
+        width, height = LIVENESS_INPUT_SIZE
+        buffers = (np.empty((height, width, 3), dtype=np.uint8),
+                   np.empty((1, height, width, 3), dtype=np.float32))
+        _preprocess_local.buffers = buffers
+    return buffers
+
+
+def preprocess_liveness_face(frame, box, margin=0.25, out=None):
+    """只裁剪人脸 ROI (加边距) 并缩放，归一化后写入 float32 缓冲区，返回 (1, 128, 128, 3)
+
+    out 可传入批次中的一行 (128, 128, 3) 或 (1, 128, 128, 3)；
+    未传入时写入当前线程复用的缓冲区，调用方需在下一次预处理前用完结果
+    """
+    resized, default_out = _thread_buffers()
+    crop_face(frame, box, LIVENESS_INPUT_SIZE, margin, dst=resized)
+    if out is None:
+        out = default_out
+    np.multiply(resized, np.float32(1.0 / 255.0), out=out.reshape(resized.shape))
+    return out if out.ndim == 4 else out[np.newaxis]
+
+
+class KerasLivenessBackend:
+    """原始 Keras hdf5 模型 (需要完整的 TensorFlow)"""
+    name = 'keras'
+
+    def __init__(self, model_path):
+        from tensorflow.keras.models import load_model
+        self.model_path = model_path
+        self.model = load_model(model_path)
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteLivenessBackend:
+    """TFLite 模型，优先使用 tflite_runtime，支持 int8 量化输入输出"""
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        # Interpreter 不是线程安全的
+        self._lock = threading.Lock()
+        self._refresh_details()
+
+    def _refresh_details(self):
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+
+    def _quantize(self, batch):
+        dtype = self.input_detail['dtype']
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero_point = self.input_detail['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if self.output_detail['dtype'] == np.float32:
+            return output
+        scale, zero_point = self.output_detail['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        with self._lock:
+            if self.input_detail['shape'][0] != len(batch):
+                self.interpreter.resize_tensor_input(self.input_detail['index'], list(batch.shape))
+                self.interpreter.allocate_tensors()
+                self._refresh_details()
+            self.interpreter.set_tensor(self.input_detail['index'], self._quantize(batch))
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self.output_detail['index']))
+
+
+class OnnxLivenessBackend:
+    """ONNX Runtime CPU 推理"""
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        self.model_path = model_path
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: batch.astype(np.float32, copy=False)})[0]
+
+
+LIVENESS_BACKENDS = {
+    'keras': KerasLivenessBackend,
+    'tflite': TFLiteLivenessBackend,
+    'onnx': OnnxLivenessBackend,
+}
+
+
+def get_liveness_model_path(backend_name):
+    """返回指定后端对应的模型文件路径"""
+    if backend_name == 'tflite':
+        return getattr(settings, 'LIVENESS_TFLITE_MODEL_PATH', None)
+    if backend_name == 'onnx':
+        return getattr(settings, 'LIVENESS_ONNX_MODEL_PATH', None)
+    return settings.LIVENESS_MODEL_PATH
+
+
+def create_liveness_backend(backend_name, model_path=None):
+    """创建指定的推理后端实例"""
+    backend_cls = LIVENESS_BACKENDS[backend_name]
+    model_path = model_path or get_liveness_model_path(backend_name)
+    if backend_name == 'keras':
+        return backend_cls(model_path)
+    return backend_cls(model_path, num_threads=getattr(settings, 'LIVENESS_INFERENCE_THREADS', None))
+
+
+def load_liveness_backend(backend_name=None):
+    """按 settings.LIVENESS_BACKEND 加载活体推理后端
+
+    导出的模型文件不存在或运行时缺失时回退到 Keras；全部失败返回 None。
+    """
+    backend_name = backend_name or getattr(settings, 'LIVENESS_BACKEND', 'keras')
+    if backend_name not in LIVENESS_BACKENDS:
+        print(f"⚠️ 未知的活体推理后端 {backend_name}，使用 keras")
+        backend_name = 'keras'
+
+    candidates = [backend_name] if backend_name == 'keras' else [backend_name, 'keras']
+    for name in candidates:
+        model_path = get_liveness_model_path(name)
+        if not model_path or not os.path.exists(model_path):
+            print(f"❌ 模型文件不存在: {model_path}")
+            continue
+        try:
+            backend = create_liveness_backend(name, model_path)
+            print(f"✅ 活体检测模型加载成功 [{name}]: {model_path}")
+            return backend
+        except Exception as e:
+            print(f"❌ 活体推理后端 {name} 加载失败: {e}")
+    return None
+
+
+class LivenessBatchScheduler:
+    """跨会话的动态微批处理调度器
+
+    请求线程调用 predict() 提交单张预处理后的人脸张量并阻塞等待；
+    后台线程在达到最大批大小或最长等待时间时一次性调用模型，
+    再把每一行结果交还给对应的请求。
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, timeout=10.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._batch_buffer = None
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'batches': 0,
+            'items': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'max_batch_size_seen': 0,
+            'last_batch_latency_ms': 0.0,
+            'total_batch_latency_ms': 0.0,
+            'total_queue_wait_ms': 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='liveness-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, tensor):
+        """提交一张 (H, W, C) 或 (1, H, W, C) 张量，返回 Future
+
+        样本在提交时拷贝：预处理复用每个线程的缓冲区，排队期间同一线程处理下一帧会覆盖它
+        """
+        self._ensure_started()
+        sample = np.array(tensor[0] if tensor.ndim == 4 else tensor, dtype=np.float32, copy=True)
+        future = Future()
+        self._queue.put((sample, future, time.perf_counter()))
+        return future
+
+    def predict(self, tensor):
+        """同步接口：返回该样本的一行模型输出"""
+        return self.submit(tensor).result(timeout=self.timeout)
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _stack(self, samples):
+        shape = (self.max_batch_size,) + samples[0].shape
+        if self._batch_buffer is None or self._batch_buffer.shape != shape:
+            self._batch_buffer = np.empty(shape, dtype=np.float32)
+        inputs = self._batch_buffer[:len(samples)]
+        for i, sample in enumerate(samples):
+            inputs[i] = sample
+        return inputs
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            samples = [item[0] for item in batch]
+            started = time.perf_counter()
+            try:
+                outputs = np.asarray(self.predict_fn(self._stack(samples)))
+                for (_, future, _), row in zip(batch, outputs):
+                    future.set_result(row)
+                failed = False
+            except Exception as e:
+                print(f"❌ 批量活体推理失败: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+            self._record(batch, started, failed)
+
+    def _record(self, batch, started, failed):
+        finished = time.perf_counter()
+        latency_ms = (finished - started) * 1000.0
+        queue_wait_ms = sum(started - item[2] for item in batch) * 1000.0
+        with self._metrics_lock:
+            m = self._metrics
+            m['batches'] += 1
+            m['items'] += len(batch)
+            m['errors'] += 1 if failed else 0
+            m['last_batch_size'] = len(batch)
+            m['max_batch_size_seen'] = max(m['max_batch_size_seen'], len(batch))
+            m['last_batch_latency_ms'] = latency_ms
+            m['total_batch_latency_ms'] += latency_ms
+            m['total_queue_wait_ms'] += queue_wait_ms
+
+    def get_metrics(self):
+        """返回批处理统计信息"""
+        with self._metrics_lock:
+            m = dict(self._metrics)
+        batches = m.pop('batches')
+        items = m.pop('items')
+        total_latency = m.pop('total_batch_latency_ms')
+        total_wait = m.pop('total_queue_wait_ms')
+        m.update({
+            'enabled': True,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': batches,
+            'items': items,
+            'avg_batch_size': items / batches if batches else 0.0,
+            'avg_batch_latency_ms': total_latency / batches if batches else 0.0,
+            'avg_queue_wait_ms': total_wait / items if items else 0.0,
+            'queue_depth': self._queue.qsize(),
+        })
+        return m
+
+
+def create_liveness_scheduler(predict_fn):
+    """按配置创建批处理调度器；未启用时返回 None"""
+    if not getattr(settings, 'LIVENESS_BATCHING_ENABLED', True):
+        return None
+    return LivenessBatchScheduler(
+        predict_fn,
+        max_batch_size=getattr(settings, 'LIVENESS_BATCH_MAX_SIZE', 16),
+        max_wait_ms=getattr(settings, 'LIVENESS_BATCH_MAX_WAIT_MS', 5),
+        timeout=getattr(settings, 'LIVENESS_BATCH_TIMEOUT', 10),
+    )
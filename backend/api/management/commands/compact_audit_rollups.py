@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import AuditLog, AuditLogRollup
+from api.rollup_utils import rebuild_rollups, prune_hourly_rollups, truncate_bucket
+
+
+class Command(BaseCommand):
+    help = ('按原始审计日志重建最近几天的小时/天统计 (纠正增量累计的偏差)，并删除过期的小时统计；'
+            '升级后首次使用 --all --include-today 为已有日志生成统计')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='重建最近多少个完整的天 (默认 7)')
+        parser.add_argument('--all', action='store_true', help='从最早的一条日志开始重建')
+        parser.add_argument('--include-today', action='store_true',
+                            help='同时重建今天 (今天的统计仍在增量累计，建议在低峰期使用)')
+        parser.add_argument('--hourly-retention-days', type=int,
+                            help='保留多少天的小时统计 (默认 AUDIT_ROLLUP_HOURLY_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        today = truncate_bucket(timezone.now(), AuditLogRollup.PERIOD_DAY)
+        end = today + timedelta(days=1) if options['include_today'] else today
+        start = today - timedelta(days=options['days'])
+        if options['all']:
+            first = AuditLog.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+            if first is not None:
+                start = min(start, truncate_bucket(first, AuditLogRollup.PERIOD_DAY))
+
+        if start < end:
+            rows = rebuild_rollups(start, end)
+            self.stdout.write(f"✅ 已重建 {timezone.localtime(start):%Y-%m-%d} 至 "
+                              f"{timezone.localtime(end - timedelta(days=1)):%Y-%m-%d} 的统计，共 {rows} 行")
+
+        retention = options['hourly_retention_days']
+        if retention is None:
+            retention = getattr(settings, 'AUDIT_ROLLUP_HOURLY_RETENTION_DAYS', 90)
+        if retention:
+            deleted = prune_hourly_rollups(today - timedelta(days=retention))
+            if deleted:
+                self.stdout.write(f"🧹 已删除 {retention} 天之前的小时统计 {deleted} 行")
@@ -0,0 +1,177 @@
+import os
+import time
+
+import numpy as np
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.detector_utils import detect_faces, largest_face
+from api.inference_utils import (
+    KerasLivenessBackend,
+    create_liveness_backend,
+    get_liveness_model_path,
+)
+from api.utils_recognition import prepare_liveness_input
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def load_image_tensors(folder, limit):
+    """读取目录 (递归) 中的图片，按线上推理相同的方式预处理为模型输入
+
+    LIVENESS_FACE_ROI 开启时 (默认) 先检测人脸、只用人脸区域，未检测到人脸的图片跳过，
+    否则校准和对比报告使用的输入与线上实际送入模型的输入不一致
+    """
+    face_roi = getattr(settings, 'LIVENESS_FACE_ROI', True)
+    tensors = []
+    skipped = 0
+    for root, _, files in os.walk(folder):
+        for filename in sorted(files):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(root, filename), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            box = None
+            if face_roi:
+                faces = detect_faces(image)
+                if len(faces) == 0:
+                    skipped += 1
+                    continue
+                box = largest_face(faces)
+            # 预处理结果写入每张图片自己的数组 (默认缓冲区会被下一张图片覆盖)
+            tensor = np.empty((1, 128, 128, 3), dtype=np.float32)
+            tensors.append(prepare_liveness_input(image, box, out=tensor))
+            if len(tensors) >= limit:
+                break
+        if len(tensors) >= limit:
+            break
+    if skipped:
+        print(f"⚠️ {folder}: {skipped} 张图片未检测到人脸，已跳过")
+    return tensors
+
+
+def measure_latency(backend, tensors, runs):
+    """单帧推理延迟 (毫秒)，返回 (p50, p95)"""
+    backend.predict(tensors[0])  # 预热
+    timings = []
+    for i in range(runs):
+        tensor = tensors[i % len(tensors)]
+        started = time.perf_counter()
+        backend.predict(tensor)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+
+class Command(BaseCommand):
+    help = '把 anandfinal.hdf5 导出为 TFLite / ONNX 轻量推理模型，可选 int8 训练后量化，并输出精度与延迟对比'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['tflite', 'onnx'], default='tflite', help='导出格式')
+        parser.add_argument('--output', help='输出路径 (默认使用 settings 中对应的模型路径)')
+        parser.add_argument('--int8', action='store_true', help='使用校准图片做 int8 训练后量化')
+        parser.add_argument('--calibration-dir', help='int8 量化使用的校准图片目录')
+        parser.add_argument('--eval-dir', help='对比报告使用的图片目录 (默认与校准目录相同)')
+        parser.add_argument('--max-images', type=int, default=200, help='每个目录最多读取的图片数')
+        parser.add_argument('--runs', type=int, default=100, help='延迟测试的推理次数')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        output = options['output'] or get_liveness_model_path(fmt)
+
+        if options['int8'] and not options['calibration_dir']:
+            raise CommandError('--int8 需要同时指定 --calibration-dir')
+
+        self.stdout.write(f"📦 加载 Keras 模型: {settings.LIVENESS_MODEL_PATH}")
+        keras_backend = KerasLivenessBackend(settings.LIVENESS_MODEL_PATH)
+
+        calibration = []
+        if options['calibration_dir']:
+            calibration = load_image_tensors(options['calibration_dir'], options['max_images'])
+            if not calibration:
+                raise CommandError(f"校准目录中没有可用图片: {options['calibration_dir']}")
+            self.stdout.write(f"🖼️ 校准图片: {len(calibration)} 张")
+
+        if fmt == 'tflite':
+            self.export_tflite(keras_backend.model, output, options['int8'], calibration)
+        else:
+            self.export_onnx(keras_backend.model, output, options['int8'], calibration)
+        self.stdout.write(self.style.SUCCESS(f"✅ 导出完成: {output}"))
+
+        eval_dir = options['eval_dir'] or options['calibration_dir']
+        tensors = load_image_tensors(eval_dir, options['max_images']) if eval_dir else []
+        if not tensors:
+            self.stdout.write("⚠️ 未提供评估图片，使用随机输入生成对比报告")
+            rng = np.random.default_rng(0)
+            tensors = [rng.random((1, 128, 128, 3), dtype=np.float32) for _ in range(32)]
+
+        exported_backend = create_liveness_backend(fmt, output)
+        self.report(keras_backend, exported_backend, tensors, options['runs'])
+
+    def export_tflite(self, model, output, int8, calibration):
+        import tensorflow as tf
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if int8:
+            def representative_dataset():
+                for tensor in calibration:
+                    yield [tensor]
+
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        with open(output, 'wb') as f:
+            f.write(converter.convert())
+
+    def export_onnx(self, model, output, int8, calibration):
+        import tensorflow as tf
+        try:
+            import tf2onnx
+        except ImportError:
+            raise CommandError('导出 ONNX 需要安装 tf2onnx: pip install tf2onnx')
+
+        spec = (tf.TensorSpec((None, 128, 128, 3), tf.float32, name='input'),)
+        float_output = output + '.float.onnx' if int8 else output
+        tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=float_output)
+
+        if int8:
+            from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+
+            class Reader(CalibrationDataReader):
+                def __init__(self):
+                    self.items = iter({'input': tensor} for tensor in calibration)
+
+                def get_next(self):
+                    return next(self.items, None)
+
+            quantize_static(float_output, output, Reader(),
+                            activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+            os.remove(float_output)
+
+    def report(self, keras_backend, exported_backend, tensors, runs):
+        threshold = 0.5
+        keras_scores = np.array([keras_backend.predict(t)[0][1] for t in tensors])
+        exported_scores = np.array([exported_backend.predict(t)[0][1] for t in tensors])
+        diff = np.abs(keras_scores - exported_scores)
+        agreement = np.mean((keras_scores >= threshold) == (exported_scores >= threshold))
+
+        keras_p50, keras_p95 = measure_latency(keras_backend, tensors, runs)
+        exported_p50, exported_p95 = measure_latency(exported_backend, tensors, runs)
+        keras_size = os.path.getsize(keras_backend.model_path) / 1024.0
+        exported_size = os.path.getsize(exported_backend.model_path) / 1024.0
+
+        self.stdout.write("-" * 60)
+        self.stdout.write(f"📊 对比报告 (样本数: {len(tensors)}, 判定阈值: {threshold})")
+        self.stdout.write(f"{'指标':<20}{'keras':>18}{exported_backend.name:>18}")
+        self.stdout.write(f"{'模型大小 (KB)':<20}{keras_size:>18.1f}{exported_size:>18.1f}")
+        self.stdout.write(f"{'单帧延迟 p50 (ms)':<20}{keras_p50:>18.2f}{exported_p50:>18.2f}")
+        self.stdout.write(f"{'单帧延迟 p95 (ms)':<20}{keras_p95:>18.2f}{exported_p95:>18.2f}")
+        self.stdout.write(f"{'平均真人分数':<20}{keras_scores.mean():>18.4f}{exported_scores.mean():>18.4f}")
+        self.stdout.write("-" * 60)
+        self.stdout.write(f"判定一致率: {agreement * 100:.2f}%")
+        self.stdout.write(f"真人分数差异: 平均 {diff.mean():.4f}, 最大 {diff.max():.4f}")
+        self.stdout.write("-" * 60)
@@ -0,0 +1,28 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from api.model_server import ModelServer, get_model_server_config
+
+
+class Command(BaseCommand):
+    help = '启动本机模型服务：推理进程持有活体模型和 DeepFace，Web 进程通过共享内存传递帧'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='推理进程数 (默认 RECOGNITION_MODEL_SERVER_WORKERS)')
+        parser.add_argument('--port', type=int, help='监听端口 (默认 RECOGNITION_MODEL_SERVER_ADDRESS 中的端口)')
+
+    def handle(self, *args, **options):
+        config = get_model_server_config()
+        if options['port']:
+            config['address'] = (config['address'][0], options['port'])
+        if not config['enabled']:
+            self.stdout.write("⚠️ RECOGNITION_MODEL_SERVER_ENABLED 未开启，Web 进程仍会在本进程内加载模型")
+
+        try:
+            server = ModelServer(config, workers=options['workers'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("⏹️ 模型服务已停止")
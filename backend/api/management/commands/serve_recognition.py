@@ -0,0 +1,209 @@
+import os
+import signal
+import socket
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 这些变量必须在导入 NumPy / TensorFlow 之前设置
+THREAD_ENV_VARS = ('OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+
+
+def plan_workers(cpu_count, workers=None, threads=None):
+    """按 CPU 核数决定工作进程数和每个进程的数学库线程数，返回 (进程数, 线程数)
+
+    默认每个进程 2 个线程：单帧推理的张量很小，线程再多收益有限，多开进程更能利用多核
+    """
+    cpu_count = max(1, cpu_count or 1)
+    if workers is None:
+        workers = max(1, cpu_count // (threads or 2))
+    if threads is None:
+        threads = max(1, cpu_count // workers)
+    return workers, threads
+
+
+def read_smaps_rollup(pid):
+    """读取 /proc/<pid>/smaps_rollup，返回以 KB 为单位的 rss/pss/私有/共享内存；不支持时返回 None"""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'unique': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+
+class Command(BaseCommand):
+    help = ('在主进程中加载 AI 模型并预热，然后 fork 出多个 WSGI/ASGI 工作进程，'
+            '只读的模型内存以写时复制方式在工作进程间共享')
+    # 系统检查会导入 URL 配置 (连带导入 NumPy)，放到设置线程数之后手动执行
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+        parser.add_argument('--port', type=int, default=8000, help='监听端口')
+        parser.add_argument('--workers', type=int, help='工作进程数 (默认按 CPU 核数计算)')
+        parser.add_argument('--threads', type=int, help='每个进程的数学库线程数 (默认按 CPU 核数计算)')
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'], default='wsgi',
+                            help='wsgi 使用 Django 内置的多线程服务器；asgi 需要安装 uvicorn')
+        parser.add_argument('--report-delay', type=float, default=3.0,
+                            help='启动后等待多少秒再报告各进程的内存占用')
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('serve_recognition 依赖 os.fork，当前平台不支持；请使用 runserver 或 uvicorn')
+
+        workers, threads = plan_workers(os.cpu_count(), options['workers'], options['threads'])
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(threads)
+        if getattr(settings, 'LIVENESS_INFERENCE_THREADS', None) is None:
+            settings.LIVENESS_INFERENCE_THREADS = threads
+        if 'numpy' in sys.modules:
+            self.stdout.write("⚠️ NumPy 已在设置线程数之前导入，OPENBLAS/MKL 线程数可能不会生效")
+        self.stdout.write(f"📝 CPU 核数 {os.cpu_count()}: {workers} 个工作进程，每个进程 {threads} 个数学库线程")
+        self.check(display_num_errors=True)
+
+        if workers > 1 and getattr(settings, 'RECOGNITION_SESSION_BACKEND', 'memory') == 'memory':
+            self.stdout.write("⚠️ 识别会话存储为 memory，多个工作进程之间不共享会话；"
+                              "请设置 RECOGNITION_SESSION_BACKEND=sqlite 或 redis")
+
+        application = self.preload(options['interface'])
+        sock = self.bind(options['host'], options['port'])
+
+        # 主进程不持有数据库连接，避免工作进程共用同一个连接
+        from django.db import connections
+        connections.close_all()
+
+        self.children = {}
+        self.stopping = False
+        for index in range(workers):
+            self.spawn(index, sock, application, options['interface'])
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.stdout.write(self.style.SUCCESS(
+            f"🚀 服务已启动: http://{options['host']}:{options['port']} ({options['interface']}, {workers} 个工作进程)"))
+
+        time.sleep(options['report_delay'])
+        self.report_memory()
+        self.supervise(sock, application, options['interface'])
+
+    def preload(self, interface):
+        """导入 Django 应用并在主进程中加载、预热全部模型"""
+        from api.model_manager import get_model_manager
+
+        models = get_model_manager()
+        if models.remote:
+            self.stdout.write("⚠️ 已开启模型服务模式，模型由推理进程持有，主进程不加载模型")
+        started = time.perf_counter()
+        models.warm_up()
+        liveness = models.liveness
+        if liveness is not None and liveness.name == 'keras':
+            self.stdout.write("⚠️ Keras 后端的 TensorFlow 运行时不保证 fork 安全，推荐导出为 tflite/onnx 后使用本命令")
+        self.stdout.write(f"✅ 主进程模型加载和预热完成，耗时 {time.perf_counter() - started:.2f} 秒")
+
+        if interface == 'asgi':
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('asgi 模式需要安装 uvicorn: pip install uvicorn')
+            from co_system_project.asgi import application
+        else:
+            from co_system_project.wsgi import application
+        # 导入全部视图和 URL 配置，工作进程中不再重复导入
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+        return application
+
+    def bind(self, host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(128)
+        sock.set_inheritable(True)
+        return sock
+
+    def spawn(self, index, sock, application, interface):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            return pid
+        # 工作进程
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            if interface == 'asgi':
+                self.serve_asgi(sock, application)
+            else:
+                self.serve_wsgi(sock, application)
+        finally:
+            os._exit(0)
+
+    def serve_wsgi(self, sock, application):
+        from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+        server = ThreadedWSGIServer(sock.getsockname(), WSGIRequestHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = sock
+        host, port = sock.getsockname()[:2]
+        server.server_address = (host, port)
+        server.server_name = socket.getfqdn(host)
+        server.server_port = port
+        server.setup_environ()
+        server.set_app(application)
+        server.serve_forever()
+
+    def serve_asgi(self, sock, application):
+        import uvicorn
+
+        server = uvicorn.Server(uvicorn.Config(application, lifespan='off'))
+        server.run(sockets=[sock])
+
+    def report_memory(self):
+        """报告各进程独占 (私有页) 与共享 (写时复制的模型页等) 的内存"""
+        pids = [os.getpid()] + sorted(self.children)
+        rows = [(pid, read_smaps_rollup(pid)) for pid in pids]
+        if all(memory is None for _, memory in rows):
+            self.stdout.write("⚠️ 当前系统没有 /proc/<pid>/smaps_rollup，无法报告内存占用")
+            return
+        self.stdout.write("📝 进程内存 (MB):   进程          RSS      PSS     独占     共享")
+        for pid, memory in rows:
+            if memory is None:
+                continue
+            role = '主进程' if pid == os.getpid() else f'工作进程{self.children[pid]}'
+            self.stdout.write(f"    {role:<10} {pid:>7} {memory['rss'] / 1024:>8.1f} {memory['pss'] / 1024:>8.1f} "
+                              f"{memory['unique'] / 1024:>8.1f} {memory['shared'] / 1024:>8.1f}")
+
+    def supervise(self, sock, application, interface):
+        """等待工作进程退出；非正常退出的进程从主进程重新 fork (仍然共享已加载的模型)"""
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            self.stdout.write(f"⚠️ 工作进程 {index} (pid {pid}) 已退出，状态 {status}，重新启动")
+            self.spawn(index, sock, application, interface)
+        sock.close()
+        self.stdout.write("⏹️ 服务已停止")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0002_auditlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', '小时'), ('day', '天')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('action', models.CharField(max_length=100)),
+                ('liveness_status', models.CharField(blank=True, default='', max_length=50)),
+                ('compare_result', models.CharField(blank=True, default='', max_length=50)),
+                ('score_bin', models.SmallIntegerField(default=-1)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0.0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='auditlogrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'action', 'liveness_status', 'compare_result', 'user', 'score_bin'), name='auditlog_rollup_unique_key'),
+        ),
+    ]
@@ -0,0 +1,459 @@
+# model_manager.py
+# AI 模型的延迟加载：导入 api 模块时不加载 TensorFlow / DeepFace / 活体模型，
+# 首次使用时才加载；runserver 和 ASGI/WSGI 工作进程启动时在后台线程中预热，
+# migrate / shell / check 等管理命令完全不会触碰 TensorFlow
+
+import importlib.util
+import threading
+import time
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .detector_utils import OPENCV_AVAILABLE, warm_up_face_detector
+from .inference_utils import (
+    LIVENESS_INPUT_SIZE,
+    load_liveness_backend,
+    create_liveness_backend,
+    create_liveness_scheduler
+)
+from .model_registry import (
+    LIVENESS,
+    EMBEDDING,
+    MODEL_KINDS,
+    DEFAULT_VERSION,
+    read_manifest,
+    verify_manifest_files,
+    initial_version,
+    read_active_versions,
+    write_active_versions
+)
+from .model_server import get_model_server_client, RemoteLivenessBackend, ModelServerUnavailable
+
+# 只检查是否安装，不导入 (导入 DeepFace 会连带导入 TensorFlow)
+DEEPFACE_INSTALLED = importlib.util.find_spec('deepface') is not None
+TENSORFLOW_INSTALLED = importlib.util.find_spec('tensorflow') is not None
+
+# 模型服务暂时不可用时，间隔该秒数后再尝试连接
+REMOTE_RETRY_INTERVAL = 5.0
+
+
+class ModelVersionUnavailable(RuntimeError):
+    """会话固定的模型版本无法加载 (如已从注册表删除)，不能改用其他版本打分"""
+
+
+class ModelManager:
+    """持有活体检测模型 (可同时加载多个版本) 和批处理调度器，首次访问时加载 (线程安全)
+
+    新版本在后台加载、预热后原子切换；进行中的会话固定使用创建时的版本，
+    旧版本在最后一次使用的会话过期时间之后才卸载，已卸载的版本再被使用时重新加载。模型服务模式 (RECOGNITION_MODEL_SERVER_ENABLED)
+    下不在本进程加载模型，活体推理和特征提取都转发给 run_model_server 启动的推理进程
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._liveness_versions = {}  # 版本 -> {'backend', 'scheduler', 'manifest', 'warm_up_ms', 'loaded_at', 'retire_at'}
+        self._embedding_manifests = {}  # 版本 -> 清单
+        self._active = {}  # 类型 -> 当前版本
+        self._loading = {}  # 类型 -> 最近一次切换的状态
+        self._next_poll = 0.0
+        self._retry_at = 0.0
+        self._remote_embedding = False
+        self._remote_info = None
+        self._warm_up_thread = None
+        self.warm_up_state = 'idle'  # idle / warming / ready / failed
+        self.warm_up_seconds = None
+
+    # ---------- 活体模型 ----------
+
+    def _initial_manifest(self, kind):
+        version = initial_version(kind)
+        try:
+            return read_manifest(kind, version)
+        except ValueError as e:
+            print(f"❌ {e}，使用默认模型配置")
+            self._loading[kind] = {'version': version, 'state': 'failed', 'error': str(e)}
+            return read_manifest(kind, DEFAULT_VERSION)
+
+    def _build_liveness(self, manifest):
+        if manifest['version'] == DEFAULT_VERSION:
+            return load_liveness_backend()
+        verify_manifest_files(manifest)
+        backend = create_liveness_backend(manifest['backend'], manifest['path'])
+        print(f"✅ 活体检测模型加载成功 [{manifest['backend']}]: {manifest['version']}")
+        return backend
+
+    def _warm_up_liveness(self, backend, runs=3):
+        """空输入推理若干次，返回预热后的单次推理耗时 (毫秒)"""
+        width, height = LIVENESS_INPUT_SIZE
+        blank = np.zeros((1, height, width, 3), dtype=np.float32)
+        backend.predict(blank)
+        started = time.perf_counter()
+        for _ in range(runs):
+            backend.predict(blank)
+        return (time.perf_counter() - started) * 1000.0 / runs
+
+    def _install_liveness(self, manifest, backend, warm_up_ms=None):
+        self._liveness_versions[manifest['version']] = {
+            'backend': backend,
+            'scheduler': create_liveness_scheduler(backend.predict),
+            'manifest': manifest,
+            'warm_up_ms': warm_up_ms,
+            'loaded_at': time.time(),
+            'retire_at': None,
+        }
+
+    def _load(self):
+        with self._lock:
+            if self._loaded or time.monotonic() < self._retry_at:
+                return
+            client = get_model_server_client()
+            if client is not None:
+                try:
+                    info = client.ping()
+                except ModelServerUnavailable as e:
+                    print(f"⚠️ {e}")
+                    info = None
+                if info is None:
+                    # 模型服务未启动或仍在加载模型，稍后重试
+                    self._retry_at = time.monotonic() + REMOTE_RETRY_INTERVAL
+                    return
+                self._remote_info = info
+                self._remote_embedding = bool(info.get('embedding_available'))
+                manifest = self._remote_manifest(info.get('liveness_version') or DEFAULT_VERSION)
+                backend = RemoteLivenessBackend(client, info, manifest['version'])
+                print(f"✅ 使用模型服务: {backend.name} 版本 {manifest['version']} (pid {info.get('pid')})")
+            else:
+                manifest = self._initial_manifest(LIVENESS)
+                started = time.perf_counter()
+                try:
+                    backend = self._build_liveness(manifest)
+                except Exception as e:
+                    print(f"❌ 活体检测模型 {manifest['version']} 加载失败: {e}")
+                    self._loading[LIVENESS] = {'version': manifest['version'], 'state': 'failed', 'error': str(e)}
+                    backend = None
+                    if manifest['version'] != DEFAULT_VERSION:
+                        manifest = read_manifest(LIVENESS, DEFAULT_VERSION)
+                        backend = self._build_liveness(manifest)
+                if backend is not None:
+                    print(f"📝 活体检测模型加载耗时 {time.perf_counter() - started:.2f} 秒")
+            if backend is not None:
+                self._install_liveness(manifest, backend)
+            self._active[LIVENESS] = manifest['version']
+            self._loaded = True
+
+    def _remote_manifest(self, version):
+        """模型服务模式下某个活体模型版本的清单 (只读取阈值，模型由推理进程加载)"""
+        try:
+            return read_manifest(LIVENESS, version)
+        except ValueError:
+            return dict(read_manifest(LIVENESS, DEFAULT_VERSION), version=version)
+
+    def _load_pinned(self, version):
+        """加载会话固定、但本进程尚未加载或已卸载的旧版本；无法加载时抛出 ModelVersionUnavailable"""
+        with self._lock:
+            entry = self._liveness_versions.get(version)
+            if entry is not None:
+                return entry
+            try:
+                manifest = read_manifest(LIVENESS, version)
+                backend = self._build_liveness(manifest)
+                if backend is None:
+                    raise RuntimeError('活体检测模型加载失败')
+            except Exception as e:
+                raise ModelVersionUnavailable(f'会话固定的活体检测模型版本 {version} 不可用: {e}')
+            self._install_liveness(manifest, backend)
+            print(f"🔄 为进行中的会话重新加载活体检测模型版本 {version}")
+            return self._liveness_versions[version]
+
+    def _entry(self, version=None):
+        """返回指定版本的活体模型；未指定时返回当前版本
+
+        会话固定的版本尚未加载或已卸载时重新加载，无法加载时抛出 ModelVersionUnavailable，
+        不会改用其他版本；模型服务模式下版本随请求发给推理进程，由推理进程加载
+        """
+        if not self._loaded:
+            self._load()
+        else:
+            self._poll_registry()
+        entry = self._liveness_versions.get(version) if version else None
+        if entry is None and version and self._remote_info is not None:
+            with self._lock:
+                entry = self._liveness_versions.get(version)
+                if entry is None:
+                    manifest = self._remote_manifest(version)
+                    self._install_liveness(manifest, RemoteLivenessBackend(
+                        get_model_server_client(), self._remote_info, version))
+                    entry = self._liveness_versions[version]
+        elif entry is None and version and self._loaded and self._active.get(LIVENESS) != version:
+            entry = self._load_pinned(version)
+        if entry is not None and version and version != self._active.get(LIVENESS):
+            # 旧版本在最后一次使用的会话过期后才卸载
+            entry['retire_at'] = time.time() + getattr(settings, 'RECOGNITION_SESSION_TTL', 1800)
+        return entry or self._liveness_versions.get(self._active.get(LIVENESS))
+
+    @property
+    def liveness(self):
+        """当前版本的活体推理后端 (首次访问时加载)；模型不可用时为 None"""
+        entry = self._entry()
+        return entry['backend'] if entry else None
+
+    @property
+    def scheduler(self):
+        """当前版本的批处理调度器；未启用批处理或模型不可用时为 None"""
+        entry = self._entry()
+        return entry['scheduler'] if entry else None
+
+    @property
+    def model_loaded(self):
+        return self.liveness is not None
+
+    @property
+    def remote(self):
+        return get_model_server_client() is not None
+
+    @property
+    def deepface_available(self):
+        """能否计算人脸特征：本地已安装 DeepFace，或模型服务的推理进程可以计算"""
+        if self.remote:
+            return self.model_loaded and self._remote_embedding
+        return DEEPFACE_INSTALLED
+
+    def liveness_manifest(self, version=None):
+        entry = self._entry(version)
+        return entry['manifest'] if entry else read_manifest(LIVENESS, DEFAULT_VERSION)
+
+    def predict_liveness(self, face_tensor, version=None):
+        """对单张预处理后的人脸张量做活体推理，返回模型输出的一行 [假, 真]
+
+        version 为会话固定的模型版本，无法加载时抛出 ModelVersionUnavailable
+        """
+        entry = self._entry(version)
+        if entry['scheduler'] is not None:
+            return entry['scheduler'].predict(face_tensor)
+        return entry['backend'].predict(face_tensor)[0]
+
+    def predict_liveness_batch(self, batch, version=None):
+        """对 (N, 128, 128, 3) 的批次做一次活体推理"""
+        return self._entry(version)['backend'].predict(batch)
+
+    # ---------- 人脸特征模型 ----------
+
+    def embedding_manifest(self, version=None):
+        """人脸特征模型的清单；version 为会话固定的版本，读取失败时使用当前版本"""
+        with self._lock:
+            if EMBEDDING not in self._active:
+                manifest = self._initial_manifest(EMBEDDING)
+                self._embedding_manifests[manifest['version']] = manifest
+                self._active[EMBEDDING] = manifest['version']
+            if version and version not in self._embedding_manifests:
+                try:
+                    self._embedding_manifests[version] = read_manifest(EMBEDDING, version)
+                except ValueError as e:
+                    print(f"⚠️ {e}")
+                    version = None
+            return self._embedding_manifests[version or self._active[EMBEDDING]]
+
+    def _warm_up_embedding(self, manifest):
+        if not DEEPFACE_INSTALLED:
+            return None
+        from .embedding_utils import compute_embedding, embedding_config_from_manifest
+        config = embedding_config_from_manifest(manifest)
+        blank = np.zeros((160, 160, 3), dtype=np.uint8)
+        compute_embedding(blank, config)
+        started = time.perf_counter()
+        compute_embedding(blank, config)
+        return (time.perf_counter() - started) * 1000.0
+
+    # ---------- 版本切换 ----------
+
+    def active_versions(self):
+        """当前生效的版本 {类型: 版本}，新会话据此固定模型版本"""
+        self._entry()
+        self.embedding_manifest()
+        with self._lock:
+            return dict(self._active)
+
+    def activate(self, kind, version):
+        """在后台加载并预热指定版本，完成后原子切换；清单无效或已有版本在加载时抛出 ValueError"""
+        if self.remote:
+            raise ValueError('模型服务模式下请在推理进程中切换模型版本')
+        manifest = read_manifest(kind, version)
+        self._entry()
+        with self._lock:
+            if self._loading.get(kind, {}).get('state') == 'loading':
+                raise ValueError(f"{kind} 模型正在加载版本 {self._loading[kind]['version']}")
+            self._loading[kind] = {'version': version, 'state': 'loading', 'started_at': time.time(), 'error': None}
+        threading.Thread(target=self._load_and_swap, args=(kind, manifest),
+                         name=f'model-load-{kind}', daemon=True).start()
+        print(f"🔄 后台加载 {kind} 模型版本 {version}")
+
+    def _load_and_swap(self, kind, manifest):
+        version = manifest['version']
+        started = time.perf_counter()
+        try:
+            if kind == LIVENESS:
+                backend = self._build_liveness(manifest)
+                if backend is None:
+                    raise RuntimeError('活体检测模型加载失败')
+                warm_up_ms = self._warm_up_liveness(backend)
+                with self._lock:
+                    self._install_liveness(manifest, backend, warm_up_ms)
+                    previous = self._active.get(LIVENESS)
+                    self._active[LIVENESS] = version
+                    self._retire(previous, version)
+            else:
+                verify_manifest_files(manifest)
+                warm_up_ms = self._warm_up_embedding(manifest)
+                manifest = dict(manifest, warm_up_ms=warm_up_ms)
+                self._rebuild_embedding_index(manifest)
+                self.embedding_manifest()
+                with self._lock:
+                    self._embedding_manifests[version] = manifest
+                    self._active[EMBEDDING] = version
+            with self._lock:
+                write_active_versions(dict(self._active))
+                self._loading[kind].update(state='ready', warm_up_ms=warm_up_ms,
+                                           load_seconds=round(time.perf_counter() - started, 3))
+            print(f"✅ {kind} 模型已切换到版本 {version}" +
+                  (f"，预热后单次推理 {warm_up_ms:.1f} ms" if warm_up_ms is not None else ''))
+        except Exception as e:
+            with self._lock:
+                self._loading[kind].update(state='failed', error=str(e))
+            print(f"❌ {kind} 模型版本 {version} 加载失败: {e}")
+
+    def _rebuild_embedding_index(self, manifest):
+        """切换特征模型前用新版本重建 1:N 检索索引 (其他进程已重建时跳过)，旧模型的特征不能与新模型比较"""
+        from .embedding_utils import embedding_config_from_manifest
+        from .index_utils import get_embedding_index
+        config = embedding_config_from_manifest(manifest)
+        index = get_embedding_index()
+        if not index.matches(config):
+            index.rebuild(config=config, compute_missing=True)
+
+    def _retire(self, version, active):
+        """旧版本在会话过期时间之后卸载 (每次使用都会顺延)，使用它的会话可以继续完成"""
+        entry = self._liveness_versions.get(version)
+        if entry is not None and version != active:
+            entry['retire_at'] = time.time() + getattr(settings, 'RECOGNITION_SESSION_TTL', 1800)
+        now = time.time()
+        for old_version, old_entry in list(self._liveness_versions.items()):
+            if old_version != active and old_entry['retire_at'] and old_entry['retire_at'] <= now:
+                del self._liveness_versions[old_version]
+                print(f"🧹 已卸载活体检测模型版本 {old_version}")
+
+    def _poll_registry(self):
+        """定期检查 active.json：其他进程切换版本后，本进程也在后台加载同一版本"""
+        now = time.monotonic()
+        if now < self._next_poll or self.remote:
+            return
+        self._next_poll = now + getattr(settings, 'MODEL_REGISTRY_POLL_INTERVAL', 10)
+        with self._lock:
+            self._retire(None, self._active.get(LIVENESS))
+        for kind, version in read_active_versions().items():
+            if kind not in MODEL_KINDS or version == self._active.get(kind, version):
+                continue
+            state = self._loading.get(kind, {})
+            if state.get('version') == version and state.get('state') in ('loading', 'failed'):
+                continue
+            try:
+                self.activate(kind, version)
+            except ValueError as e:
+                self._loading[kind] = {'version': version, 'state': 'failed', 'error': str(e)}
+                print(f"⚠️ {e}")
+
+    # ---------- 预热与状态 ----------
+
+    def warm_up(self):
+        """加载并预热全部模型：人脸检测器、活体模型 (空输入推理一次) 和人脸特征模型"""
+        self.warm_up_state = 'warming'
+        started = time.perf_counter()
+        try:
+            if OPENCV_AVAILABLE:
+                warm_up_face_detector()
+            entry = self._entry()
+            if entry is not None and not self.remote:
+                entry['warm_up_ms'] = self._warm_up_liveness(entry['backend'], runs=1)
+            if (not self.remote and DEEPFACE_INSTALLED
+                    and getattr(settings, 'RECOGNITION_WARM_UP_EMBEDDING', True)):
+                manifest = self.embedding_manifest()
+                manifest['warm_up_ms'] = self._warm_up_embedding(manifest)
+            self.warm_up_state = 'ready'
+        except Exception as e:
+            self.warm_up_state = 'failed'
+            print(f"❌ 模型预热失败: {e}")
+        self.warm_up_seconds = time.perf_counter() - started
+        if self.warm_up_state == 'ready':
+            print(f"✅ 模型预热完成，耗时 {self.warm_up_seconds:.2f} 秒")
+
+    def start_background_warm_up(self):
+        """在后台线程中预热 (重复调用只启动一次)，服务进程可以先开始接受连接
+
+        已经预热过时 (如 serve_recognition 在主进程预热后 fork 出的工作进程) 直接返回
+        """
+        with self._lock:
+            if self.warm_up_state == 'ready':
+                return None
+            if self._warm_up_thread is not None:
+                return self._warm_up_thread
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name='model-warm-up', daemon=True)
+            self._warm_up_thread.start()
+        print("🔄 模型在后台预热中...")
+        return self._warm_up_thread
+
+    def versions_status(self):
+        """各类模型的当前版本、已加载版本 (含预热耗时) 和正在加载的版本 (不会触发加载)"""
+        with self._lock:
+            liveness = [{
+                'version': version,
+                'backend': entry['backend'].name,
+                'warm_up_ms': round(entry['warm_up_ms'], 2) if entry['warm_up_ms'] is not None else None,
+                'retiring': entry['retire_at'] is not None,
+            } for version, entry in self._liveness_versions.items()]
+            embedding = [{
+                'version': version,
+                'model_name': manifest['model_name'],
+                'warm_up_ms': round(manifest['warm_up_ms'], 2) if manifest.get('warm_up_ms') is not None else None,
+            } for version, manifest in self._embedding_manifests.items()]
+            return {
+                LIVENESS: {'active': self._active.get(LIVENESS), 'loaded': liveness,
+                           'loading': dict(self._loading[LIVENESS]) if LIVENESS in self._loading else None},
+                EMBEDDING: {'active': self._active.get(EMBEDDING), 'loaded': embedding,
+                            'loading': dict(self._loading[EMBEDDING]) if EMBEDDING in self._loading else None},
+            }
+
+    def status(self):
+        """当前加载状态 (不会触发加载)"""
+        client = get_model_server_client()
+        entry = self._liveness_versions.get(self._active.get(LIVENESS))
+        return {
+            'loaded': self._loaded,
+            'liveness_backend': entry['backend'].name if entry else None,
+            'warm_up_state': self.warm_up_state,
+            'warm_up_seconds': round(self.warm_up_seconds, 3) if self.warm_up_seconds is not None else None,
+            'model_server': client.get_metrics() if client is not None else None,
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_model_manager():
+    """获取进程内唯一的模型管理器 (创建时不加载任何模型)"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ModelManager()
+    return _manager
+
+
+def warm_up_on_start():
+    """服务进程启动时调用：按 RECOGNITION_WARM_UP_ON_START 在后台预热模型"""
+    if getattr(settings, 'RECOGNITION_WARM_UP_ON_START', True):
+        get_model_manager().start_background_warm_up()
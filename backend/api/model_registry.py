@@ -0,0 +1,154 @@
+# model_registry.py
+# 版本化的模型注册表：每个版本一个目录，manifest.json 记录后端、输入尺寸、阈值和校验和
+#
+# model_registry/
+#   liveness/<版本>/manifest.json   {"backend": "tflite", "file": "liveness.tflite", "sha256": "...",
+#                                    "input_size": [128, 128], "thresholds": {"live": 0.6}}
+#   embedding/<版本>/manifest.json  {"model_name": "Facenet", "embedding_version": "2",
+#                                    "thresholds": {"match": 0.40, "distance_metric": "cosine"}}
+#   active.json                     当前生效的版本，重启后沿用
+#
+# 注册表为空时使用 settings 中的模型配置，版本名为 default
+
+import hashlib
+import json
+import os
+from django.conf import settings
+
+from .inference_utils import LIVENESS_BACKENDS, LIVENESS_INPUT_SIZE
+
+LIVENESS = 'liveness'
+EMBEDDING = 'embedding'
+MODEL_KINDS = (LIVENESS, EMBEDDING)
+DEFAULT_VERSION = 'default'
+
+MANIFEST_FILE = 'manifest.json'
+ACTIVE_FILE = 'active.json'
+
+
+def get_registry_path():
+    return getattr(settings, 'MODEL_REGISTRY_PATH', None) or os.path.join(settings.BASE_DIR, 'model_registry')
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """计算文件的 SHA-256 (分块读取，模型文件可能很大)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_manifest(kind):
+    """注册表中没有该类模型时，按 settings 生成的默认清单"""
+    if kind == LIVENESS:
+        return {
+            'kind': LIVENESS,
+            'version': DEFAULT_VERSION,
+            'backend': getattr(settings, 'LIVENESS_BACKEND', 'keras'),
+            'path': None,
+            'sha256': None,
+            'input_size': list(LIVENESS_INPUT_SIZE),
+            'thresholds': {'live': 0.6},
+        }
+    return {
+        'kind': EMBEDDING,
+        'version': DEFAULT_VERSION,
+        'model_name': getattr(settings, 'FACE_MODEL_NAME', 'Facenet'),
+        'embedding_version': getattr(settings, 'FACE_EMBEDDING_VERSION', '1'),
+        'path': None,
+        'sha256': None,
+        'input_size': [160, 160],
+        'thresholds': {
+            'match': getattr(settings, 'FACE_MATCH_THRESHOLD', 0.40),
+            'distance_metric': getattr(settings, 'FACE_DISTANCE_METRIC', 'cosine'),
+        },
+    }
+
+
+def read_manifest(kind, version):
+    """读取并校验某个版本的清单；版本不存在或清单无效时抛出 ValueError"""
+    if kind not in MODEL_KINDS:
+        raise ValueError(f'未知的模型类型: {kind}')
+    if version == DEFAULT_VERSION:
+        return default_manifest(kind)
+    if not version or os.sep in version or version.startswith('.'):
+        raise ValueError(f'无效的版本名: {version}')
+
+    version_dir = os.path.join(get_registry_path(), kind, version)
+    manifest_path = os.path.join(version_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f'模型版本不存在: {kind}/{version}')
+    except json.JSONDecodeError as e:
+        raise ValueError(f'清单格式错误 {manifest_path}: {e}')
+
+    manifest = default_manifest(kind)
+    manifest.update({key: value for key, value in data.items() if key != 'thresholds'})
+    manifest['thresholds'].update(data.get('thresholds') or {})
+    manifest['kind'] = kind
+    manifest['version'] = version
+    manifest['path'] = os.path.join(version_dir, data['file']) if data.get('file') else None
+
+    if kind == LIVENESS:
+        if manifest['backend'] not in LIVENESS_BACKENDS:
+            raise ValueError(f"不支持的活体推理后端: {manifest['backend']}")
+        if not manifest['path']:
+            raise ValueError(f'活体模型清单缺少 file 字段: {manifest_path}')
+        if tuple(manifest['input_size']) != LIVENESS_INPUT_SIZE:
+            raise ValueError(f"输入尺寸 {manifest['input_size']} 与预处理尺寸 {list(LIVENESS_INPUT_SIZE)} 不一致")
+    return manifest
+
+
+def verify_manifest_files(manifest):
+    """检查模型文件存在且校验和一致 (清单未记录 sha256 时只检查存在)"""
+    path = manifest.get('path')
+    if not path:
+        return
+    if not os.path.exists(path):
+        raise ValueError(f'模型文件不存在: {path}')
+    expected = manifest.get('sha256')
+    if expected:
+        actual = file_sha256(path)
+        if actual.lower() != expected.lower():
+            raise ValueError(f'模型文件校验和不一致: {path} (期望 {expected}, 实际 {actual})')
+
+
+def list_versions(kind):
+    """列出注册表中某类模型的全部版本 (按名称排序)"""
+    kind_dir = os.path.join(get_registry_path(), kind)
+    try:
+        names = sorted(os.listdir(kind_dir))
+    except OSError:
+        return []
+    return [name for name in names if os.path.isfile(os.path.join(kind_dir, name, MANIFEST_FILE))]
+
+
+def read_active_versions():
+    """读取已生效的版本 {类型: 版本}；文件不存在时为空"""
+    try:
+        with open(os.path.join(get_registry_path(), ACTIVE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def write_active_versions(versions):
+    """保存生效的版本 (先写临时文件再原子替换)"""
+    registry_path = get_registry_path()
+    os.makedirs(registry_path, exist_ok=True)
+    path = os.path.join(registry_path, ACTIVE_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(versions, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def initial_version(kind):
+    """进程启动时使用的版本：active.json > settings 指定 > default"""
+    version = read_active_versions().get(kind)
+    if not version:
+        version = getattr(settings, f'MODEL_REGISTRY_{kind.upper()}_VERSION', None)
+    return version or DEFAULT_VERSION
@@ -0,0 +1,499 @@
+# model_server.py
+# 模型服务模式：由少量本机推理进程持有 TensorFlow / 活体模型 / DeepFace，
+# Web 进程不再各自加载模型，只把解码后的帧写入共享内存环形缓冲区，通过本地连接取回分数和特征向量
+#
+# 启动: python manage.py run_model_server   (settings.RECOGNITION_MODEL_SERVER_ENABLED = True)
+# 请求: (操作, 数据描述, 模型版本)，模型版本为会话固定的注册表版本 (None 为推理进程的当前版本)，数据描述为 ('shm', 共享内存名, 偏移, 形状, dtype) / ('inline', 数组) / ('path', 图片路径)
+#       图片路径只允许 FACES_DATABASE_PATH 下的身份照片
+# 连接用 RECOGNITION_MODEL_SERVER_AUTHKEY 认证 (请求经 pickle 传递)，未配置时客户端和服务都拒绝启动
+# 响应: ('ok', 结果) 或 ('error', 错误信息)
+
+import atexit
+import itertools
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OP_PING = 'ping'
+OP_LIVENESS = 'liveness'
+OP_EMBEDDING = 'embedding'
+
+# 推理进程中为 True：进程内直接使用本地模型
+_server_process = False
+
+
+def get_model_server_config():
+    """读取模型服务配置 (未配置 RECOGNITION_MODEL_SERVER_AUTHKEY 时 authkey 为 None)"""
+    authkey = getattr(settings, 'RECOGNITION_MODEL_SERVER_AUTHKEY', None) or None
+    return {
+        'enabled': getattr(settings, 'RECOGNITION_MODEL_SERVER_ENABLED', False),
+        'address': tuple(getattr(settings, 'RECOGNITION_MODEL_SERVER_ADDRESS', ('127.0.0.1', 8765))),
+        'authkey': authkey.encode('utf-8') if isinstance(authkey, str) else authkey,
+        'workers': getattr(settings, 'RECOGNITION_MODEL_SERVER_WORKERS', 2),
+        'ring_slots': getattr(settings, 'RECOGNITION_MODEL_SERVER_RING_SLOTS', 8),
+        'slot_bytes': getattr(settings, 'RECOGNITION_MODEL_SERVER_SLOT_BYTES', 4 * 1024 * 1024),
+        'timeout': getattr(settings, 'RECOGNITION_MODEL_SERVER_TIMEOUT', 10),
+        'queue_size': getattr(settings, 'RECOGNITION_MODEL_SERVER_QUEUE_SIZE', 64),
+    }
+
+
+def _require_authkey(config):
+    """连接上传递的是 pickle 数据，认证密钥泄露即可在推理进程中执行任意代码，
+    因此必须单独配置，不能退回到写在 settings 中的 SECRET_KEY
+    """
+    if not config.get('authkey'):
+        raise ImproperlyConfigured('模型服务需要设置环境变量 RECOGNITION_MODEL_SERVER_AUTHKEY (随机生成的密钥)')
+
+
+def _attach_shared_memory(name):
+    """附加到其他进程创建的共享内存，且不让本进程的 resource_tracker 在退出时删除它"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedFrameRing:
+    """Web 进程一侧的共享内存环形缓冲区：slots 个固定大小的槽位按顺序轮流使用
+
+    槽位在推理进程返回结果前一直被占用 (包括客户端已超时的请求)，推理进程可以直接在共享内存上读取数据而不拷贝
+    """
+
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free = queue.Queue()
+        for index in range(slots):
+            self._free.put(index)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self, timeout=None):
+        """取得一个空闲槽位；全部占用时等待，超时抛出 queue.Empty"""
+        return self._free.get(timeout=timeout)
+
+    def release(self, index):
+        self._free.put(index)
+
+    def write(self, index, array):
+        """把数组写入槽位，返回推理进程读取所需的数据描述"""
+        offset = index * self.slot_bytes
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, offset=offset)
+        view[...] = array
+        return ('shm', self.shm.name, offset, array.shape, array.dtype.str)
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ModelServerUnavailable(Exception):
+    """无法连接模型服务或模型服务尚未就绪"""
+
+
+class ModelServerClient:
+    """Web 进程中的模型服务客户端 (线程安全：每个线程一条连接，槽位由环形缓冲区分配)"""
+
+    def __init__(self, config):
+        _require_authkey(config)
+        self.address = config['address']
+        self.authkey = config['authkey']
+        self.timeout = config['timeout']
+        self.ring = SharedFrameRing(config['ring_slots'], config['slot_bytes'])
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._inline = 0
+        self._timeouts = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+            except (OSError, EOFError) as e:
+                raise ModelServerUnavailable(f'无法连接模型服务 {self.address}: {e}')
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _call(self, op, payload=None, slot=None, version=None):
+        """发送请求并等待响应；slot 为请求占用的共享内存槽位，由本方法负责释放
+
+        超时时推理进程可能仍在读取槽位，此时连接交给后台线程等待迟到的响应，收到后才释放槽位
+        """
+        handed_over = False
+        try:
+            conn = self._connection()
+            try:
+                conn.send((op, payload, version))
+                if not conn.poll(self.timeout):
+                    self._local.conn = None
+                    threading.Thread(target=self._await_late_reply, args=(conn, slot),
+                                     name='model-server-late-reply', daemon=True).start()
+                    handed_over = True
+                    with self._lock:
+                        self._timeouts += 1
+                    raise ModelServerUnavailable(f'模型服务响应超时 ({self.timeout} 秒)')
+                status, result = conn.recv()
+            except (OSError, EOFError) as e:
+                self._drop_connection()
+                raise ModelServerUnavailable(f'模型服务连接中断: {e}')
+        finally:
+            if slot is not None and not handed_over:
+                self.ring.release(slot)
+        if status != 'ok':
+            raise RuntimeError(f'模型服务处理失败: {result}')
+        return result
+
+    def _await_late_reply(self, conn, slot):
+        """等待超时请求的响应 (模型服务在推理进程处理完后才会响应)，然后释放槽位并关闭连接
+
+        连接中断说明模型服务 (及其推理进程) 已退出，槽位不会再被读取
+        """
+        try:
+            conn.recv()
+        except (OSError, EOFError):
+            pass
+        finally:
+            try:
+                conn.close()
+            except OSError:
+                pass
+            if slot is not None:
+                self.ring.release(slot)
+
+    def _call_with_array(self, op, array, version=None):
+        array = np.ascontiguousarray(array)
+        with self._lock:
+            self._requests += 1
+        if array.nbytes > self.ring.slot_bytes:
+            # 超过槽位大小 (如高分辨率的身份照片) 时随请求一起发送
+            with self._lock:
+                self._inline += 1
+            return self._call(op, ('inline', array), version=version)
+        try:
+            index = self.ring.acquire(timeout=self.timeout)
+        except queue.Empty:
+            raise ModelServerUnavailable('共享内存槽位已全部占用')
+        try:
+            payload = self.ring.write(index, array)
+        except Exception:
+            self.ring.release(index)
+            raise
+        try:
+            return self._call(op, payload, slot=index, version=version)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def ping(self):
+        """返回推理进程的模型信息；没有就绪的推理进程时返回 None"""
+        return self._call(OP_PING)
+
+    def predict_liveness(self, batch, version=None):
+        """活体推理，batch 为 (N, 128, 128, 3) float32，返回 (N, 2)
+
+        version 为会话固定的活体模型版本，推理进程无法使用该版本时抛出 RuntimeError
+        """
+        return self._call_with_array(OP_LIVENESS, np.asarray(batch, dtype=np.float32), version)
+
+    def compute_embedding(self, img, version=None):
+        """人脸特征向量，img 可以是图片路径或 BGR 数组；version 为特征模型版本，
+        推理进程无法使用该版本时抛出 RuntimeError (不会退回到其他版本)
+        """
+        if isinstance(img, str):
+            with self._lock:
+                self._requests += 1
+            return self._call(OP_EMBEDDING, ('path', img), version=version)
+        return self._call_with_array(OP_EMBEDDING, img, version)
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'address': '%s:%s' % self.address,
+                'ring_slots': self.ring.slots,
+                'slot_bytes': self.ring.slot_bytes,
+                'free_slots': self.ring._free.qsize(),
+                'requests': self._requests,
+                'inline_requests': self._inline,
+                'errors': self._errors,
+                'timeouts': self._timeouts,
+            }
+
+    def close(self):
+        self._drop_connection()
+        self.ring.close()
+
+
+class RemoteLivenessBackend:
+    """通过模型服务推理的活体后端，接口与 inference_utils 中的本地后端一致
+
+    每个实例对应一个活体模型版本，推理时把版本一起发给推理进程
+    """
+
+    def __init__(self, client, info, version=None):
+        self.client = client
+        self.name = f"remote:{info.get('liveness_backend')}"
+        self.model_path = info.get('model_path')
+        self.version = version
+
+    def predict(self, batch):
+        return self.client.predict_liveness(batch, self.version)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_model_server_client():
+    """模型服务模式下返回本进程的客户端；未启用或当前就是推理进程时返回 None"""
+    global _client
+    if _server_process:
+        return None
+    config = get_model_server_config()
+    if not config['enabled']:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ModelServerClient(config)
+                # 进程退出时释放共享内存
+                atexit.register(_client.close)
+                print(f"✅ 模型服务客户端: {_client.address[0]}:{_client.address[1]}, "
+                      f"共享内存 {config['ring_slots']} x {config['slot_bytes'] // 1024} KB")
+    return _client
+
+
+# ---------------------------------------------------------------------------
+# 推理进程与服务主进程
+# ---------------------------------------------------------------------------
+
+class _AttachedSegments:
+    """推理进程中已附加的共享内存 (按名称缓存，数量超过上限时关闭最久未用的)"""
+
+    def __init__(self, limit=32):
+        self.limit = limit
+        self._segments = OrderedDict()
+
+    def array(self, name, offset, shape, dtype):
+        shm = self._segments.get(name)
+        if shm is None:
+            shm = _attach_shared_memory(name)
+            self._segments[name] = shm
+            while len(self._segments) > self.limit:
+                _, oldest = self._segments.popitem(last=False)
+                oldest.close()
+        else:
+            self._segments.move_to_end(name)
+        return np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+
+
+def _resolve_image_path(path):
+    """只允许读取 FACES_DATABASE_PATH 下的文件，其他路径抛出 ValueError"""
+    root = os.path.realpath(settings.FACES_DATABASE_PATH)
+    resolved = os.path.realpath(path)
+    if os.path.commonpath([root, resolved]) != root or not os.path.isfile(resolved):
+        raise ValueError(f'不允许读取的图片路径: {path}')
+    return resolved
+
+
+def _read_payload(payload, segments):
+    kind = payload[0]
+    if kind == 'shm':
+        return segments.array(*payload[1:])
+    if kind == 'path':
+        return _resolve_image_path(payload[1])
+    if kind == 'inline':
+        return payload[1]
+    raise ValueError(f'未知的数据描述: {kind}')
+
+
+def _run_request(models, op, data, version):
+    """推理进程中执行一个请求；会话固定的版本不可用时报错，不能用其他版本的模型计算"""
+    from .embedding_utils import compute_embedding, get_embedding_config
+    if op == OP_LIVENESS:
+        if models.liveness is None:
+            raise RuntimeError('活体检测模型未加载')
+        if version and models.liveness_manifest(version)['version'] != version:
+            raise RuntimeError(f'推理进程没有活体检测模型版本 {version}')
+        return np.asarray(models.predict_liveness_batch(data, version))
+    if op == OP_EMBEDDING:
+        config = get_embedding_config(version)
+        if version and config['version'] != version:
+            raise RuntimeError(f'推理进程无法加载人脸特征模型版本 {version}')
+        return compute_embedding(data, config)
+    raise ValueError(f'未知的操作: {op}')
+
+
+def _worker_main(worker_id, requests, results):
+    """推理进程：加载并预热模型，然后循环处理请求"""
+    global _server_process
+    _server_process = True
+
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from .model_manager import get_model_manager
+    from .model_registry import LIVENESS
+
+    models = get_model_manager()
+    models.warm_up()
+    liveness = models.liveness
+    results.put((None, 'ready', {
+        'worker': worker_id,
+        'pid': os.getpid(),
+        'liveness_backend': liveness.name if liveness is not None else None,
+        'liveness_version': models.active_versions().get(LIVENESS),
+        'model_path': liveness.model_path if liveness is not None else None,
+        'embedding_available': models.deepface_available,
+    }))
+
+    segments = _AttachedSegments()
+    while True:
+        request_id, op, payload, version = requests.get()
+        try:
+            result = _run_request(models, op, _read_payload(payload, segments), version)
+            results.put((request_id, 'ok', result))
+        except Exception as e:
+            results.put((request_id, 'error', str(e)))
+
+
+class ModelServer:
+    """服务主进程：接受 Web 进程的连接，把请求分发给推理进程并转发结果
+
+    主进程本身不加载任何模型，帧数据只在 Web 进程与推理进程之间通过共享内存传递
+    """
+
+    def __init__(self, config=None, workers=None):
+        import multiprocessing
+        self.config = config or get_model_server_config()
+        _require_authkey(self.config)
+        self.num_workers = max(1, int(workers or self.config['workers']))
+        self._ctx = multiprocessing.get_context('spawn')
+        # 有界队列：推理进程跟不上时直接拒绝新请求，而不是无限堆积
+        self._requests = self._ctx.Queue(maxsize=max(1, int(self.config.get('queue_size') or 64)))
+        self._results = self._ctx.Queue()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.workers = []
+        self.ready = {}
+
+    def start_workers(self):
+        for worker_id in range(self.num_workers):
+            process = self._ctx.Process(target=_worker_main, args=(worker_id, self._requests, self._results),
+                                        name=f'model-worker-{worker_id}', daemon=True)
+            process.start()
+            self.workers.append(process)
+        threading.Thread(target=self._route_results, name='model-server-results', daemon=True).start()
+
+    def _route_results(self):
+        while True:
+            request_id, status, result = self._results.get()
+            if request_id is None:
+                self.ready[result['worker']] = result
+                print(f"✅ 推理进程 {result['worker']} 就绪 (pid {result['pid']}, "
+                      f"活体后端 {result['liveness_backend']})")
+                continue
+            with self._pending_lock:
+                future = self._pending.pop(request_id, None)
+            if future is not None:
+                future.set_result((status, result))
+
+    def _ping_info(self):
+        for info in self.ready.values():
+            if info['liveness_backend'] is not None:
+                return info
+        return None
+
+    def _dispatch(self, op, payload, version=None):
+        """把请求交给推理进程，推理进程返回结果后才响应
+
+        客户端在收到响应前不会复用请求占用的共享内存槽位，因此这里不能提前以超时响应；
+        只有推理进程全部退出 (不会再读取槽位) 时才放弃等待
+        """
+        request_id = next(self._ids)
+        future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = future
+        try:
+            self._requests.put((request_id, op, payload, version), block=False)
+        except queue.Full:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            return ('error', '推理请求队列已满')
+        while True:
+            try:
+                return future.result(timeout=self.config['timeout'])
+            except FutureTimeoutError:
+                if not any(process.is_alive() for process in self.workers):
+                    with self._pending_lock:
+                        self._pending.pop(request_id, None)
+                    return ('error', '推理进程已全部退出')
+
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                op, payload, version = conn.recv()
+                if op == OP_PING:
+                    conn.send(('ok', self._ping_info()))
+                else:
+                    conn.send(self._dispatch(op, payload, version))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        self.start_workers()
+        # 默认 backlog 为 1，多个 Web 进程同时连接时会卡在握手阶段
+        listener = Listener(self.config['address'], authkey=self.config['authkey'], backlog=128)
+        print(f"🚀 模型服务已启动: {self.config['address'][0]}:{self.config['address'][1]}, "
+              f"{self.num_workers} 个推理进程")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # 认证失败等单条连接的错误不影响服务
+                    print(f"⚠️ 拒绝模型服务连接: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            for process in self.workers:
+                process.terminate()
+
@@ -22,3 +22,41 @@ class AuditLog(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        # 列表按 (timestamp, id) 倒序做键集分页，警报和按用户查询分别走带前缀的复合索引
+        indexes = [
+            models.Index(fields=['timestamp'], name='auditlog_timestamp_idx'),
+            models.Index(fields=['liveness_status', 'timestamp'], name='auditlog_status_ts_idx'),
+            models.Index(fields=['user', 'timestamp'], name='auditlog_user_ts_idx'),
+        ]
+
+
+class AuditLogRollup(models.Model):
+    """审计日志的预聚合计数：按小时/按天、动作、状态、比对结果、用户和分数区间累计
+
+    由审计日志写入器在写入每批日志时增量更新，compact_audit_rollups 命令按原始日志重建并清理旧的小时数据
+    """
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_CHOICES = [(PERIOD_HOUR, '小时'), (PERIOD_DAY, '天')]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()  # 小时或当天 0 点 (本地时区)
+    action = models.CharField(max_length=100)
+    liveness_status = models.CharField(max_length=50, default='', blank=True)
+    compare_result = models.CharField(max_length=50, default='', blank=True)  # 只保留 ':' 之前的结果类别
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    score_bin = models.SmallIntegerField(default=-1)  # 分数区间 0-9 (每 0.1 一档)，-1 表示没有分数
+    count = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0.0)
+
+    def __str__(self):
+        return f"{self.period} {self.bucket} - {self.action} {self.liveness_status}: {self.count}"
+
+    class Meta:
+        # 唯一约束的索引以 (period, bucket) 开头，同时用于按时间范围查询
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'bucket', 'action', 'liveness_status', 'compare_result', 'user', 'score_bin'],
+                name='auditlog_rollup_unique_key',
+            ),
+        ]
@@ -0,0 +1,110 @@
+# quality_utils.py
+# 推理前的帧质量检查：模糊、过暗、过曝和重复帧 (摄像头卡住时会反复发送同一帧)
+# 在缩小的灰度图上计算，耗时远小于人脸检测和活体推理；被拒绝的帧不计票
+
+from django.conf import settings
+
+try:
+    import numpy as np
+    import cv2
+except ImportError:
+    np = None
+
+# 拒绝原因代码 (同时返回给前端)
+REJECT_BLURRY = 'blurry'
+REJECT_TOO_DARK = 'too_dark'
+REJECT_OVEREXPOSED = 'overexposed'
+REJECT_DUPLICATE = 'duplicate_frame'
+REJECT_NO_FACE = 'no_face'
+REJECT_MULTIPLE_FACES = 'multiple_faces'
+
+REJECT_MESSAGES = {
+    REJECT_BLURRY: '画面模糊，请保持不动',
+    REJECT_TOO_DARK: '画面过暗，请改善光线',
+    REJECT_OVEREXPOSED: '画面过曝，请避免强光直射',
+    REJECT_DUPLICATE: '与上一帧相同，摄像头可能已卡住',
+    REJECT_NO_FACE: '未检测到人脸',
+    REJECT_MULTIPLE_FACES: '检测到多张人脸',
+}
+
+# 这些原因在推理前拒绝，不计入投票
+NON_VOTING_REASONS = (REJECT_BLURRY, REJECT_TOO_DARK, REJECT_OVEREXPOSED, REJECT_DUPLICATE)
+
+
+def get_quality_config():
+    """读取帧质量检查配置 (也通过 API 提供给前端做上传前检查)"""
+    return {
+        'enabled': getattr(settings, 'FRAME_QUALITY_ENABLED', True),
+        'analysis_side': getattr(settings, 'FRAME_QUALITY_ANALYSIS_SIDE', 160),
+        'min_sharpness': getattr(settings, 'FRAME_QUALITY_MIN_SHARPNESS', 30.0),
+        'min_brightness': getattr(settings, 'FRAME_QUALITY_MIN_BRIGHTNESS', 40.0),
+        'max_brightness': getattr(settings, 'FRAME_QUALITY_MAX_BRIGHTNESS', 220.0),
+        'dhash_size': getattr(settings, 'FRAME_QUALITY_DHASH_SIZE', 16),
+        'duplicate_max_distance': getattr(settings, 'FRAME_QUALITY_DUPLICATE_MAX_DISTANCE', 0),
+    }
+
+
+def _analysis_gray(frame, side):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    h, w = gray.shape[:2]
+    if side and max(h, w) > side:
+        scale = side / float(max(h, w))
+        gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def frame_dhash(gray, hash_size=16):
+    """差值感知哈希：缩放到 (hash_size+1) x hash_size，比较相邻像素，返回整数"""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hash_distance(a, b):
+    """两个哈希之间的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+def is_duplicate_frame(frame_hash, previous_hash, config=None):
+    """与上一帧的哈希足够接近时视为重复帧"""
+    if frame_hash is None or previous_hash is None:
+        return False
+    config = config or get_quality_config()
+    return hash_distance(frame_hash, previous_hash) <= config['duplicate_max_distance']
+
+
+def assess_frame_quality(frame, previous_hash=None):
+    """检查一帧的清晰度、亮度以及是否与上一帧重复
+
+    返回 {'reason': 拒绝原因或 None, 'sharpness', 'brightness', 'frame_hash'}
+    """
+    config = get_quality_config()
+    gray = _analysis_gray(frame, config['analysis_side'])
+    brightness = float(gray.mean())
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    frame_hash = frame_dhash(gray, config['dhash_size'])
+
+    reason = None
+    if brightness < config['min_brightness']:
+        reason = REJECT_TOO_DARK
+    elif brightness > config['max_brightness']:
+        reason = REJECT_OVEREXPOSED
+    elif sharpness < config['min_sharpness']:
+        reason = REJECT_BLURRY
+    elif is_duplicate_frame(frame_hash, previous_hash, config):
+        reason = REJECT_DUPLICATE
+
+    return {'reason': reason, 'sharpness': sharpness, 'brightness': brightness, 'frame_hash': frame_hash}
+
+
+def rejection_analysis(reason, quality=None, detail=None):
+    """生成被拒绝帧的分析结果"""
+    message = REJECT_MESSAGES.get(reason, reason)
+    if detail:
+        message = f"{message} ({detail})"
+    analysis = {'face_detected': False, 'rejected': reason in NON_VOTING_REASONS, 'reason': reason, 'message': message}
+    if quality is not None:
+        analysis['frame_hash'] = quality['frame_hash']
+        analysis['quality'] = {'sharpness': round(quality['sharpness'], 1),
+                               'brightness': round(quality['brightness'], 1)}
+    return analysis
@@ -0,0 +1,129 @@
+# rollup_utils.py
+# 审计日志统计的预聚合：每批日志写入时累加到按小时/按天的计数表，
+# 统计接口只读这张小表，不再对审计日志做 COUNT(*)
+
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import AuditLog, AuditLogRollup
+
+SCORE_BINS = 10
+ROLLUP_PERIODS = (AuditLogRollup.PERIOD_HOUR, AuditLogRollup.PERIOD_DAY)
+_KEY_FIELDS = ('period', 'bucket', 'action', 'liveness_status', 'compare_result', 'user_id', 'score_bin')
+
+
+def truncate_bucket(timestamp, period):
+    """时间戳所在的整点或当天 0 点 (本地时区)"""
+    bucket = timezone.localtime(timestamp).replace(minute=0, second=0, microsecond=0)
+    if period == AuditLogRollup.PERIOD_DAY:
+        bucket = bucket.replace(hour=0)
+    return bucket
+
+
+def score_bin(score):
+    """分数所在的区间 (每 0.1 一档)，没有分数为 -1"""
+    if score is None:
+        return -1
+    return min(max(int(score * SCORE_BINS), 0), SCORE_BINS - 1)
+
+
+def result_category(compare_result):
+    """比对结果的类别：'DEEPFACE_ERROR: ...' 这类结果只保留 ':' 之前的部分，避免统计维度无限增长"""
+    return (compare_result or '').split(':', 1)[0][:50]
+
+
+def aggregate_logs(logs):
+    """把日志聚合为 {维度键: [条数, 分数和]}，每条日志同时计入小时和天"""
+    totals = defaultdict(lambda: [0, 0.0])
+    for log in logs:
+        dims = (log.action[:100], log.liveness_status or '', result_category(log.compare_result),
+                log.user_id, score_bin(log.score))
+        for period in ROLLUP_PERIODS:
+            total = totals[(period, truncate_bucket(log.timestamp, period)) + dims]
+            total[0] += 1
+            total[1] += log.score or 0.0
+    return totals
+
+
+def record_rollups(logs):
+    """把一批新写入的日志累加到预聚合表 (F 表达式原子累加，多个进程同时写入也不会丢失计数)"""
+    for key, (count, score_sum) in aggregate_logs(logs).items():
+        lookup = dict(zip(_KEY_FIELDS, key))
+        rows = AuditLogRollup.objects.filter(**lookup)
+        if rows.update(count=F('count') + count, score_sum=F('score_sum') + score_sum):
+            continue
+        try:
+            with transaction.atomic():
+                AuditLogRollup.objects.create(count=count, score_sum=score_sum, **lookup)
+        except IntegrityError:
+            # 其他进程刚插入了同一行
+            rows.update(count=F('count') + count, score_sum=F('score_sum') + score_sum)
+
+
+def rebuild_rollups(start, end, chunk_size=5000):
+    """按原始日志重建 [start, end) 内的预聚合数据，返回写入的行数
+
+    start/end 应为本地时区的 0 点，这样范围内的小时和天都完整重算
+    """
+    logs = (AuditLog.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            .only('timestamp', 'action', 'liveness_status', 'compare_result', 'score', 'user_id').order_by())
+    totals = aggregate_logs(logs.iterator(chunk_size=chunk_size))
+    with transaction.atomic():
+        AuditLogRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+        AuditLogRollup.objects.bulk_create([
+            AuditLogRollup(count=count, score_sum=score_sum, **dict(zip(_KEY_FIELDS, key)))
+            for key, (count, score_sum) in totals.items()
+        ], batch_size=1000)
+    return len(totals)
+
+
+def prune_hourly_rollups(before):
+    """删除 before 之前的小时数据 (按天的数据保留)，返回删除的行数"""
+    deleted, _ = AuditLogRollup.objects.filter(period=AuditLogRollup.PERIOD_HOUR, bucket__lt=before).delete()
+    return deleted
+
+
+def rollup_stats(period, start, end, user_id=None, action=None):
+    """从预聚合表读取 [start, end) 的统计：时间序列 (按状态)、各维度合计和分数分布"""
+    rows = AuditLogRollup.objects.filter(period=period, bucket__gte=truncate_bucket(start, period), bucket__lt=end)
+    if user_id is not None:
+        rows = rows.filter(user_id=user_id)
+    if action:
+        rows = rows.filter(action=action)
+
+    bucket_format = '%Y-%m-%d %H:00' if period == AuditLogRollup.PERIOD_HOUR else '%Y-%m-%d'
+    series = {}
+    for row in rows.values('bucket', 'liveness_status').annotate(total=Sum('count')).order_by('bucket'):
+        bucket = timezone.localtime(row['bucket']).strftime(bucket_format)
+        point = series.setdefault(bucket, {'bucket': bucket, 'count': 0, 'by_status': {}})
+        point['count'] += row['total']
+        point['by_status'][row['liveness_status'] or 'UNKNOWN'] = row['total']
+
+    def totals_by(field, limit=None):
+        grouped = rows.values(field).annotate(total=Sum('count')).order_by('-total')
+        if limit:
+            grouped = grouped[:limit]
+        return {row[field] or 'UNKNOWN': row['total'] for row in grouped}
+
+    histogram = [{'bin': f'{i / SCORE_BINS:.1f}-{(i + 1) / SCORE_BINS:.1f}', 'count': 0} for i in range(SCORE_BINS)]
+    scored_count, scored_sum, total = 0, 0.0, 0
+    for row in rows.values('score_bin').annotate(total=Sum('count'), score_sum=Sum('score_sum')):
+        total += row['total']
+        if row['score_bin'] >= 0:
+            histogram[row['score_bin']]['count'] += row['total']
+            scored_count += row['total']
+            scored_sum += row['score_sum']
+
+    return {
+        'period': period,
+        'total': total,
+        'by_status': totals_by('liveness_status'),
+        'by_compare_result': totals_by('compare_result'),
+        'by_action': totals_by('action', limit=20),
+        'by_user': totals_by('user__username', limit=10),
+        'series': list(series.values()),
+        'score_histogram': histogram,
+        'average_score': round(scored_sum / scored_count, 4) if scored_count else None,
+    }
@@ -0,0 +1,479 @@
+# session_store.py
+# 识别会话存储：支持进程内内存、共享 SQLite (WAL) 和本地 Redis 兼容服务
+# 多个 gunicorn/uvicorn 工作进程时需使用 sqlite 或 redis 后端，
+# 这样帧请求落到任意进程都能找到 recognition/start/ 创建的会话
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def estimate_session_size(data):
+    """估算会话占用的字节数 (数组和字节串按实际长度计算)"""
+    total = 0
+    for key, value in data.items():
+        total += len(key) + 64
+        if value is None:
+            continue
+        if np is not None and isinstance(value, np.ndarray):
+            total += value.nbytes
+        elif isinstance(value, (bytes, bytearray, memoryview, str)):
+            total += len(value)
+        elif isinstance(value, (list, tuple)):
+            total += 8 * len(value)
+        else:
+            total += 32
+    return total
+
+
+_session_locks = [threading.Lock() for _ in range(getattr(settings, 'RECOGNITION_SESSION_LOCK_SHARDS', 64))]
+
+
+def session_lock(session_id):
+    """按会话ID分片的进程内锁，不同会话的更新互不阻塞"""
+    return _session_locks[zlib.crc32(session_id.encode('utf-8')) % len(_session_locks)]
+
+
+class BaseSessionStore:
+    """会话存储接口：get / set / compare_and_set / delete / cleanup_expired / stats
+
+    max_bytes 为全部会话的总字节预算 (0 表示不限制)，超出时按最近最少使用淘汰；
+    on_evict(session_id) 在会话被淘汰后调用
+    """
+    backend = 'base'
+
+    def __init__(self, ttl, max_bytes=0):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.on_evict = None
+
+    def _notify_evicted(self, evicted):
+        if not evicted:
+            return
+        self.evictions += len(evicted)
+        print(f"🧹 会话存储超出预算 ({self.max_bytes} 字节)，淘汰最久未使用的会话: {len(evicted)} 个")
+        if self.on_evict:
+            for session_id in evicted:
+                self.on_evict(session_id)
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def set(self, session_id, data):
+        raise NotImplementedError
+
+    def compare_and_set(self, session_id, data, expected_version):
+        """仅当存储中的版本号仍为 expected_version 时写入，返回是否成功"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def cleanup_expired(self):
+        """删除过期会话，返回被删除的会话ID列表"""
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(BaseSessionStore):
+    """进程内字典存储 (仅适用于单进程部署)；get 返回的是同一个字典对象
+
+    字典按访问顺序排列，超出字节预算时从最久未访问的一端淘汰
+    """
+    backend = 'memory'
+
+    def __init__(self, ttl, max_bytes=0):
+        super().__init__(ttl, max_bytes)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= time.time():
+                self._remove(session_id)
+                return None
+            self._sessions.move_to_end(session_id)
+            return entry['data']
+
+    def set(self, session_id, data):
+        size = estimate_session_size(data)
+        evicted = []
+        with self._lock:
+            old = self._sessions.get(session_id)
+            if old is not None:
+                self._bytes -= old['size']
+            self._sessions[session_id] = {'data': data, 'expires_at': time.time() + self.ttl, 'size': size}
+            self._sessions.move_to_end(session_id)
+            self._bytes += size
+            # 当前写入的会话位于末尾，不会被自己淘汰
+            while self.max_bytes and self._bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                self._remove(oldest)
+                evicted.append(oldest)
+        self._notify_evicted(evicted)
+
+    def compare_and_set(self, session_id, data, expected_version):
+        # get 返回的是同一个字典对象，进程内的串行化由 session_lock 保证；
+        # 这里只需确认会话未被删除或替换
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry['data'] is not data:
+                return False
+        self.set(session_id, data)
+        return True
+
+    def _remove(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry['size']
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def cleanup_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry['expires_at'] <= now]
+            for session_id in expired:
+                self._remove(session_id)
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.backend, 'sessions': len(self._sessions), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions, 'ttl': self.ttl}
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """共享 SQLite 表 (WAL 模式)，同一台机器上的多个工作进程共用
+
+    每次写入都会刷新 expires_at，因此按 expires_at 升序即为最久未更新的会话
+    """
+    backend = 'sqlite'
+
+    def __init__(self, ttl, path, max_bytes=0):
+        super().__init__(ttl, max_bytes)
+        self.path = str(path)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS recognition_sessions (
+            session_id TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            size INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        # 旧表缺少 version 列时添加
+        cols = [row[1] for row in conn.execute("PRAGMA table_info(recognition_sessions);")]
+        if "version" not in cols:
+            conn.execute("ALTER TABLE recognition_sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_recognition_sessions_expires ON recognition_sessions (expires_at);")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            "SELECT data FROM recognition_sessions WHERE session_id = ? AND expires_at > ?;",
+            (session_id, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, session_id, data):
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO recognition_sessions (session_id, data, expires_at, size, version) VALUES (?, ?, ?, ?, ?);",
+            (session_id, blob, time.time() + self.ttl, len(blob), data.get('version', 0))
+        )
+        conn.commit()
+        self._enforce_budget(session_id)
+
+    def compare_and_set(self, session_id, data, expected_version):
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._connection()
+        cursor = conn.execute(
+            "UPDATE recognition_sessions SET data = ?, expires_at = ?, size = ?, version = ? "
+            "WHERE session_id = ? AND version = ?;",
+            (blob, time.time() + self.ttl, len(blob), data.get('version', 0), session_id, expected_version)
+        )
+        conn.commit()
+        if cursor.rowcount != 1:
+            return False
+        self._enforce_budget(session_id)
+        return True
+
+    def _enforce_budget(self, current_id):
+        if not self.max_bytes:
+            return
+        conn = self._connection()
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM recognition_sessions;").fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for session_id, size in conn.execute(
+                "SELECT session_id, size FROM recognition_sessions WHERE session_id != ? ORDER BY expires_at;",
+                (current_id,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append(session_id)
+            total -= size
+        conn.executemany("DELETE FROM recognition_sessions WHERE session_id = ?;", [(sid,) for sid in evicted])
+        conn.commit()
+        self._notify_evicted(evicted)
+
+    def delete(self, session_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM recognition_sessions WHERE session_id = ?;", (session_id,))
+        conn.commit()
+
+    def cleanup_expired(self):
+        conn = self._connection()
+        now = time.time()
+        expired = [row[0] for row in conn.execute(
+            "SELECT session_id FROM recognition_sessions WHERE expires_at <= ?;", (now,))]
+        if expired:
+            conn.execute("DELETE FROM recognition_sessions WHERE expires_at <= ?;", (now,))
+            conn.commit()
+        return expired
+
+    def stats(self):
+        count, total = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM recognition_sessions WHERE expires_at > ?;",
+            (time.time(),)
+        ).fetchone()
+        return {'backend': self.backend, 'sessions': count, 'bytes': total, 'max_bytes': self.max_bytes,
+                'evictions': self.evictions, 'ttl': self.ttl, 'path': self.path}
+
+
+# 写入会话并执行字节预算 (在服务端原子执行)
+# KEYS: 会话键, 大小哈希, 最近写入时间有序集合, 总字节数, 淘汰计数
+# ARGV: 会话ID, 数据, TTL, 当前时间, 字节预算, 键前缀
+_REDIS_WRITE_SCRIPT = """
+local size = string.len(ARGV[2])
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+local old = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HSET', KEYS[2], ARGV[1], size)
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+local total = redis.call('INCRBY', KEYS[4], size - old)
+local budget = tonumber(ARGV[5])
+local evicted = {}
+while budget > 0 and total > budget do
+    local oldest = redis.call('ZRANGE', KEYS[3], 0, 0)[1]
+    if not oldest or oldest == ARGV[1] then
+        break
+    end
+    local oldest_size = tonumber(redis.call('HGET', KEYS[2], oldest) or '0')
+    redis.call('DEL', ARGV[6] .. oldest)
+    redis.call('HDEL', KEYS[2], oldest)
+    redis.call('ZREM', KEYS[3], oldest)
+    total = redis.call('DECRBY', KEYS[4], oldest_size)
+    evicted[#evicted + 1] = oldest
+end
+if #evicted > 0 then
+    redis.call('INCRBY', KEYS[5], #evicted)
+end
+return evicted
+"""
+
+# 删除会话 (ARGV[2] 为 'delete') 或清理已过期会话的统计 (ARGV[2] 为 'expired'，键仍存在时跳过)
+# KEYS: 大小哈希, 最近写入时间有序集合, 总字节数
+# ARGV: 键前缀, 模式, 会话ID...
+_REDIS_REMOVE_SCRIPT = """
+local removed = {}
+for i = 3, #ARGV do
+    local key = ARGV[1] .. ARGV[i]
+    if ARGV[2] == 'delete' or redis.call('EXISTS', key) == 0 then
+        redis.call('DEL', key)
+        local size = redis.call('HGET', KEYS[1], ARGV[i])
+        if size then
+            redis.call('DECRBY', KEYS[3], size)
+            redis.call('HDEL', KEYS[1], ARGV[i])
+        end
+        redis.call('ZREM', KEYS[2], ARGV[i])
+        removed[#removed + 1] = ARGV[i]
+    end
+end
+return removed
+"""
+
+
+class RedisSessionStore(BaseSessionStore):
+    """Redis 兼容服务 (redis / valkey / keydb)，过期由服务端 TTL 处理
+
+    每次写入在 Lua 脚本中原子地更新大小统计，超出字节预算时淘汰最久未写入的会话；
+    淘汰次数记在服务端，多个工作进程共享。脚本按前缀拼出被淘汰会话的键，只适用于单实例 (非集群)
+    """
+    backend = 'redis'
+
+    def __init__(self, ttl, url, prefix='cosys:session:', max_bytes=0):
+        super().__init__(ttl, max_bytes)
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.sizes_key = prefix + '__sizes__'
+        self.lru_key = prefix + '__lru__'
+        self.bytes_key = prefix + '__bytes__'
+        self.evictions_key = prefix + '__evictions__'
+        self._write_script = self.client.register_script(_REDIS_WRITE_SCRIPT)
+        self._remove_script = self.client.register_script(_REDIS_REMOVE_SCRIPT)
+
+    def _key(self, session_id):
+        return self.prefix + session_id
+
+    def _write(self, session_id, blob, client=None):
+        return self._write_script(
+            keys=[self._key(session_id), self.sizes_key, self.lru_key, self.bytes_key, self.evictions_key],
+            args=[session_id, blob, self.ttl, time.time(), self.max_bytes or 0, self.prefix],
+            client=client
+        )
+
+    def _remove(self, session_ids, mode):
+        removed = self._remove_script(keys=[self.sizes_key, self.lru_key, self.bytes_key],
+                                      args=[self.prefix, mode, *session_ids])
+        return [sid.decode() for sid in removed]
+
+    def _notify_evicted(self, evicted):
+        # 淘汰次数已在脚本中计入服务端计数
+        evicted = [sid.decode() for sid in evicted or []]
+        if evicted:
+            print(f"🧹 会话存储超出预算 ({self.max_bytes} 字节)，淘汰最久未写入的会话: {len(evicted)} 个")
+            if self.on_evict:
+                for session_id in evicted:
+                    self.on_evict(session_id)
+
+    def get(self, session_id):
+        blob = self.client.get(self._key(session_id))
+        return pickle.loads(blob) if blob else None
+
+    def set(self, session_id, data):
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        self._notify_evicted(self._write(session_id, blob))
+
+    def compare_and_set(self, session_id, data, expected_version):
+        import redis
+        key = self._key(session_id)
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if current is None or pickle.loads(current).get('version', 0) != expected_version:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                self._write(session_id, blob, client=pipe)
+                evicted = pipe.execute()[-1]
+            except redis.WatchError:
+                return False
+        self._notify_evicted(evicted)
+        return True
+
+    def delete(self, session_id):
+        self._remove([session_id], 'delete')
+
+    def cleanup_expired(self):
+        # 会话键由 Redis 自动过期，这里只清理大小统计中的残留项
+        session_ids = [sid.decode() for sid in self.client.hkeys(self.sizes_key)]
+        if not session_ids:
+            return []
+        pipe = self.client.pipeline()
+        for session_id in session_ids:
+            pipe.exists(self._key(session_id))
+        expired = [sid for sid, exists in zip(session_ids, pipe.execute()) if not exists]
+        return self._remove(expired, 'expired') if expired else []
+
+    def stats(self):
+        pipe = self.client.pipeline()
+        pipe.hlen(self.sizes_key)
+        pipe.get(self.bytes_key)
+        pipe.get(self.evictions_key)
+        sessions, total, evictions = pipe.execute()
+        return {'backend': self.backend, 'sessions': sessions, 'bytes': int(total or 0),
+                'max_bytes': self.max_bytes, 'evictions': int(evictions or 0), 'ttl': self.ttl}
+
+
+def create_session_store():
+    """按 settings.RECOGNITION_SESSION_BACKEND 创建会话存储"""
+    backend = getattr(settings, 'RECOGNITION_SESSION_BACKEND', 'memory')
+    ttl = getattr(settings, 'RECOGNITION_SESSION_TTL', 1800)
+    max_bytes = getattr(settings, 'RECOGNITION_SESSION_MAX_BYTES', 0)
+    try:
+        if backend == 'sqlite':
+            path = getattr(settings, 'RECOGNITION_SESSION_SQLITE_PATH',
+                           os.path.join(settings.BASE_DIR, 'recognition_sessions.db'))
+            return SQLiteSessionStore(ttl, path, max_bytes)
+        if backend == 'redis':
+            return RedisSessionStore(ttl, getattr(settings, 'RECOGNITION_SESSION_REDIS_URL', 'redis://127.0.0.1:6379/0'),
+                                     max_bytes=max_bytes)
+    except Exception as e:
+        print(f"❌ 会话存储后端 {backend} 初始化失败，使用内存存储: {e}")
+    return MemorySessionStore(ttl, max_bytes)
+
+
+class SessionSweeper(threading.Thread):
+    """后台线程：定期删除过期会话"""
+
+    def __init__(self, store, interval, on_expired=None):
+        super().__init__(name='recognition-session-sweeper', daemon=True)
+        self.store = store
+        self.interval = interval
+        self.on_expired = on_expired
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                expired = self.store.cleanup_expired()
+                if expired:
+                    print(f"🧹 清理过期识别会话: {len(expired)} 个")
+                    if self.on_expired:
+                        for session_id in expired:
+                            self.on_expired(session_id)
+            except Exception as e:
+                print(f"清理过期会话失败: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store(on_expired=None):
+    """获取全局会话存储，首次调用时启动清理线程"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = create_session_store()
+                store.on_evict = on_expired
+                SessionSweeper(store, getattr(settings, 'RECOGNITION_SESSION_SWEEP_INTERVAL', 60), on_expired).start()
+                print(f"✅ 识别会话存储: {store.backend}")
+                _store = store
+    return _store
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, Client, override_settings
+
+from api import async_utils
+from api.async_utils import (
+    BoundedInferenceExecutor, InferenceExecutorSaturated, async_csrf_exempt, run_inference,
+)
+
+
+class BoundedInferenceExecutorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def test_rejects_beyond_workers_and_queue(self):
+        executor = BoundedInferenceExecutor(max_workers=1, queue_size=1)
+        running = executor.submit(self.release.wait, 2)
+        queued = executor.submit(self.release.wait, 2)
+        with self.assertRaises(InferenceExecutorSaturated):
+            executor.submit(self.release.wait, 2)
+        self.assertEqual(executor.get_metrics()['in_flight'], 2)
+        self.assertEqual(executor.get_metrics()['rejected'], 1)
+
+        self.release.set()
+        running.result(timeout=2)
+        queued.result(timeout=2)
+        # 完成后槽位归还，可以继续提交
+        self.assertTrue(executor.submit(lambda: True).result(timeout=2))
+        metrics = executor.get_metrics()
+        self.assertEqual((metrics['in_flight'], metrics['completed']), (0, 3))
+
+    def test_failed_task_releases_slot(self):
+        executor = BoundedInferenceExecutor(max_workers=1, queue_size=0)
+        with self.assertRaises(ZeroDivisionError):
+            executor.submit(lambda: 1 / 0).result(timeout=2)
+        self.assertEqual(executor.submit(lambda: 'ok').result(timeout=2), 'ok')
+
+    def test_run_inference_does_not_block_event_loop(self):
+        barrier = threading.Barrier(2, timeout=2)
+
+        async def both():
+            # 两个任务必须同时在线程池中运行才能通过屏障
+            return await asyncio.gather(run_inference(barrier.wait), run_inference(barrier.wait))
+
+        with mock.patch.object(async_utils, '_executor', BoundedInferenceExecutor(2, 0)):
+            self.assertEqual(sorted(asyncio.run(both())), [0, 1])
+
+    def test_async_csrf_exempt_keeps_coroutine(self):
+        async def view(request):
+            return 'ok'
+
+        wrapped = async_csrf_exempt(view)
+        self.assertTrue(asyncio.iscoroutinefunction(wrapped))
+        self.assertTrue(wrapped.csrf_exempt)
+        self.assertEqual(asyncio.run(wrapped(None)), 'ok')
+
+
+@override_settings(RECOGNITION_RETRY_AFTER=3)
+class SaturatedViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.executor = BoundedInferenceExecutor(max_workers=1, queue_size=0)
+        patcher = mock.patch.object(async_utils, '_executor', self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def finalize(self, session_id):
+        return Client(enforce_csrf_checks=True).post('/api/recognition/finalize/', json.dumps({'session_id': session_id}),
+                                                     content_type='application/json')
+
+    def test_busy_pool_returns_503_with_retry_after(self):
+        self.executor.submit(self.release.wait, 2)
+        response = self.finalize('s1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_request_runs_when_pool_has_room(self):
+        response = self.finalize('missing-session')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.executor.get_metrics()['completed'], 1)
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from api.audit_utils import query_audit_logs, encode_audit_cursor, decode_audit_cursor
+from api.models import AuditLog
+
+
+class AuditPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        base = timezone.make_aware(datetime(2024, 5, 1, 12, 0))
+        cls.tied = base + timedelta(minutes=5)
+        logs = []
+        for i in range(10):
+            # 第 5 到第 8 条时间戳相同，只能靠 id 区分先后
+            timestamp = cls.tied if 5 <= i <= 8 else base + timedelta(minutes=i)
+            logs.append(AuditLog(user=cls.alice if i % 2 else cls.bob, timestamp=timestamp,
+                                 action='face_recognition', liveness_status=['SUCCESS', 'FAIL', 'ERROR'][i % 3]))
+        AuditLog.objects.bulk_create(logs)
+        cls.expected = list(AuditLog.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+    def collect(self, params, limit):
+        """沿 next_cursor 翻完所有页"""
+        ids, cursor, pages = [], None, 0
+        while True:
+            page, cursor = query_audit_logs(dict(params, limit=limit, **({'before': cursor} if cursor else {})))
+            ids.extend(log.id for log in page)
+            pages += 1
+            if cursor is None:
+                return ids, pages
+
+    def test_pages_cover_every_row_once_across_timestamp_ties(self):
+        for limit in (1, 2, 3, 4, 10):
+            ids, pages = self.collect({}, limit)
+            self.assertEqual(ids, self.expected, f'limit={limit}')
+            self.assertEqual(pages, -(-len(self.expected) // limit))
+
+    def test_cursor_inside_a_tie_excludes_same_timestamp_with_higher_id(self):
+        tied_ids = sorted(AuditLog.objects.filter(timestamp=self.tied).values_list('id', flat=True))
+        cursor = f"{encode_audit_cursor(AuditLog.objects.get(id=tied_ids[2])).split(',')[0]},{tied_ids[2]}"
+        page, _ = query_audit_logs({'before': cursor, 'limit': 3})
+        self.assertEqual([log.id for log in page][:2], [tied_ids[1], tied_ids[0]])
+        self.assertLess(page[2].timestamp, self.tied)
+
+    def test_cursor_round_trip(self):
+        log = AuditLog.objects.get(id=self.expected[3])
+        self.assertEqual(decode_audit_cursor(encode_audit_cursor(log)), (log.timestamp, log.id))
+        for bad in ('abc', '1,2,3', '99999999999999999999999,1'):
+            with self.assertRaises(ValueError):
+                decode_audit_cursor(bad)
+
+    def test_status_pages_are_merged_in_order(self):
+        ids, _ = self.collect({'status': 'FAIL,ERROR'}, 2)
+        expected = list(AuditLog.objects.filter(liveness_status__in=['FAIL', 'ERROR'])
+                        .order_by('-timestamp', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_alert_statuses_limit_requested_statuses(self):
+        page, _ = query_audit_logs({'status': 'SUCCESS'}, statuses=('FAIL', 'ERROR'))
+        self.assertEqual(page, [])
+        page, _ = query_audit_logs({}, statuses=('FAIL', 'ERROR'), default_limit=100)
+        self.assertTrue(page and all(log.liveness_status in ('FAIL', 'ERROR') for log in page))
+
+    def test_filters(self):
+        page, _ = query_audit_logs({'user': 'alice', 'limit': 100})
+        self.assertEqual({log.user_id for log in page}, {self.alice.id})
+        self.assertEqual(query_audit_logs({'user': 'nobody'}), ([], None))
+        # 只有日期的 end 包含当天全部
+        page, _ = query_audit_logs({'start': '2024-05-01', 'end': '2024-05-01', 'limit': 100})
+        self.assertEqual(len(page), 10)
+        page, _ = query_audit_logs({'start': '2024-05-01T12:05:00', 'limit': 100})
+        self.assertEqual(len(page), 5)
+
+    def test_invalid_parameters(self):
+        for params in ({'limit': '0'}, {'limit': 'x'}, {'before': 'bad'}, {'start': 'yesterday'}):
+            with self.assertRaises(ValueError):
+                query_audit_logs(params)
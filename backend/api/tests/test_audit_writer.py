@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.audit_utils import AuditLogWriter
+from api.models import AuditLog, AuditLogRollup
+
+
+class RecordingWriter(AuditLogWriter):
+    """不写数据库，只记录每批日志；block 未设置时后台线程的写入会一直等待"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+        self.sync_batches = []
+        self.block = threading.Event()
+        self.block.set()
+
+    def _write(self, entries):
+        if not entries:
+            return
+        if threading.current_thread().name == 'audit-log-writer':
+            self.block.wait(2)
+            self.batches.append([entry[0] for entry in entries])
+        else:
+            self.sync_batches.append([entry[0] for entry in entries])
+
+
+class AuditLogBatchingTests(SimpleTestCase):
+
+    def test_batches_by_size_and_flush(self):
+        writer = RecordingWriter(batch_size=3, flush_interval=60)
+        for i in range(7):
+            writer.submit(f'u{i}', 'login', 'SUCCESS')
+        self.assertTrue(writer.flush(timeout=2))
+        self.assertEqual(writer.batches, [['u0', 'u1', 'u2'], ['u3', 'u4', 'u5'], ['u6']])
+
+    def test_partial_batch_written_after_interval(self):
+        writer = RecordingWriter(batch_size=100, flush_interval=0.05)
+        writer.submit('alice', 'login', 'SUCCESS')
+        deadline = time.monotonic() + 2
+        while not writer.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(writer.batches, [['alice']])
+
+    def test_full_queue_falls_back_to_synchronous_write(self):
+        writer = RecordingWriter(batch_size=1, flush_interval=60, queue_size=1, enqueue_timeout=0.01)
+        writer.block.clear()
+        writer.submit('first', 'login', 'SUCCESS')  # 后台线程取走后阻塞在写入中
+        deadline = time.monotonic() + 2
+        while writer._queue.qsize() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.submit('queued', 'login', 'SUCCESS')
+        writer.submit('overflow', 'login', 'SUCCESS')
+        # 队列满时不丢日志，在调用线程中写入
+        self.assertEqual(writer.sync_batches, [['overflow']])
+        self.assertEqual(writer.get_metrics()['sync_writes'], 1)
+        writer.block.set()
+        self.assertTrue(writer.flush(timeout=2))
+        self.assertEqual(writer.batches, [['first'], ['queued']])
+
+    def test_closed_writer_writes_synchronously(self):
+        writer = RecordingWriter()
+        writer.submit('before', 'login', 'SUCCESS')
+        writer.close(timeout=2)
+        writer.submit('after', 'login', 'SUCCESS')
+        self.assertEqual(writer.batches, [['before']])
+        self.assertEqual(writer.sync_batches, [['after']])
+
+    def test_forked_process_starts_its_own_thread(self):
+        writer = RecordingWriter()
+        writer.submit('parent', 'login', 'SUCCESS')
+        self.assertTrue(writer.flush(timeout=2))
+        parent_queue, parent_thread = writer._queue, writer._thread
+        # 模拟 fork 后的子进程：继承的队列和线程不可用，首次写入时重新创建
+        writer._pid = -1
+        writer.submit('child', 'login', 'SUCCESS')
+        self.assertEqual(writer._pid, os.getpid())
+        self.assertIsNot(writer._queue, parent_queue)
+        self.assertIsNot(writer._thread, parent_thread)
+        self.assertTrue(writer._thread.is_alive())
+
+
+class AuditLogWriteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.admin = User.objects.create_superuser('admin', password='x')
+
+    def entry(self, username, skip_admin=False):
+        return (username, timezone.now(), 'face_recognition', 'SUCCESS', 'MATCH', 0.9, None, skip_admin)
+
+    def test_batch_written_with_rollups(self):
+        writer = AuditLogWriter()
+        writer._write([self.entry('alice'), self.entry('alice'), self.entry('ghost'),
+                       self.entry('admin', skip_admin=True), self.entry('admin')])
+        self.assertEqual(list(AuditLog.objects.values_list('user__username', flat=True).order_by('id')),
+                         ['alice', 'alice', 'admin'])
+        self.assertTrue(AuditLogRollup.objects.exists())
+        metrics = writer.get_metrics()
+        self.assertEqual((metrics['written'], metrics['batches'], metrics['unknown_users']), (3, 1, 1))
+
+    def test_user_ids_cached_between_batches(self):
+        writer = AuditLogWriter()
+        writer._write([self.entry('alice')])
+        with CaptureQueriesContext(connection) as queries:
+            writer._write([self.entry('alice')])
+        # 缓存命中时不再查询用户表
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "auth_user"' in q['sql']])
+        self.assertEqual(AuditLog.objects.count(), 2)
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import utils_recognition
+from api.quality_utils import REJECT_BLURRY, rejection_analysis
+from api.session_store import MemorySessionStore
+from api.upload_utils import FrameBuffer
+from api.voting_utils import LIVENESS_PASSED
+
+
+def write_clip(path, count):
+    """写入 count 帧的 MJPG 视频，第 i 帧的像素值为 10 * i"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (32, 24))
+    for i in range(count):
+        writer.write(np.full((24, 32, 3), 10 * i, dtype=np.uint8))
+    writer.release()
+    with open(path, 'rb') as f:
+        return FrameBuffer(f.read(), name='clip.avi')
+
+
+def passed(score=0.9):
+    return {'face_detected': True, 'real_score': score, 'face': b'face', 'simulation_mode': True}
+
+
+class ClipTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.clip = write_clip(os.path.join(self.tmpdir, 'clip.avi'), 12)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+class IterClipFramesTests(ClipTestCase):
+
+    def test_stride_selects_every_nth_frame(self):
+        frames = list(utils_recognition.iter_clip_frames(self.clip, 4))
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(frames[0].shape, (24, 32, 3))
+        # MJPG 有损压缩，按帧亮度的大致值判断是第 0、4、8 帧
+        self.assertEqual([round(float(f.mean()) / 10) for f in frames], [0, 4, 8])
+
+    def test_temporary_file_removed_when_closed_early(self):
+        created = []
+        real = tempfile.NamedTemporaryFile
+
+        def record(*args, **kwargs):
+            tmp = real(*args, **kwargs)
+            created.append(tmp.name)
+            return tmp
+
+        with mock.patch.object(utils_recognition.tempfile, 'NamedTemporaryFile', side_effect=record):
+            frames = utils_recognition.iter_clip_frames(self.clip, 1)
+            next(frames)
+            frames.close()
+        self.assertEqual(len(created), 1)
+        self.assertFalse(os.path.exists(created[0]))
+
+
+@override_settings(RECOGNITION_BURST_MAX_FRAMES=32)
+class ProcessClipTests(ClipTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = MemorySessionStore(60)
+        self.store.set('s1', {'session_id': 's1', 'username': 'alice', 'num_votes': 3, 'live_threshold': 0.6,
+                              'total_votes': 0, 'votes_passed': 0, 'model_versions': {}, 'version': 0})
+        patchers = [
+            mock.patch.object(utils_recognition, 'get_recognition_session_store', return_value=self.store),
+            mock.patch.object(type(utils_recognition.model_manager), 'model_loaded', False),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_keeps_decoding_past_rejected_frames(self):
+        analyses = [rejection_analysis(REJECT_BLURRY), rejection_analysis(REJECT_BLURRY),
+                    passed(), passed(0.1), passed(), passed()]
+        with mock.patch.object(utils_recognition, 'analyze_frame_simple', side_effect=analyses) as analyze:
+            result = utils_recognition.process_clip_for_session('s1', self.clip, stride=1)
+        # 两帧被拒绝不计票，继续解码直到投票结果确定 (2/3 通过)，之后的帧不再解码
+        self.assertEqual(analyze.call_count, 5)
+        self.assertEqual(len(result['frame_results']), 5)
+        self.assertEqual(result['session_status'], LIVENESS_PASSED)
+        self.assertEqual(result['session_data']['total_votes'], 3)
+
+    def test_finalize_in_same_call(self):
+        with mock.patch.object(utils_recognition, 'analyze_frame_simple', side_effect=lambda f: passed()), \
+                mock.patch.object(utils_recognition, 'finalize_face_recognition', return_value={'success': True}):
+            result = utils_recognition.process_clip_for_session('s1', self.clip, stride=1, finalize=True)
+        self.assertEqual(result['final_result'], {'success': True})
+
+    def test_undecodable_clip_is_an_error(self):
+        with self.assertRaises(ValueError):
+            utils_recognition.process_clip_for_session('s1', FrameBuffer(b'not a video', name='clip.webm'))
+
+    def test_missing_session(self):
+        self.assertIsNone(utils_recognition.process_clip_for_session('missing', self.clip))
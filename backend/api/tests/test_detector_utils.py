@@ -0,0 +1,91 @@
+import threading
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import detector_utils
+from api.detector_utils import (
+    CascadeFaceDetector, build_face_detector, detect_faces, get_detector_config, get_face_detector,
+    prepare_detection_image,
+)
+
+
+class RecordingDetector:
+    """记录检测时的图像尺寸和最小人脸尺寸，返回缩小后图像上的一个固定人脸框"""
+    needs_color = False
+    window = 24
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, image, min_size, max_size=None):
+        self.calls.append((image.shape, min_size))
+        return np.array([[100, 100, 48, 48]], dtype=np.float32)
+
+
+class DetectorConfigTests(SimpleTestCase):
+
+    @override_settings(FACE_DETECTOR_BACKEND=None, FACE_CASCADE_PATH='/models/lbpcascade_frontalface.xml')
+    def test_backend_inferred_from_cascade_path(self):
+        self.assertEqual(get_detector_config()['backend'], 'lbp')
+
+    @override_settings(FACE_DETECTOR_BACKEND=None, FACE_CASCADE_PATH=None)
+    def test_defaults_to_haar(self):
+        self.assertEqual(get_detector_config()['backend'], 'haar')
+
+    @override_settings(FACE_DETECTOR_BACKEND='yunet', FACE_CASCADE_PATH='/models/lbpcascade_frontalface.xml')
+    def test_explicit_backend_wins(self):
+        self.assertEqual(get_detector_config()['backend'], 'yunet')
+
+
+class DetectionScaleTests(SimpleTestCase):
+
+    def test_downscale_to_max_side(self):
+        image, scale = prepare_detection_image(np.zeros((1080, 1920, 3), dtype=np.uint8), False, 640)
+        self.assertAlmostEqual(scale, 1 / 3)
+        self.assertEqual(image.shape, (360, 640))
+
+    def test_min_scale_floor(self):
+        image, scale = prepare_detection_image(np.zeros((1080, 1920, 3), dtype=np.uint8), False, 320, 0.5)
+        self.assertEqual(scale, 0.5)
+        self.assertEqual(image.shape, (540, 960))
+
+    @override_settings(FACE_DETECT_MAX_SIDE=320, FACE_DETECT_MIN_SIZE=30)
+    def test_min_face_stays_above_detector_window(self):
+        detector = RecordingDetector()
+        with mock.patch.object(detector_utils, 'get_face_detector', return_value=detector):
+            faces = detect_faces(np.zeros((1080, 1920, 3), dtype=np.uint8))
+        (shape, min_size), = detector.calls
+        # 30 像素的人脸缩小后仍为 24 像素，不会被缩到检测窗口以下
+        self.assertEqual(min_size, 24)
+        self.assertEqual(shape, (864, 1536))
+        np.testing.assert_array_equal(faces, [[125, 125, 60, 60]])
+
+    @override_settings(FACE_DETECT_MAX_SIDE=320, FACE_DETECT_MIN_SIZE=144)
+    def test_large_min_size_allows_full_downscale(self):
+        detector = RecordingDetector()
+        with mock.patch.object(detector_utils, 'get_face_detector', return_value=detector):
+            detect_faces(np.zeros((1080, 1920, 3), dtype=np.uint8))
+        (shape, min_size), = detector.calls
+        self.assertEqual(shape, (180, 320))
+        self.assertEqual(min_size, 24)
+
+
+class DetectorRegistryTests(SimpleTestCase):
+
+    def test_detector_reused_per_thread(self):
+        first = get_face_detector()
+        self.assertIs(get_face_detector(), first)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(get_face_detector()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], first)
+
+    def test_missing_model_falls_back_to_haar(self):
+        config = dict(get_detector_config(), backend='yunet', yunet_model_path='/missing.onnx')
+        detector = build_face_detector(config)
+        self.assertIsInstance(detector, CascadeFaceDetector)
+        self.assertEqual(detector.backend, 'haar')
+        self.assertEqual(detector.window, 24)
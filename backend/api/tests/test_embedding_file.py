@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import embedding_utils
+from api.embedding_utils import (
+    encode_embedding, decode_embedding, save_identity_embedding, load_identity_embedding,
+    delete_identity_embedding, embedding_path, legacy_embedding_path, embedding_file_suffix, embedding_distance,
+)
+
+ACTIVE = {'model_name': 'Facenet', 'model_version': '1'}
+NEXT = {'model_name': 'Facenet', 'model_version': '2.0'}
+
+
+class EmbeddingCodecTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        vector = np.linspace(-1, 1, 128, dtype=np.float32)
+        decoded, model_name, model_version = decode_embedding(encode_embedding(vector, 'ArcFace', 'v3'))
+        np.testing.assert_array_equal(decoded, vector)
+        self.assertEqual((model_name, model_version), ('ArcFace', 'v3'))
+        self.assertEqual(decoded.dtype, np.float32)
+
+    def test_header_size(self):
+        data = encode_embedding(np.zeros(4), 'A', 'BC')
+        # 魔数 4 + 格式版本 1 + 长度 1 + 2，模型名和版本，维度 4，向量 4 * 4
+        self.assertEqual(len(data), 8 + 3 + 4 + 16)
+
+    def test_rejects_unknown_format(self):
+        data = bytearray(encode_embedding(np.zeros(4), 'A', '1'))
+        with self.assertRaises(ValueError):
+            decode_embedding(b'XXXX' + bytes(data[4:]))
+        data[4] = 99
+        with self.assertRaises(ValueError):
+            decode_embedding(bytes(data))
+
+    def test_distance_metrics(self):
+        a, b = np.array([1.0, 0.0]), np.array([0.0, 2.0])
+        self.assertAlmostEqual(embedding_distance(a, b, 'cosine'), 1.0)
+        self.assertAlmostEqual(embedding_distance(a, b, 'euclidean'), np.sqrt(5), places=6)
+        self.assertAlmostEqual(embedding_distance(a, b, 'euclidean_l2'), np.sqrt(2), places=6)
+
+
+class IdentityEmbeddingFileTests(SimpleTestCase):
+
+    def setUp(self):
+        self.faces_dir = tempfile.mkdtemp()
+        override = override_settings(FACES_DATABASE_PATH=self.faces_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        embedding_utils._cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.faces_dir, ignore_errors=True)
+
+    def test_each_model_version_has_its_own_file(self):
+        save_identity_embedding('alice', np.ones(8), ACTIVE)
+        save_identity_embedding('alice', np.arange(8), NEXT)
+        self.assertEqual(sorted(os.listdir(self.faces_dir)), ['alice.Facenet-1.emb', 'alice.Facenet-2_0.emb'])
+        np.testing.assert_array_equal(load_identity_embedding('alice', ACTIVE), np.ones(8))
+        np.testing.assert_array_equal(load_identity_embedding('alice', NEXT), np.arange(8))
+
+    def test_missing_or_mismatched_file_returns_none(self):
+        self.assertIsNone(load_identity_embedding('nobody', ACTIVE))
+        # 文件名对应的标签与文件内容不一致 (例如手工复制) 时不使用
+        with open(embedding_path('bob', ACTIVE), 'wb') as f:
+            f.write(encode_embedding(np.ones(8), 'Facenet', 'other'))
+        self.assertIsNone(load_identity_embedding('bob', ACTIVE))
+
+    def test_legacy_file_is_read_when_labels_match(self):
+        with open(legacy_embedding_path('carol'), 'wb') as f:
+            f.write(encode_embedding(np.full(8, 3.0), 'Facenet', '1'))
+        np.testing.assert_array_equal(load_identity_embedding('carol', ACTIVE), np.full(8, 3.0))
+        self.assertIsNone(load_identity_embedding('carol', NEXT))
+
+    def test_cache_follows_file_changes(self):
+        save_identity_embedding('alice', np.ones(8), ACTIVE)
+        path = embedding_path('alice', ACTIVE)
+        with open(path, 'wb') as f:
+            f.write(encode_embedding(np.zeros(8), 'Facenet', '1'))
+        os.utime(path, (0, os.path.getmtime(path) + 5))
+        np.testing.assert_array_equal(load_identity_embedding('alice', ACTIVE), np.zeros(8))
+
+    def test_delete_removes_all_versions_of_one_user_only(self):
+        save_identity_embedding('alice', np.ones(8), ACTIVE)
+        save_identity_embedding('alice', np.ones(8), NEXT)
+        save_identity_embedding('alice.b', np.ones(8), ACTIVE)
+        with open(legacy_embedding_path('alice'), 'wb') as f:
+            f.write(encode_embedding(np.ones(8), 'Facenet', '1'))
+        with open(legacy_embedding_path('alice.b'), 'wb') as f:
+            f.write(encode_embedding(np.ones(8), 'Facenet', '1'))
+        delete_identity_embedding('alice')
+        self.assertEqual(sorted(os.listdir(self.faces_dir)), ['alice.b.Facenet-1.emb', 'alice.b.emb'])
+        self.assertIsNone(load_identity_embedding('alice', ACTIVE))
+
+    def test_file_suffix_has_no_extra_dots(self):
+        suffix = embedding_file_suffix({'model_name': 'Face.net', 'model_version': '1.2/3'})
+        self.assertEqual(suffix, '.Face_net-1_2_3.emb')
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from api import utils_recognition
+from api.index_utils import EmbeddingIndex, metric_distance, META_FILE, USERNAMES_FILE
+
+CONFIG = {'model_name': 'Facenet', 'model_version': '1'}
+OTHER = {'model_name': 'Facenet', 'model_version': '2'}
+
+
+def vector(seed):
+    return np.random.default_rng(seed).standard_normal(32).astype(np.float32)
+
+
+class EmbeddingIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def index(self):
+        return EmbeddingIndex(self.path)
+
+    def fill(self, index, count):
+        for i in range(count):
+            index.add(f'u{i}', vector(i), CONFIG)
+
+    def test_search_returns_nearest_first(self):
+        index = self.index()
+        self.fill(index, 20)
+        results = index.search(vector(7) + 0.01 * vector(100), 3, CONFIG)
+        self.assertEqual(results[0][0], 'u7')
+        self.assertLess(results[0][1], 0.01)
+        self.assertEqual([d for _, d in results], sorted(d for _, d in results))
+
+    def test_other_instance_sees_adds_and_removes(self):
+        writer, reader = self.index(), self.index()
+        self.fill(writer, 10)
+        self.assertEqual(reader.search(vector(9), 1, CONFIG)[0][0], 'u9')
+        writer.remove('u3')
+        writer.add('u9', vector(50), CONFIG)  # 更新已有用户不新增行
+        self.assertEqual(reader.stats()['count'], 9)
+        self.assertNotIn('u3', [name for name, _ in reader.search(vector(3), 9, CONFIG)])
+        self.assertEqual(reader.search(vector(50), 1, CONFIG)[0][0], 'u9')
+        self.assertEqual(set(reader._row_of), {f'u{i}' for i in range(10)} - {'u3'})
+
+    def test_meta_does_not_grow_with_users(self):
+        index = self.index()
+        self.fill(index, 50)
+        with open(os.path.join(self.path, META_FILE)) as f:
+            meta = json.load(f)
+        self.assertNotIn('usernames', meta)
+        self.assertEqual(meta['journal_records'], 50)
+
+    def test_journal_is_compacted(self):
+        index = self.index()
+        self.fill(index, 2)
+        for _ in range(600):
+            index.add('tmp', vector(99), CONFIG)
+            index.remove('tmp')
+        self.assertLessEqual(index.meta['journal_records'], 2 * index.meta['count'] + 1024 + 2)
+        reader = self.index()
+        self.assertEqual([name for name, _ in reader.search(vector(1), 5, CONFIG)], ['u1', 'u0'])
+
+    def test_uncommitted_journal_tail_is_ignored(self):
+        index = self.index()
+        self.fill(index, 3)
+        with open(os.path.join(self.path, USERNAMES_FILE), 'ab') as f:
+            f.write(b'[3, "ghost"]\n')  # 写入中断：meta.json 未记录这部分
+        reader = self.index()
+        self.assertEqual(reader.stats()['count'], 3)
+        self.assertNotIn('ghost', reader._row_of)
+        index.add('u3', vector(3), CONFIG)
+        self.assertEqual(self.index().search(vector(3), 1, CONFIG)[0][0], 'u3')
+
+    def test_legacy_meta_with_usernames_is_migrated(self):
+        index = self.index()
+        self.fill(index, 4)
+        meta = dict(index.meta, usernames=['u0', 'u1', 'u2', 'u3'])
+        for key in ('generation', 'journal_size', 'journal_records'):
+            meta.pop(key)
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+        os.remove(os.path.join(self.path, USERNAMES_FILE))
+        legacy = self.index()
+        self.assertEqual(legacy.search(vector(2), 1, CONFIG)[0][0], 'u2')
+        legacy.add('u4', vector(4), CONFIG)
+        reader = self.index()
+        self.assertEqual(reader.search(vector(4), 1, CONFIG)[0][0], 'u4')
+        self.assertNotIn('usernames', reader.meta)
+
+    def test_refuses_other_model_versions(self):
+        index = self.index()
+        self.fill(index, 2)
+        self.assertTrue(index.matches(CONFIG))
+        self.assertFalse(index.matches(OTHER))
+        with self.assertRaises(ValueError):
+            index.search(vector(0), 1, OTHER)
+        with self.assertRaises(ValueError):
+            index.add('u9', vector(9), OTHER)
+
+    def test_metric_distance(self):
+        a, b = vector(1), vector(2)
+        a, b = a / np.linalg.norm(a), b / np.linalg.norm(b)
+        cosine = float(1 - a @ b)
+        self.assertEqual(metric_distance(cosine, 'cosine'), cosine)
+        self.assertAlmostEqual(metric_distance(cosine, 'euclidean_l2'), float(np.linalg.norm(a - b)), places=5)
+        self.assertIsNone(metric_distance(cosine, 'euclidean'))
+
+
+class IdentifyFaceTests(SimpleTestCase):
+    """1:N 识别按会话的距离度量对前 k 个候选重新排序"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.query = vector(100)
+        # 方向与查询完全一致但模长是 10 倍 (余弦最近)；另一个用户加了少量噪声 (欧氏最近)
+        self.identities = {
+            'same_direction': self.query * 10,
+            'close_vector': self.query + 0.05 * vector(101),
+            'stranger': vector(102),
+        }
+        self.index = EmbeddingIndex(self.path)
+        for username, embedding in self.identities.items():
+            self.index.add(username, embedding, CONFIG)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def identify(self, metric, threshold):
+        config = dict(CONFIG, distance_metric=metric, threshold=threshold)
+        with mock.patch.object(utils_recognition, 'model_manager', mock.Mock(deepface_available=True)), \
+                mock.patch.object(utils_recognition, 'get_embedding_index', return_value=self.index), \
+                mock.patch.object(utils_recognition, 'session_embedding_config', return_value=config), \
+                mock.patch.object(utils_recognition, 'get_session_live_embedding', return_value=self.query), \
+                mock.patch.object(utils_recognition, 'load_identity_embedding',
+                                  side_effect=lambda username, config: self.identities[username]), \
+                mock.patch.object(utils_recognition, 'add_audit_log_entry') as audit:
+            result = utils_recognition.identify_face(session_data={'session_id': 's1'})
+        return result, audit
+
+    def test_euclidean_reranks_candidates(self):
+        result, audit = self.identify('euclidean', 10.0)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['username'], 'close_vector')
+        audit.assert_called_once()
+
+    def test_cosine_uses_index_order(self):
+        result, _ = self.identify('cosine', 0.4)
+        self.assertEqual(result['username'], 'same_direction')
+
+    def test_threshold_applies_to_reranked_distance(self):
+        result, audit = self.identify('euclidean', 0.01)
+        self.assertFalse(result['success'])
+        audit.assert_not_called()
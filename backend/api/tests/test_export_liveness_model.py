@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api.inference_utils import preprocess_liveness_face, preprocess_liveness_frame
+from api.management.commands import export_liveness_model
+from api.management.commands.export_liveness_model import load_image_tensors
+
+BOX = np.array([40, 30, 60, 60], dtype=np.int32)
+
+
+class LoadImageTensorsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        for name in ('a.png', 'b.png', 'c.png'):
+            cv2.imwrite(os.path.join(self.folder, name), rng.integers(0, 255, (120, 160, 3), dtype=np.uint8))
+        open(os.path.join(self.folder, 'notes.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def detect(self, image):
+        # 第二张图片 (按文件名排序) 没有人脸
+        self.calls += 1
+        return np.empty((0, 4), dtype=np.int32) if self.calls == 2 else BOX[np.newaxis]
+
+    @override_settings(LIVENESS_FACE_ROI=True, LIVENESS_FACE_MARGIN=0.25)
+    def test_uses_face_crops_like_serving(self):
+        self.calls = 0
+        with mock.patch.object(export_liveness_model, 'detect_faces', side_effect=self.detect):
+            tensors = load_image_tensors(self.folder, 10)
+        self.assertEqual(len(tensors), 2)
+        image = cv2.imread(os.path.join(self.folder, 'a.png'), cv2.IMREAD_COLOR)
+        np.testing.assert_allclose(tensors[0], preprocess_liveness_face(image, BOX, 0.25))
+        # 每张图片有自己的数组，不共用预处理缓冲区
+        self.assertFalse(np.shares_memory(tensors[0], tensors[1]))
+
+    @override_settings(LIVENESS_FACE_ROI=False)
+    def test_whole_frame_when_roi_disabled(self):
+        with mock.patch.object(export_liveness_model, 'detect_faces') as detect:
+            tensors = load_image_tensors(self.folder, 2)
+        detect.assert_not_called()
+        self.assertEqual(len(tensors), 2)
+        image = cv2.imread(os.path.join(self.folder, 'a.png'), cv2.IMREAD_COLOR)
+        np.testing.assert_allclose(tensors[0], preprocess_liveness_frame(image))
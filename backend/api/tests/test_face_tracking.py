@@ -0,0 +1,96 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import detector_utils, utils_recognition
+from api.detector_utils import detect_faces_near, detect_faces_tracked
+from api.quality_utils import REJECT_NO_FACE, rejection_analysis
+
+
+class RoiDetector:
+    """记录检测区域和尺寸范围，返回 ROI 坐标下的固定人脸框"""
+    needs_color = False
+    window = 24
+
+    def __init__(self, boxes=((20, 20, 100, 100),)):
+        self.boxes = boxes
+        self.calls = []
+
+    def detect(self, image, min_size, max_size=None):
+        self.calls.append((image.shape, min_size, max_size))
+        return np.array(self.boxes, dtype=np.float32).reshape(-1, 4)
+
+
+class DetectFacesNearTests(SimpleTestCase):
+
+    def setUp(self):
+        self.frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    def detect_near(self, detector, box):
+        with mock.patch.object(detector_utils, 'get_face_detector', return_value=detector):
+            return detect_faces_near(self.frame, box)
+
+    def test_searches_padded_roi_at_native_resolution(self):
+        detector = RoiDetector()
+        faces = self.detect_near(detector, (800, 400, 100, 100))
+        (shape, min_size, max_size), = detector.calls
+        # 四周各扩展半个人脸，不缩小；尺寸限制在上一帧的 0.7 ~ 1.4 倍
+        self.assertEqual(shape, (200, 200))
+        self.assertEqual((min_size, max_size), (70, 140))
+        np.testing.assert_array_equal(faces, [[770, 370, 100, 100]])
+
+    def test_roi_clipped_at_frame_edge(self):
+        detector = RoiDetector()
+        faces = self.detect_near(detector, (0, 0, 100, 100))
+        self.assertEqual(detector.calls[0][0], (150, 150))
+        np.testing.assert_array_equal(faces, [[20, 20, 100, 100]])
+
+    def test_tracked_hit_skips_full_frame_detection(self):
+        with mock.patch.object(detector_utils, 'get_face_detector', return_value=RoiDetector()), \
+                mock.patch.object(detector_utils, 'detect_faces') as full:
+            faces, tracked = detect_faces_tracked(self.frame, (800, 400, 100, 100))
+        self.assertTrue(tracked)
+        self.assertEqual(len(faces), 1)
+        full.assert_not_called()
+
+    def test_lost_face_falls_back_to_full_frame(self):
+        with mock.patch.object(detector_utils, 'get_face_detector', return_value=RoiDetector(boxes=())), \
+                mock.patch.object(detector_utils, 'detect_faces', return_value=np.array([[1, 2, 3, 4]])) as full:
+            faces, tracked = detect_faces_tracked(self.frame, (800, 400, 100, 100))
+        self.assertFalse(tracked)
+        full.assert_called_once()
+        np.testing.assert_array_equal(faces, [[1, 2, 3, 4]])
+
+
+def detected(box, tracked):
+    return {'face_detected': True, 'real_score': 0.9, 'face': b'face', 'simulation_mode': True,
+            'face_box': list(box), 'tracked': tracked}
+
+
+@override_settings(FACE_TRACKING_ENABLED=True, FACE_TRACKING_REDETECT_EVERY=2)
+class SessionTrackTests(SimpleTestCase):
+
+    def setUp(self):
+        self.session_data = {'session_id': 's1', 'num_votes': 10, 'live_threshold': 0.6,
+                             'total_votes': 0, 'votes_passed': 0}
+
+    def apply(self, analysis):
+        utils_recognition.apply_frame_analysis(self.session_data, analysis)
+        return utils_recognition.session_frame_hints(self.session_data)['track_box']
+
+    def test_full_frame_redetect_after_streak(self):
+        self.assertEqual(self.apply(detected((10, 10, 50, 50), False)), [10, 10, 50, 50])
+        self.assertEqual(self.apply(detected((12, 10, 50, 50), True)), [12, 10, 50, 50])
+        # 连续跟踪 FACE_TRACKING_REDETECT_EVERY 帧后下一帧做整帧检测
+        self.assertIsNone(self.apply(detected((14, 10, 50, 50), True)))
+        self.assertEqual(self.apply(detected((14, 10, 50, 50), False)), [14, 10, 50, 50])
+
+    def test_lost_face_clears_track(self):
+        self.apply(detected((10, 10, 50, 50), False))
+        self.assertIsNone(self.apply(rejection_analysis(REJECT_NO_FACE)))
+        self.assertNotIn('face_track', self.session_data)
+
+    @override_settings(FACE_TRACKING_ENABLED=False)
+    def test_tracking_can_be_disabled(self):
+        self.assertIsNone(self.apply(detected((10, 10, 50, 50), False)))
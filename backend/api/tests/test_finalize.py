@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import utils_recognition
+from api.voting_utils import LIVENESS_PASSED
+
+
+def passed_session(face):
+    return {'session_id': 's1', 'username': 'alice', 'num_votes': 3, 'live_threshold': 0.6,
+            'total_votes': 2, 'votes_passed': 2, 'liveness_decision': LIVENESS_PASSED,
+            'last_valid_face': face, 'model_versions': {}}
+
+
+class FinalizeInMemoryTests(SimpleTestCase):
+    """投票阶段保存的人脸直接在内存中提取特征，不写临时文件"""
+
+    def setUp(self):
+        self.faces_dir = tempfile.mkdtemp()
+        open(os.path.join(self.faces_dir, 'alice.jpg'), 'wb').close()
+        override = override_settings(FACES_DATABASE_PATH=self.faces_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.face = np.full((32, 32, 3), 120, dtype=np.uint8)
+        self.vector = np.linspace(-1, 1, 16, dtype=np.float32)
+        patchers = [
+            mock.patch.object(type(utils_recognition.model_manager), 'deepface_available', True),
+            mock.patch.object(utils_recognition, 'add_audit_log_entry'),
+            mock.patch.object(utils_recognition, 'get_or_create_identity_embedding', return_value=self.vector),
+            mock.patch.object(utils_recognition.tempfile, 'NamedTemporaryFile',
+                              side_effect=AssertionError('不应写临时文件')),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.faces_dir)
+
+    def test_decoded_face_is_embedded_directly(self):
+        with mock.patch.object(utils_recognition, 'compute_embedding', return_value=self.vector) as compute:
+            result = utils_recognition.finalize_face_recognition_real(passed_session(self.face))
+        self.assertTrue(result['success'], result)
+        self.assertIs(compute.call_args[0][0], self.face)
+
+    def test_encoded_face_is_decoded_in_memory(self):
+        encoded = cv2.imencode('.png', self.face)[1].tobytes()
+        with mock.patch.object(utils_recognition, 'compute_embedding', return_value=self.vector) as compute:
+            result = utils_recognition.finalize_face_recognition_real(passed_session(encoded))
+        self.assertTrue(result['success'], result)
+        np.testing.assert_array_equal(compute.call_args[0][0], self.face)
+
+    def test_embedding_error_is_reported(self):
+        with mock.patch.object(utils_recognition, 'compute_embedding', side_effect=RuntimeError('boom')):
+            result = utils_recognition.finalize_face_recognition_real(passed_session(self.face))
+        self.assertFalse(result['success'])
+        self.assertIn('boom', result['message'])
+
+    def test_missing_face_is_not_matched(self):
+        with mock.patch.object(utils_recognition, 'compute_embedding') as compute:
+            result = utils_recognition.finalize_face_recognition_real(passed_session(None))
+        self.assertFalse(result['success'])
+        compute.assert_not_called()
+
+
+@override_settings(RECOGNITION_INCREMENTAL_EMBEDDING=False)
+class PassedFaceBufferTests(SimpleTestCase):
+
+    def test_passed_frames_reuse_session_buffer(self):
+        session_data = passed_session(None)
+        session_data.update(total_votes=0, votes_passed=0, num_votes=5, liveness_decision=None)
+        first = np.full((8, 8, 3), 1, dtype=np.uint8)
+        second = np.full((8, 8, 3), 2, dtype=np.uint8)
+        utils_recognition.apply_frame_analysis(session_data, {'face_detected': True, 'real_score': 0.9, 'face': first})
+        buffer = session_data['last_valid_face']
+        utils_recognition.apply_frame_analysis(session_data, {'face_detected': True, 'real_score': 0.9, 'face': second})
+        # 同尺寸的人脸写入同一块缓冲区，会话中保存的是数据的拷贝而不是帧本身
+        self.assertIs(session_data['last_valid_face'], buffer)
+        self.assertIsNot(buffer, second)
+        np.testing.assert_array_equal(buffer, second)
@@ -0,0 +1,81 @@
+import io
+import struct
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, Client, override_settings
+
+from api.upload_utils import frame_buffer
+from api.utils_recognition import FrameDataTooLarge, read_length_prefixed_frames
+
+
+def length_prefixed(*frames):
+    return b''.join(struct.pack('<I', len(frame)) + frame for frame in frames)
+
+
+class TrickleStream(io.BytesIO):
+    """每次最多返回 3 字节，模拟分多次到达的请求体"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size and size > 0 else 3)
+
+
+class LengthPrefixedFramesTests(SimpleTestCase):
+
+    def parse(self, data, max_frames=32, max_frame_bytes=1024, stream_class=io.BytesIO):
+        return read_length_prefixed_frames(stream_class(data), max_frames, max_frame_bytes)
+
+    def test_parses_frames_in_order(self):
+        frames = self.parse(length_prefixed(b'first', b'', b'third'))
+        self.assertEqual([bytes(frame_buffer(f)) for f in frames], [b'first', b'', b'third'])
+        self.assertEqual([f.name for f in frames], ['frame0.jpg', 'frame1.jpg', 'frame2.jpg'])
+
+    def test_short_reads_are_reassembled(self):
+        frames = self.parse(length_prefixed(b'abcdefgh', b'ij'), stream_class=TrickleStream)
+        self.assertEqual([bytes(frame_buffer(f)) for f in frames], [b'abcdefgh', b'ij'])
+
+    def test_empty_body(self):
+        self.assertEqual(self.parse(b''), [])
+
+    def test_truncated_prefix(self):
+        with self.assertRaisesMessage(ValueError, '帧长度前缀不完整'):
+            self.parse(length_prefixed(b'abc') + b'\x01\x00')
+
+    def test_truncated_frame(self):
+        with self.assertRaisesMessage(ValueError, '帧数据长度不足'):
+            self.parse(length_prefixed(b'abcdef')[:-2])
+
+    def test_too_many_frames(self):
+        with self.assertRaises(FrameDataTooLarge):
+            self.parse(length_prefixed(b'a', b'b', b'c'), max_frames=2)
+
+    def test_oversized_frame_is_rejected_before_reading(self):
+        stream = io.BytesIO(struct.pack('<I', 4096) + b'x' * 4096)
+        with self.assertRaises(FrameDataTooLarge):
+            read_length_prefixed_frames(stream, 32, 1024)
+        self.assertEqual(stream.tell(), 4)
+
+
+class BurstUploadLimitTests(SimpleTestCase):
+
+    @override_settings(RECOGNITION_FRAME_MAX_BYTES=16)
+    def test_oversized_octet_stream_frame_returns_413(self):
+        response = Client().post('/api/recognition/process_burst/?session_id=none', length_prefixed(b'x' * 17),
+                                 content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(RECOGNITION_BURST_MAX_FRAMES=2)
+    def test_too_many_octet_stream_frames_returns_413(self):
+        response = Client().post('/api/recognition/process_burst/?session_id=none', length_prefixed(b'a', b'b', b'c'),
+                                 content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(RECOGNITION_BURST_MAX_FRAMES=2)
+    def test_too_many_multipart_frames_returns_413(self):
+        frames = [SimpleUploadedFile(f'{i}.jpg', b'x', 'image/jpeg') for i in range(3)]
+        response = Client().post('/api/recognition/process_burst/', {'session_id': 'none', 'frames': frames})
+        self.assertEqual(response.status_code, 413)
+
+    def test_malformed_octet_stream_returns_400(self):
+        response = Client().post('/api/recognition/process_burst/?session_id=none', b'\x05\x00',
+                                 content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
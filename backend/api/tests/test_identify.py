@@ -0,0 +1,48 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api import utils_recognition
+from api.voting_utils import LIVENESS_FAILED, LIVENESS_PASSED
+
+
+def identify_session(decision):
+    return {
+        'session_id': 's1', 'username': None, 'num_votes': 3, 'live_threshold': 0.6,
+        'total_votes': 3, 'votes_passed': 3 if decision == LIVENESS_PASSED else 0,
+        'liveness_decision': decision, 'last_valid_face': None, 'model_versions': {},
+    }
+
+
+class FinalizeIdentifySessionTests(SimpleTestCase):
+    """1:N 识别会话 (未指定用户名) 完成时只做 1:N 识别"""
+
+    def finalize(self, session_data):
+        with mock.patch.object(utils_recognition, 'identify_face',
+                               return_value={'success': True, 'username': 'alice'}) as identify, \
+                mock.patch.object(utils_recognition, 'finalize_face_recognition_real') as real, \
+                mock.patch.object(utils_recognition, 'finalize_face_recognition_simple') as simple, \
+                mock.patch.object(utils_recognition, 'add_audit_log_entry') as audit:
+            result = utils_recognition.finalize_face_recognition(session_data)
+        real.assert_not_called()
+        simple.assert_not_called()
+        audit.assert_not_called()
+        return result, identify
+
+    def test_passed_session_is_identified(self):
+        session_data = identify_session(LIVENESS_PASSED)
+        result, identify = self.finalize(session_data)
+        identify.assert_called_once_with(session_data=session_data)
+        self.assertEqual(result['username'], 'alice')
+
+    def test_failed_session_is_not_identified(self):
+        result, identify = self.finalize(identify_session(LIVENESS_FAILED))
+        identify.assert_not_called()
+        self.assertFalse(result['success'])
+
+    def test_finalize_session_by_id(self):
+        session_data = identify_session(LIVENESS_PASSED)
+        with mock.patch.object(utils_recognition, 'get_recognition_session', return_value=session_data), \
+                mock.patch.object(utils_recognition, 'identify_face', return_value={'success': True}) as identify:
+            utils_recognition.finalize_session('s1')
+        identify.assert_called_once_with(session_data=session_data)
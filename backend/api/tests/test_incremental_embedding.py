@@ -0,0 +1,77 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import embedding_utils, utils_recognition
+from api.embedding_utils import update_running_mean, submit_session_embedding
+from api.session_store import MemorySessionStore
+
+
+class RunningMeanTests(SimpleTestCase):
+
+    def test_mean_of_normalized_embeddings(self):
+        session_data = {}
+        update_running_mean(session_data, [3.0, 0.0])
+        update_running_mean(session_data, [0.0, 0.5])
+        # 每帧先归一化，长度不同的特征权重相同
+        np.testing.assert_allclose(session_data['embedding_mean'], [0.5, 0.5])
+        self.assertEqual(session_data['embedding_count'], 2)
+
+
+class SubmitSessionEmbeddingTests(SimpleTestCase):
+
+    def test_result_passed_to_callback(self):
+        results = []
+        with mock.patch.object(embedding_utils, 'compute_embedding', return_value=np.ones(4)):
+            submit_session_embedding('s1', 'face', lambda sid, emb: results.append((sid, emb))).result(timeout=2)
+        self.assertEqual(results[0][0], 's1')
+        np.testing.assert_array_equal(results[0][1], np.ones(4))
+
+    def test_failure_reported_as_none(self):
+        results = []
+        with mock.patch.object(embedding_utils, 'compute_embedding', side_effect=RuntimeError('no face')):
+            submit_session_embedding('s1', 'face', lambda sid, emb: results.append(emb)).result(timeout=2)
+        self.assertEqual(results, [None])
+
+
+@override_settings(RECOGNITION_INCREMENTAL_EMBEDDING=True, RECOGNITION_EMBEDDING_POLL_INTERVAL=0.01)
+class IncrementalSessionEmbeddingTests(SimpleTestCase):
+    """投票阶段通过的帧在后台提取特征，识别阶段直接使用会话中的特征均值"""
+
+    def setUp(self):
+        self.store = MemorySessionStore(60)
+        self.store.set('s1', {'session_id': 's1', 'num_votes': 5, 'live_threshold': 0.6, 'total_votes': 0,
+                              'votes_passed': 0, 'model_versions': {}, 'version': 0})
+        patchers = [
+            mock.patch.object(utils_recognition, 'get_recognition_session_store', return_value=self.store),
+            mock.patch.object(type(utils_recognition.model_manager), 'deepface_available', True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def analysis(self, value, score=0.9):
+        return {'face_detected': True, 'real_score': score, 'face': np.full((4, 4, 3), value, dtype=np.uint8)}
+
+    def embed(self, face, config=None):
+        return np.array([1.0, 0.0]) if face[0, 0, 0] == 1 else np.array([0.0, 1.0])
+
+    def test_passed_frames_are_averaged(self):
+        with mock.patch.object(embedding_utils, 'compute_embedding', side_effect=self.embed) as compute:
+            utils_recognition.apply_analyses_to_session(
+                's1', [self.analysis(1), self.analysis(2), self.analysis(3, score=0.1)])
+            session_data = self.store.get('s1')
+            live = utils_recognition.get_session_live_embedding(session_data)
+        # 未通过的帧不提取特征；会话不保存原始帧
+        self.assertEqual(compute.call_count, 2)
+        self.assertEqual(session_data['embedding_frames'], 2)
+        self.assertIsNone(session_data.get('last_valid_face'))
+        np.testing.assert_allclose(live, [0.5, 0.5])
+
+    def test_failed_extractions_do_not_block_finalize(self):
+        with mock.patch.object(embedding_utils, 'compute_embedding', side_effect=RuntimeError('no face')):
+            utils_recognition.apply_analyses_to_session('s1', [self.analysis(1)])
+            live = utils_recognition.get_session_live_embedding(self.store.get('s1'))
+        self.assertIsNone(live)
+        self.assertEqual(self.store.get('s1')['embedding_failed'], 1)
@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api.inference_utils import LivenessBatchScheduler, create_liveness_scheduler
+
+
+class RecordingModel:
+    """记录每次调用的批大小，输出每个样本的均值"""
+
+    def __init__(self, release=None):
+        self.batch_sizes = []
+        self.release = release
+
+    def __call__(self, batch):
+        if self.release is not None:
+            self.release.wait(2)
+        self.batch_sizes.append(len(batch))
+        means = batch.reshape(len(batch), -1).mean(axis=1)
+        return np.stack([1.0 - means, means], axis=1)
+
+
+def sample(value):
+    return np.full((1, 4, 4, 3), value, dtype=np.float32)
+
+
+class LivenessBatchSchedulerTests(SimpleTestCase):
+
+    def test_single_prediction(self):
+        scheduler = LivenessBatchScheduler(RecordingModel(), max_wait_ms=0)
+        np.testing.assert_allclose(scheduler.predict(sample(0.25)), [0.75, 0.25])
+
+    def test_concurrent_requests_share_a_batch(self):
+        release = threading.Event()
+        model = RecordingModel(release)
+        scheduler = LivenessBatchScheduler(model, max_batch_size=8, max_wait_ms=50)
+        futures = [scheduler.submit(sample(i / 10)) for i in range(5)]
+        release.set()
+        results = [future.result(timeout=2) for future in futures]
+        # 每个请求拿回自己那一行
+        np.testing.assert_allclose([row[1] for row in results], [i / 10 for i in range(5)], atol=1e-6)
+        self.assertEqual(sum(model.batch_sizes), 5)
+        self.assertLess(len(model.batch_sizes), 5)
+        metrics = scheduler.get_metrics()
+        self.assertEqual(metrics['items'], 5)
+        self.assertEqual(metrics['batches'], len(model.batch_sizes))
+
+    def test_batch_size_capped(self):
+        release = threading.Event()
+        model = RecordingModel(release)
+        scheduler = LivenessBatchScheduler(model, max_batch_size=2, max_wait_ms=50)
+        futures = [scheduler.submit(sample(0.5)) for _ in range(5)]
+        release.set()
+        for future in futures:
+            future.result(timeout=2)
+        self.assertLessEqual(max(model.batch_sizes), 2)
+
+    def test_sample_copied_on_submit(self):
+        release = threading.Event()
+        scheduler = LivenessBatchScheduler(RecordingModel(release), max_wait_ms=0)
+        buffer = sample(0.2)
+        future = scheduler.submit(buffer)
+        # 预处理复用缓冲区：排队期间被下一帧覆盖不影响已提交的样本
+        buffer[...] = 0.9
+        release.set()
+        np.testing.assert_allclose(future.result(timeout=2), [0.8, 0.2], atol=1e-6)
+
+    def test_errors_propagate_to_every_request(self):
+        def broken(batch):
+            raise RuntimeError('model failed')
+
+        scheduler = LivenessBatchScheduler(broken, max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            scheduler.predict(sample(0.5))
+        self.assertEqual(scheduler.get_metrics()['errors'], 1)
+
+    @override_settings(LIVENESS_BATCHING_ENABLED=False)
+    def test_disabled_by_setting(self):
+        self.assertIsNone(create_liveness_scheduler(RecordingModel()))
+
+    @override_settings(LIVENESS_BATCHING_ENABLED=True, LIVENESS_BATCH_MAX_SIZE=4, LIVENESS_BATCH_MAX_WAIT_MS=2)
+    def test_created_from_settings(self):
+        scheduler = create_liveness_scheduler(RecordingModel())
+        self.assertEqual(scheduler.max_batch_size, 4)
+        self.assertAlmostEqual(scheduler.max_wait, 0.002)
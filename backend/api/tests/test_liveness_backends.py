@@ -0,0 +1,138 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import inference_utils
+from api.inference_utils import TFLiteLivenessBackend, load_liveness_backend
+
+
+class FakeInterpreter:
+    """int8 量化模型的 Interpreter 替身：每个样本输出输入的前两个值"""
+
+    def __init__(self, model_path=None, num_threads=None):
+        self.num_threads = num_threads
+        self.batch = 1
+        self.resized = []
+        self.inputs = None
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': [self.batch, 4, 4, 3], 'dtype': np.int8, 'quantization': (1 / 255, -128)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'dtype': np.int8, 'quantization': (0.5, 10)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.resized.append(shape)
+        self.batch = shape[0]
+
+    def set_tensor(self, index, value):
+        self.inputs = value
+
+    def invoke(self):
+        pass
+
+    def get_tensor(self, index):
+        return self.inputs.reshape(len(self.inputs), -1)[:, :2]
+
+
+class TFLiteBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        interpreter = types.ModuleType('tflite_runtime.interpreter')
+        interpreter.Interpreter = FakeInterpreter
+        package = types.ModuleType('tflite_runtime')
+        package.interpreter = interpreter
+        patcher = mock.patch.dict(sys.modules, {'tflite_runtime': package, 'tflite_runtime.interpreter': interpreter})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_int8_model_is_quantized_and_dequantized(self):
+        backend = TFLiteLivenessBackend('/models/liveness.tflite', num_threads=2)
+        self.assertEqual(backend.interpreter.num_threads, 2)
+        batch = np.full((2, 4, 4, 3), 0.6, dtype=np.float32)
+        output = backend.predict(batch)
+        # 输入 0.6 * 255 - 128 = 25；输出 (25 - 10) * 0.5
+        self.assertEqual(backend.interpreter.inputs.dtype, np.int8)
+        np.testing.assert_array_equal(backend.interpreter.inputs, 25)
+        np.testing.assert_allclose(output, np.full((2, 2), 7.5))
+
+    def test_input_resized_only_when_batch_size_changes(self):
+        backend = TFLiteLivenessBackend('/models/liveness.tflite')
+        for size in (3, 3, 1):
+            backend.predict(np.zeros((size, 4, 4, 3), dtype=np.float32))
+        self.assertEqual(backend.interpreter.resized, [[3, 4, 4, 3], [1, 4, 4, 3]])
+
+    def test_quantized_input_is_clipped(self):
+        backend = TFLiteLivenessBackend('/models/liveness.tflite')
+        backend.predict(np.array([2.0, -1.0], dtype=np.float32).reshape(1, 2, 1, 1) * np.ones((1, 2, 2, 3)))
+        self.assertEqual(int(backend.interpreter.inputs.max()), 127)
+        self.assertEqual(int(backend.interpreter.inputs.min()), -128)
+
+
+class LoadLivenessBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.paths = {}
+        for name, ext in (('keras', 'hdf5'), ('tflite', 'tflite'), ('onnx', 'onnx')):
+            self.paths[name] = os.path.join(self.root, f'liveness.{ext}')
+        override = override_settings(LIVENESS_MODEL_PATH=self.paths['keras'],
+                                     LIVENESS_TFLITE_MODEL_PATH=self.paths['tflite'],
+                                     LIVENESS_ONNX_MODEL_PATH=self.paths['onnx'])
+        override.enable()
+        self.addCleanup(override.disable)
+        self.created = []
+        patcher = mock.patch.object(inference_utils, 'create_liveness_backend', side_effect=self._create)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.broken = set()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _create(self, name, model_path):
+        self.created.append(name)
+        if name in self.broken:
+            raise ImportError(f'{name} runtime missing')
+        return name
+
+    def touch(self, *names):
+        for name in names:
+            open(self.paths[name], 'wb').close()
+
+    def test_configured_backend_is_used(self):
+        self.touch('keras', 'onnx')
+        self.assertEqual(load_liveness_backend('onnx'), 'onnx')
+        self.assertEqual(self.created, ['onnx'])
+
+    def test_missing_export_falls_back_to_keras(self):
+        self.touch('keras')
+        self.assertEqual(load_liveness_backend('tflite'), 'keras')
+
+    def test_missing_runtime_falls_back_to_keras(self):
+        self.touch('keras', 'tflite')
+        self.broken.add('tflite')
+        self.assertEqual(load_liveness_backend('tflite'), 'keras')
+        self.assertEqual(self.created, ['tflite', 'keras'])
+
+    def test_unknown_backend_uses_keras(self):
+        self.touch('keras')
+        self.assertEqual(load_liveness_backend('tensorrt'), 'keras')
+
+    def test_nothing_loadable_returns_none(self):
+        self.assertIsNone(load_liveness_backend('onnx'))
+        self.assertEqual(self.created, [])
+
+    @override_settings(LIVENESS_BACKEND='tflite')
+    def test_backend_read_from_settings(self):
+        self.touch('tflite')
+        self.assertEqual(load_liveness_backend(), 'tflite')
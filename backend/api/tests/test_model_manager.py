@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import model_manager
+from api.model_manager import ModelManager, ModelVersionUnavailable
+from api.model_registry import LIVENESS, EMBEDDING, read_active_versions
+
+
+class FakeClient:
+    """模型服务客户端替身：记录每次活体推理使用的版本"""
+
+    def __init__(self, liveness_version='v1'):
+        self.info = {'liveness_backend': 'tflite', 'liveness_version': liveness_version,
+                     'model_path': None, 'embedding_available': True, 'pid': 1}
+        self.versions = []
+
+    def ping(self):
+        return self.info
+
+    def predict_liveness(self, batch, version=None):
+        self.versions.append(version)
+        return np.zeros((len(batch), 2), dtype=np.float32)
+
+
+class RemoteVersionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = mock.patch.object(model_manager, 'get_model_server_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = ModelManager()
+
+    def test_active_version_comes_from_the_worker(self):
+        self.assertEqual(self.manager.active_versions()[LIVENESS], 'v1')
+
+    def test_pinned_version_is_sent_to_the_server(self):
+        batch = np.zeros((2, 128, 128, 3), dtype=np.float32)
+        self.manager.predict_liveness_batch(batch)
+        self.manager.predict_liveness_batch(batch, 'v0')
+        self.assertEqual(self.client.versions, ['v1', 'v0'])
+        self.assertEqual(self.manager.liveness_manifest('v0')['version'], 'v0')
+
+
+class VersionedBackend:
+    """按版本区分输出的活体后端替身：真实分数等于版本号"""
+
+    def __init__(self, version):
+        self.name = f'fake-{version}'
+        self.model_path = None
+        self.score = float(version.lstrip('v')) / 10
+
+    def predict(self, batch):
+        return np.tile([1.0 - self.score, self.score], (len(batch), 1)).astype(np.float32)
+
+
+def write_manifest(root, kind, version, data):
+    version_dir = os.path.join(root, kind, version)
+    os.makedirs(version_dir)
+    with open(os.path.join(version_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+class HotSwapTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = tempfile.mkdtemp()
+        for version in ('v1', 'v2'):
+            write_manifest(self.registry, LIVENESS, version, {'backend': 'tflite', 'file': 'liveness.tflite'})
+        write_manifest(self.registry, EMBEDDING, 'e2', {'model_name': 'ArcFace', 'embedding_version': '2'})
+        with open(os.path.join(self.registry, 'active.json'), 'w', encoding='utf-8') as f:
+            json.dump({LIVENESS: 'v1'}, f)
+
+        settings_override = override_settings(MODEL_REGISTRY_PATH=self.registry, MODEL_REGISTRY_POLL_INTERVAL=3600,
+                                               LIVENESS_BATCHING_ENABLED=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(model_manager, 'get_model_server_client', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.builds = []
+        patcher = mock.patch.object(ModelManager, '_build_liveness', side_effect=self._build)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = ModelManager()
+        self.batch = np.zeros((1, 128, 128, 3), dtype=np.float32)
+        # 首次使用加载模型，第二次使用时检查一次注册表，之后在测试期间不再检查
+        self.score()
+        self.score()
+
+    def tearDown(self):
+        shutil.rmtree(self.registry)
+
+    def _build(self, manifest):
+        self.builds.append(manifest['version'])
+        return VersionedBackend(manifest['version'])
+
+    def score(self, version=None):
+        return float(self.manager.predict_liveness_batch(self.batch, version)[0][1])
+
+    def activate(self, kind, version):
+        self.manager.activate(kind, version)
+        deadline = time.monotonic() + 5
+        while self.manager._loading[kind]['state'] == 'loading' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.manager._loading[kind]['state'], 'ready')
+
+    def test_swap_keeps_pinned_sessions_on_old_version(self):
+        self.assertEqual(self.manager.active_versions()[LIVENESS], 'v1')
+        self.activate(LIVENESS, 'v2')
+        self.assertEqual(self.manager.active_versions()[LIVENESS], 'v2')
+        self.assertEqual(read_active_versions()[LIVENESS], 'v2')
+        self.assertAlmostEqual(self.score(), 0.2)
+        self.assertAlmostEqual(self.score('v1'), 0.1)
+        self.assertTrue(self.manager._liveness_versions['v1']['retire_at'])
+
+    def test_retirement_deferred_while_old_version_in_use(self):
+        self.activate(LIVENESS, 'v2')
+        entry = self.manager._liveness_versions['v1']
+        entry['retire_at'] = time.time() - 1
+        # 会话再次使用旧版本时顺延卸载时间
+        self.score('v1')
+        self.manager._retire(None, 'v2')
+        self.assertIn('v1', self.manager._liveness_versions)
+
+        entry['retire_at'] = time.time() - 1
+        self.manager._retire(None, 'v2')
+        self.assertNotIn('v1', self.manager._liveness_versions)
+
+    def test_retired_version_reloaded_for_pinned_session(self):
+        self.activate(LIVENESS, 'v2')
+        self.manager._liveness_versions['v1']['retire_at'] = time.time() - 1
+        self.manager._retire(None, 'v2')
+        self.assertAlmostEqual(self.score('v1'), 0.1)
+        self.assertEqual(self.builds, ['v1', 'v2', 'v1'])
+        self.assertEqual(self.manager.active_versions()[LIVENESS], 'v2')
+
+    def test_unavailable_pinned_version_is_an_error(self):
+        with self.assertRaises(ModelVersionUnavailable):
+            self.score('v9')
+
+    def test_embedding_swap_keeps_pinned_manifest(self):
+        with mock.patch.object(ModelManager, '_rebuild_embedding_index') as rebuild:
+            self.activate(EMBEDDING, 'e2')
+        rebuild.assert_called_once()
+        self.assertEqual(self.manager.embedding_manifest()['model_name'], 'ArcFace')
+        self.assertEqual(self.manager.embedding_manifest('default')['version'], 'default')
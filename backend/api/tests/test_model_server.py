@@ -0,0 +1,230 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Listener
+from unittest import mock
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from api import embedding_utils
+from api.model_server import (
+    OP_EMBEDDING, OP_LIVENESS, ModelServer, ModelServerClient, ModelServerUnavailable,
+    _AttachedSegments, _read_payload, _run_request, get_model_server_config,
+)
+
+
+def server_config(**overrides):
+    config = {
+        'enabled': True,
+        'address': ('127.0.0.1', 0),
+        'authkey': b'test-authkey',
+        'workers': 1,
+        'ring_slots': 2,
+        'slot_bytes': 64 * 1024,
+        'timeout': 1,
+    }
+    config.update(overrides)
+    return config
+
+
+class AuthkeyTests(SimpleTestCase):
+
+    @override_settings(RECOGNITION_MODEL_SERVER_AUTHKEY=None, SECRET_KEY='not-the-authkey')
+    def test_no_secret_key_fallback(self):
+        self.assertIsNone(get_model_server_config()['authkey'])
+
+    @override_settings(RECOGNITION_MODEL_SERVER_AUTHKEY='s3cret')
+    def test_authkey_encoded(self):
+        self.assertEqual(get_model_server_config()['authkey'], b's3cret')
+
+    def test_refuses_to_start_without_authkey(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ModelServer(server_config(authkey=None))
+        with self.assertRaises(ImproperlyConfigured):
+            ModelServerClient(server_config(authkey=b''))
+
+
+class PayloadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.faces = os.path.join(self.root, 'faces')
+        os.makedirs(self.faces)
+        self.photo = os.path.join(self.faces, 'alice.jpg')
+        open(self.photo, 'wb').close()
+        self.outside = os.path.join(self.root, 'secret.txt')
+        open(self.outside, 'wb').close()
+        self.segments = _AttachedSegments()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_path_inside_faces_database(self):
+        with override_settings(FACES_DATABASE_PATH=self.faces):
+            self.assertEqual(_read_payload(('path', self.photo), self.segments), os.path.realpath(self.photo))
+
+    def test_path_outside_faces_database_rejected(self):
+        with override_settings(FACES_DATABASE_PATH=self.faces):
+            for path in (self.outside, os.path.join(self.faces, '..', 'secret.txt'), self.faces):
+                with self.assertRaises(ValueError):
+                    _read_payload(('path', path), self.segments)
+
+    def test_unknown_payload_rejected(self):
+        with self.assertRaises(ValueError):
+            _read_payload(('pickle', b''), self.segments)
+
+
+class SlotReservationTests(SimpleTestCase):
+    """客户端超时后，槽位要等模型服务真正响应后才释放"""
+
+    def setUp(self):
+        self.listener = Listener(('127.0.0.1', 0), authkey=b'test-authkey')
+        self.reply = threading.Event()
+        self.received = []
+        self.server = threading.Thread(target=self._serve, daemon=True)
+        self.server.start()
+        self.client = ModelServerClient(server_config(address=self.listener.address, timeout=0.2))
+
+    def tearDown(self):
+        self.reply.set()
+        self.client.close()
+        self.listener.close()
+
+    def _serve(self):
+        conn = self.listener.accept()
+        try:
+            while True:
+                op, payload, version = conn.recv()
+                self.received.append((payload, version))
+                self.reply.wait(5)
+                conn.send(('ok', np.zeros((1, 2), dtype=np.float32)))
+        except (EOFError, OSError):
+            pass
+
+    def _free_slots(self):
+        return self.client.ring._free.qsize()
+
+    def test_slot_held_until_late_reply(self):
+        with self.assertRaises(ModelServerUnavailable):
+            self.client.predict_liveness(np.ones((1, 4, 4, 3), dtype=np.float32))
+        self.assertEqual(self.received[0][0][0], 'shm')
+        self.assertEqual(self._free_slots(), 1)
+
+        self.reply.set()
+        deadline = time.monotonic() + 2
+        while self._free_slots() < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self._free_slots(), 2)
+        self.assertEqual(self.client.get_metrics()['timeouts'], 1)
+
+    def test_slot_released_after_reply(self):
+        self.reply.set()
+        result = self.client.predict_liveness(np.ones((1, 4, 4, 3), dtype=np.float32))
+        self.assertEqual(result.shape, (1, 2))
+        self.assertEqual(self._free_slots(), 2)
+
+    def test_pinned_version_sent_with_request(self):
+        self.reply.set()
+        self.client.predict_liveness(np.ones((1, 4, 4, 3), dtype=np.float32), 'v1')
+        self.client.compute_embedding(np.zeros((8, 8, 3), dtype=np.uint8), 'facenet-2')
+        self.assertEqual([version for _, version in self.received], ['v1', 'facenet-2'])
+
+
+class _AliveWorker:
+    def is_alive(self):
+        return True
+
+
+class DispatchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ModelServer(server_config(timeout=0.1, queue_size=1))
+
+    def tearDown(self):
+        self.server._requests.close()
+        self.server._results.close()
+
+    def test_full_queue_rejected(self):
+        self.server.workers = [_AliveWorker()]
+        self.server._requests.put((0, 'liveness', None))
+        status, message = self.server._dispatch('liveness', ('inline', None))
+        self.assertEqual(status, 'error')
+        self.assertIn('已满', message)
+        self.assertEqual(self.server._pending, {})
+
+    def test_waits_for_worker_past_timeout(self):
+        self.server.workers = [_AliveWorker()]
+
+        def worker():
+            request_id, op, payload, version = self.server._requests.get(timeout=2)
+            time.sleep(0.3)
+            with self.server._pending_lock:
+                future = self.server._pending.pop(request_id)
+            future.set_result(('ok', 'done'))
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        self.assertEqual(self.server._dispatch('liveness', ('inline', None)), ('ok', 'done'))
+        thread.join()
+
+    def test_gives_up_when_workers_exit(self):
+        status, message = self.server._dispatch('liveness', ('inline', None))
+        self.assertEqual(status, 'error')
+        self.assertEqual(self.server._pending, {})
+
+
+class FakeModels:
+    """推理进程中的模型管理器替身：只加载了 loaded 中的活体模型版本"""
+
+    def __init__(self, loaded=('v1',), active='v1'):
+        self.loaded = loaded
+        self.active = active
+        self.liveness = object()
+        self.calls = []
+
+    def liveness_manifest(self, version=None):
+        return {'version': version if version in self.loaded else self.active}
+
+    def predict_liveness_batch(self, batch, version=None):
+        self.calls.append(version)
+        return np.zeros((len(batch), 2), dtype=np.float32)
+
+
+class WorkerRequestTests(SimpleTestCase):
+
+    def test_liveness_uses_pinned_version(self):
+        models = FakeModels(loaded=('v1', 'v2'))
+        _run_request(models, OP_LIVENESS, np.zeros((2, 4, 4, 3), dtype=np.float32), 'v2')
+        self.assertEqual(models.calls, ['v2'])
+
+    def test_unavailable_liveness_version_is_an_error(self):
+        models = FakeModels()
+        with self.assertRaises(RuntimeError):
+            _run_request(models, OP_LIVENESS, np.zeros((1, 4, 4, 3), dtype=np.float32), 'v2')
+        self.assertEqual(models.calls, [])
+
+    def test_unavailable_embedding_version_is_an_error(self):
+        active = {'version': 'facenet-1', 'model_name': 'Facenet', 'model_version': '1'}
+        with mock.patch('api.embedding_utils.get_embedding_config', return_value=active), \
+                mock.patch('api.embedding_utils.compute_embedding') as compute:
+            with self.assertRaises(RuntimeError):
+                _run_request(FakeModels(), OP_EMBEDDING, np.zeros((8, 8, 3), dtype=np.uint8), 'facenet-2')
+            compute.assert_not_called()
+            _run_request(FakeModels(), OP_EMBEDDING, np.zeros((8, 8, 3), dtype=np.uint8), 'facenet-1')
+            self.assertIs(compute.call_args[0][1], active)
+
+
+class RemoteEmbeddingTests(SimpleTestCase):
+
+    def test_compute_embedding_sends_config_version(self):
+        client = mock.Mock()
+        client.compute_embedding.return_value = [0.5, 0.5]
+        config = {'version': 'facenet-2', 'model_name': 'Facenet', 'model_version': '2'}
+        with mock.patch.object(embedding_utils, 'get_model_server_client', return_value=client):
+            vector = embedding_utils.compute_embedding('/faces/alice.jpg', config)
+        client.compute_embedding.assert_called_once_with('/faces/alice.jpg', 'facenet-2')
+        self.assertEqual(vector.dtype, np.float32)
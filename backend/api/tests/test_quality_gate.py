@@ -0,0 +1,91 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, Client, override_settings
+
+from api import utils_recognition
+from api.quality_utils import (
+    REJECT_BLURRY, REJECT_DUPLICATE, REJECT_OVEREXPOSED, REJECT_TOO_DARK, assess_frame_quality,
+)
+
+
+def textured(seed=0, level=128):
+    """清晰、亮度适中的测试帧 (随机纹理)"""
+    noise = np.random.default_rng(seed).integers(-60, 60, (120, 160, 3))
+    return np.clip(level + noise, 0, 255).astype(np.uint8)
+
+
+def flat(level):
+    return np.full((120, 160, 3), level, dtype=np.uint8)
+
+
+def voting_session():
+    return {'session_id': 's1', 'num_votes': 5, 'live_threshold': 0.6, 'total_votes': 0, 'votes_passed': 0}
+
+
+class AssessFrameQualityTests(SimpleTestCase):
+
+    def test_good_frame_passes(self):
+        quality = assess_frame_quality(textured())
+        self.assertIsNone(quality['reason'])
+        self.assertGreater(quality['sharpness'], 30)
+
+    def test_exposure_and_blur(self):
+        self.assertEqual(assess_frame_quality(flat(10))['reason'], REJECT_TOO_DARK)
+        self.assertEqual(assess_frame_quality(flat(250))['reason'], REJECT_OVEREXPOSED)
+        self.assertEqual(assess_frame_quality(flat(128))['reason'], REJECT_BLURRY)
+
+    def test_repeated_frame_is_duplicate(self):
+        first = assess_frame_quality(textured(1))
+        self.assertEqual(assess_frame_quality(textured(1), first['frame_hash'])['reason'], REJECT_DUPLICATE)
+        self.assertIsNone(assess_frame_quality(textured(2), first['frame_hash'])['reason'])
+
+    @override_settings(FRAME_QUALITY_MIN_SHARPNESS=0.0)
+    def test_thresholds_come_from_settings(self):
+        self.assertIsNone(assess_frame_quality(flat(128))['reason'])
+
+
+class QualityGateTests(SimpleTestCase):
+
+    def test_rejected_frame_skips_face_detection(self):
+        with mock.patch.object(utils_recognition, 'detect_faces_tracked') as detect:
+            frame, faces, quality, _ = utils_recognition.inspect_frame(flat(10))
+        detect.assert_not_called()
+        self.assertIsNone(faces)
+        self.assertEqual(quality['reason'], REJECT_TOO_DARK)
+
+    @override_settings(FRAME_QUALITY_ENABLED=False)
+    def test_gate_can_be_disabled(self):
+        with mock.patch.object(utils_recognition, 'detect_faces_tracked', return_value=([], False)) as detect:
+            _, _, quality, _ = utils_recognition.inspect_frame(flat(10))
+        detect.assert_called_once()
+        self.assertIsNone(quality)
+
+    def test_rejected_frames_are_not_votes(self):
+        session_data = voting_session()
+        analysis = utils_recognition.select_liveness_face(None, assess_frame_quality(flat(250)))[1]
+        frame_result, status = utils_recognition.apply_frame_analysis(session_data, analysis)
+        self.assertTrue(frame_result['rejected'])
+        self.assertEqual(frame_result['reason'], REJECT_OVEREXPOSED)
+        self.assertEqual((session_data['total_votes'], session_data['frames_rejected']), (0, 1))
+
+    def test_duplicate_detected_in_vote_order(self):
+        # 并发上传的两帧各自与分析时的上一帧比较都不重复，计票时按顺序再比较一次
+        session_data = voting_session()
+        analysis = {'face_detected': True, 'real_score': 0.9, 'face': b'face', 'simulation_mode': True,
+                    'frame_hash': 12345}
+        utils_recognition.apply_frame_analysis(session_data, dict(analysis))
+        frame_result, _ = utils_recognition.apply_frame_analysis(session_data, dict(analysis))
+        self.assertEqual(frame_result['reason'], REJECT_DUPLICATE)
+        self.assertEqual(session_data['total_votes'], 1)
+
+
+class QualityConfigApiTests(SimpleTestCase):
+
+    @override_settings(FRAME_QUALITY_MIN_BRIGHTNESS=55.0)
+    def test_config_published_to_clients(self):
+        response = Client().get('/api/recognition/quality_config/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['quality']['min_brightness'], 55.0)
+        self.assertIn(REJECT_BLURRY, data['reasons'])
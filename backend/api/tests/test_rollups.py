@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from api.models import AuditLog, AuditLogRollup
+from api.rollup_utils import (
+    truncate_bucket, score_bin, result_category, record_rollups, rebuild_rollups, prune_hourly_rollups,
+    rollup_stats,
+)
+
+
+def rollup_rows():
+    return sorted(AuditLogRollup.objects.values_list(
+        'period', 'bucket', 'action', 'liveness_status', 'compare_result', 'user_id', 'score_bin', 'count'))
+
+
+class RollupHelperTests(TestCase):
+
+    def test_truncate_bucket_uses_local_time(self):
+        timestamp = timezone.make_aware(datetime(2024, 5, 1, 0, 30))
+        self.assertEqual(truncate_bucket(timestamp, AuditLogRollup.PERIOD_HOUR), timestamp.replace(minute=0))
+        day = truncate_bucket(timestamp, AuditLogRollup.PERIOD_DAY)
+        self.assertEqual((timezone.localtime(day).day, timezone.localtime(day).hour), (1, 0))
+
+    def test_score_bin_and_result_category(self):
+        self.assertEqual([score_bin(s) for s in (None, 0.0, 0.05, 0.95, 1.0, 1.7, -0.2)], [-1, 0, 0, 9, 9, 9, 0])
+        self.assertEqual(result_category('DEEPFACE_ERROR: something broke'), 'DEEPFACE_ERROR')
+        self.assertEqual(result_category(None), '')
+
+
+class RollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='x')
+        cls.now = timezone.now()
+        cls.today = truncate_bucket(cls.now, AuditLogRollup.PERIOD_DAY)
+
+    def add_logs(self, day_offset, count, status='SUCCESS', score=0.85, action='face_recognition', record=True):
+        timestamp = self.today - timedelta(days=day_offset) + timedelta(hours=10)
+        logs = AuditLog.objects.bulk_create([
+            AuditLog(user=self.user, timestamp=timestamp + timedelta(minutes=i), action=action,
+                     liveness_status=status, compare_result='MATCH', score=score)
+            for i in range(count)
+        ])
+        if record:
+            record_rollups(logs)
+        return logs
+
+    def test_record_rollups_counts_hour_and_day(self):
+        self.add_logs(1, 3)
+        self.add_logs(1, 2, status='FAIL', score=None)
+        day = AuditLogRollup.objects.filter(period=AuditLogRollup.PERIOD_DAY)
+        self.assertEqual(sum(day.values_list('count', flat=True)), 5)
+        self.assertEqual(sum(AuditLogRollup.objects.filter(period=AuditLogRollup.PERIOD_HOUR)
+                             .values_list('count', flat=True)), 5)
+        success = day.get(liveness_status='SUCCESS')
+        self.assertEqual((success.score_bin, success.count), (8, 3))
+        self.assertAlmostEqual(success.score_sum, 2.55)
+        # 同一维度再次写入只累加，不新增行
+        rows = AuditLogRollup.objects.count()
+        self.add_logs(1, 1)
+        self.assertEqual(AuditLogRollup.objects.count(), rows)
+        self.assertEqual(day.get(liveness_status='SUCCESS').count, 4)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.add_logs(2, 4)
+        self.add_logs(1, 3, status='ERROR', score=0.2)
+        incremental = rollup_rows()
+        AuditLogRollup.objects.update(count=999)  # 模拟累计偏差
+        rows = rebuild_rollups(self.today - timedelta(days=3), self.today)
+        self.assertEqual(rollup_rows(), incremental)
+        self.assertEqual(rows, len(incremental))
+
+    def test_rebuild_picks_up_unrecorded_logs(self):
+        self.add_logs(1, 2, record=False)
+        rebuild_rollups(self.today - timedelta(days=1), self.today)
+        self.assertEqual(AuditLogRollup.objects.get(period=AuditLogRollup.PERIOD_DAY).count, 2)
+
+    def test_prune_hourly_keeps_daily(self):
+        self.add_logs(10, 2)
+        self.add_logs(1, 2)
+        deleted = prune_hourly_rollups(self.today - timedelta(days=5))
+        self.assertEqual(deleted, 1)
+        self.assertEqual(AuditLogRollup.objects.filter(period=AuditLogRollup.PERIOD_DAY).count(), 2)
+
+    def test_compact_command_rebuilds_and_prunes(self):
+        self.add_logs(40, 1)
+        self.add_logs(2, 3)
+        AuditLogRollup.objects.filter(bucket__gte=self.today - timedelta(days=7)).update(count=0)
+        out = StringIO()
+        call_command('compact_audit_rollups', '--days', '7', '--hourly-retention-days', '30', stdout=out)
+        hourly = AuditLogRollup.objects.filter(period=AuditLogRollup.PERIOD_HOUR)
+        self.assertEqual(list(hourly.values_list('count', flat=True)), [3])
+        # 超出重建范围的按天数据保持不变
+        daily = dict(AuditLogRollup.objects.filter(period=AuditLogRollup.PERIOD_DAY)
+                     .values_list('bucket', 'count'))
+        self.assertEqual(sorted(daily.values()), [1, 3])
+        self.assertIn('已重建', out.getvalue())
+
+    def test_rollup_stats(self):
+        self.add_logs(1, 3)
+        self.add_logs(1, 1, status='FAIL', score=0.1)
+        stats = rollup_stats(AuditLogRollup.PERIOD_DAY, self.today - timedelta(days=2), self.today)
+        self.assertEqual(stats['total'], 4)
+        self.assertEqual(stats['by_status'], {'SUCCESS': 3, 'FAIL': 1})
+        self.assertEqual(stats['by_user'], {'alice': 4})
+        self.assertEqual(stats['score_histogram'][8]['count'], 3)
+        self.assertAlmostEqual(stats['average_score'], (0.85 * 3 + 0.1) / 4)
+        self.assertEqual(len(stats['series']), 1)
+        self.assertEqual(rollup_stats(AuditLogRollup.PERIOD_DAY, self.today - timedelta(days=2), self.today,
+                                      action='other')['total'], 0)
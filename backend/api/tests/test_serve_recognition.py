@@ -0,0 +1,97 @@
+import io
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from api.management.commands import serve_recognition
+from api.management.commands.serve_recognition import Command, plan_workers, read_smaps_rollup
+
+SMAPS_ROLLUP = """00400000-7fff0000 ---p 00000000 00:00 0                          [rollup]
+Rss:              204800 kB
+Pss:               81920 kB
+Shared_Clean:     150000 kB
+Shared_Dirty:       4800 kB
+Private_Clean:      1000 kB
+Private_Dirty:     49000 kB
+"""
+
+
+class PlanWorkersTests(SimpleTestCase):
+
+    def test_two_threads_per_worker_by_default(self):
+        self.assertEqual(plan_workers(8), (4, 2))
+        self.assertEqual(plan_workers(1), (1, 1))
+        self.assertEqual(plan_workers(None), (1, 1))
+
+    def test_explicit_values(self):
+        self.assertEqual(plan_workers(8, workers=2), (2, 4))
+        self.assertEqual(plan_workers(8, threads=1), (8, 1))
+        self.assertEqual(plan_workers(8, workers=3, threads=3), (3, 3))
+
+
+class ReadSmapsRollupTests(SimpleTestCase):
+
+    def test_parses_private_and_shared_pages(self):
+        with mock.patch('builtins.open', mock.mock_open(read_data=SMAPS_ROLLUP)):
+            memory = read_smaps_rollup(123)
+        self.assertEqual(memory, {'rss': 204800, 'pss': 81920, 'unique': 50000, 'shared': 154800})
+
+    def test_unsupported_system(self):
+        with mock.patch('builtins.open', side_effect=FileNotFoundError):
+            self.assertIsNone(read_smaps_rollup(123))
+
+
+class SuperviseTests(SimpleTestCase):
+
+    def setUp(self):
+        self.command = Command(stdout=io.StringIO())
+        self.command.children = {101: 0, 102: 1}
+        self.command.stopping = False
+        self.command.spawn = mock.Mock()
+        self.sock = mock.Mock()
+
+    def test_crashed_worker_is_respawned(self):
+        with mock.patch.object(serve_recognition.os, 'wait', side_effect=[(101, 256), ChildProcessError]):
+            self.command.supervise(self.sock, 'app', 'wsgi')
+        self.command.spawn.assert_called_once_with(0, self.sock, 'app', 'wsgi')
+        self.sock.close.assert_called_once()
+
+    def test_no_respawn_while_stopping(self):
+        self.command.stopping = True
+        with mock.patch.object(serve_recognition.os, 'wait', side_effect=[(101, 0), (102, 0)]):
+            self.command.supervise(self.sock, 'app', 'wsgi')
+        self.command.spawn.assert_not_called()
+        self.assertEqual(self.command.children, {})
+
+    def test_stop_signals_every_worker(self):
+        with mock.patch.object(serve_recognition.os, 'kill') as kill:
+            self.command.stop(None, None)
+        self.assertTrue(self.command.stopping)
+        self.assertEqual(sorted(call.args[0] for call in kill.call_args_list), [101, 102])
+
+
+@override_settings(LIVENESS_INFERENCE_THREADS=None, RECOGNITION_SESSION_BACKEND='sqlite')
+class HandleTests(SimpleTestCase):
+
+    def test_thread_counts_applied_before_preload(self):
+        seen = {}
+
+        def preload(command, interface):
+            seen['env'] = {name: os.environ[name] for name in serve_recognition.THREAD_ENV_VARS}
+            seen['liveness_threads'] = settings.LIVENESS_INFERENCE_THREADS
+            return 'app'
+
+        with mock.patch.dict(os.environ), \
+                mock.patch.object(Command, 'preload', autospec=True, side_effect=preload), \
+                mock.patch.object(Command, 'bind'), \
+                mock.patch.object(Command, 'spawn') as spawn, \
+                mock.patch.object(Command, 'report_memory'), \
+                mock.patch.object(Command, 'supervise'), \
+                mock.patch.object(serve_recognition.signal, 'signal'):
+            call_command('serve_recognition', workers=3, threads=2, report_delay=0, stdout=io.StringIO())
+        self.assertEqual(set(seen['env'].values()), {'2'})
+        self.assertEqual(seen['liveness_threads'], 2)
+        self.assertEqual([call.args[0] for call in spawn.call_args_list], [0, 1, 2])
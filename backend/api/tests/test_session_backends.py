@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from api import session_store
+from api.session_store import (
+    MemorySessionStore, SQLiteSessionStore, SessionSweeper, create_session_store,
+)
+
+
+class StopSweep(Exception):
+    pass
+
+
+class CreateSessionStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    @override_settings(RECOGNITION_SESSION_BACKEND='memory', RECOGNITION_SESSION_TTL=42)
+    def test_memory_backend(self):
+        store = create_session_store()
+        self.assertIsInstance(store, MemorySessionStore)
+        self.assertEqual(store.ttl, 42)
+
+    def test_sqlite_backend(self):
+        path = os.path.join(self.tmpdir, 'sessions.db')
+        with override_settings(RECOGNITION_SESSION_BACKEND='sqlite', RECOGNITION_SESSION_SQLITE_PATH=path):
+            store = create_session_store()
+        self.assertIsInstance(store, SQLiteSessionStore)
+        self.assertTrue(os.path.exists(path))
+
+    @override_settings(RECOGNITION_SESSION_BACKEND='redis')
+    def test_unavailable_backend_falls_back_to_memory(self):
+        with mock.patch.object(session_store, 'RedisSessionStore', side_effect=ConnectionError('refused')):
+            self.assertIsInstance(create_session_store(), MemorySessionStore)
+
+
+class SharedSessionTests(SimpleTestCase):
+    """不同工作进程 (各自的存储实例) 看到同一个会话"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sessions.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_session_created_in_one_process_is_visible_in_another(self):
+        starter, worker = SQLiteSessionStore(60, self.path), SQLiteSessionStore(60, self.path)
+        starter.set('s1', {'session_id': 's1', 'username': 'alice', 'version': 0})
+        self.assertEqual(worker.get('s1')['username'], 'alice')
+        worker.delete('s1')
+        self.assertIsNone(starter.get('s1'))
+
+    def test_update_extends_expiry(self):
+        store = SQLiteSessionStore(60, self.path)
+        now = time.time()
+        with mock.patch('api.session_store.time.time', return_value=now):
+            store.set('s1', {'session_id': 's1', 'version': 0})
+        with mock.patch('api.session_store.time.time', return_value=now + 50):
+            store.set('s1', {'session_id': 's1', 'version': 1})
+        # 以最后一次更新计算过期时间
+        with mock.patch('api.session_store.time.time', return_value=now + 100):
+            self.assertEqual(store.get('s1')['version'], 1)
+        with mock.patch('api.session_store.time.time', return_value=now + 111):
+            self.assertIsNone(store.get('s1'))
+
+
+class SessionSweeperTests(SimpleTestCase):
+
+    def test_expired_sessions_are_reported(self):
+        store = MemorySessionStore(60)
+        store.set('old', {'session_id': 'old'})
+        expired = []
+        sweeper = SessionSweeper(store, 1, expired.append)
+        with mock.patch('api.session_store.time.sleep', side_effect=[None, StopSweep()]), \
+                mock.patch('api.session_store.time.time', return_value=time.time() + 120):
+            with self.assertRaises(StopSweep):
+                sweeper.run()
+        self.assertEqual(expired, ['old'])
+        self.assertEqual(store.stats()['sessions'], 0)
+
+    def test_cleanup_errors_do_not_stop_the_sweeper(self):
+        store = mock.Mock()
+        store.cleanup_expired.side_effect = [RuntimeError('database is locked'), ['s1']]
+        expired = []
+        sweeper = SessionSweeper(store, 1, expired.append)
+        with mock.patch('api.session_store.time.sleep', side_effect=[None, None, StopSweep()]):
+            with self.assertRaises(StopSweep):
+                sweeper.run()
+        self.assertEqual(expired, ['s1'])
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from api import utils_recognition
+from api.session_store import SQLiteSessionStore
+
+
+class SessionCasTests(SimpleTestCase):
+    """mutate_recognition_session 在跨进程存储上的比较并交换与冲突重试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = SQLiteSessionStore(60, os.path.join(self.tmpdir, 'sessions.db'))
+        patcher = mock.patch.object(utils_recognition, 'get_recognition_session_store', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store.set('s1', {'session_id': 's1', 'counter': 0, 'version': 0})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def concurrent_write(self):
+        """模拟另一个进程在本进程读取之后写入同一会话"""
+        other = self.store.get('s1')
+        other['counter'] += 100
+        other['version'] += 1
+        self.store.set('s1', other)
+
+    def test_mutation_commits_and_bumps_version(self):
+        session_data, result = utils_recognition.mutate_recognition_session(
+            's1', lambda data: data.update(counter=data['counter'] + 1) or 'ok')
+        self.assertEqual(result, 'ok')
+        self.assertEqual(session_data['version'], 1)
+        self.assertEqual(self.store.get('s1')['counter'], 1)
+
+    def test_conflict_retries_on_fresh_data(self):
+        calls = []
+
+        def mutator(data):
+            calls.append(data['counter'])
+            if len(calls) == 1:
+                self.concurrent_write()
+            data['counter'] += 1
+
+        session_data, _ = utils_recognition.mutate_recognition_session('s1', mutator)
+        # 第一次基于旧数据修改，CAS 失败后基于另一个进程写入的数据重做
+        self.assertEqual(calls, [0, 100])
+        self.assertEqual(self.store.get('s1')['counter'], 101)
+        self.assertEqual(session_data['version'], 2)
+
+    @override_settings(RECOGNITION_SESSION_CAS_RETRIES=3)
+    def test_gives_up_after_retries(self):
+        mutator = mock.Mock(side_effect=lambda data: self.concurrent_write())
+        with self.assertRaises(RuntimeError):
+            utils_recognition.mutate_recognition_session('s1', mutator)
+        self.assertEqual(mutator.call_count, 3)
+
+    def test_missing_session_returns_none(self):
+        self.assertIsNone(utils_recognition.mutate_recognition_session('missing', lambda data: None))
+
+    @override_settings(RECOGNITION_INCREMENTAL_EMBEDDING=True)
+    def test_embedding_frames_are_submitted_once_after_conflict(self):
+        self.store.set('s2', {'session_id': 's2', 'num_votes': 5, 'live_threshold': 0.6, 'total_votes': 0,
+                              'votes_passed': 0, 'model_versions': {}, 'version': 0})
+        analysis = {'face_detected': True, 'real_score': 0.9, 'face': np.zeros((4, 4, 3), dtype=np.uint8)}
+        real_cas = self.store.compare_and_set
+        attempts = []
+
+        def flaky_cas(session_id, data, expected_version):
+            attempts.append(expected_version)
+            return len(attempts) > 1 and real_cas(session_id, data, expected_version)
+
+        with mock.patch.object(self.store, 'compare_and_set', side_effect=flaky_cas), \
+                mock.patch.object(type(utils_recognition.model_manager), 'deepface_available', True), \
+                mock.patch.object(utils_recognition, 'session_embedding_config', return_value={}), \
+                mock.patch.object(utils_recognition, 'submit_session_embedding') as submit:
+            result = utils_recognition.apply_analyses_to_session('s2', [analysis, analysis])
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(submit.call_count, 2)
+        self.assertEqual(result['session_data']['embedding_frames'], 2)
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.session_store import MemorySessionStore, SQLiteSessionStore, RedisSessionStore, estimate_session_size
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def session(version=0, payload=0):
+    return {'session_id': 'x', 'version': version, 'blob': b'x' * payload}
+
+
+class StoreContractMixin:
+    """各存储后端共同的行为：读写、CAS、删除、按字节预算淘汰"""
+
+    def make_store(self, ttl=60, max_bytes=0):
+        raise NotImplementedError
+
+    def test_set_get_delete(self):
+        store = self.make_store()
+        self.assertIsNone(store.get('a'))
+        store.set('a', session(payload=10))
+        self.assertEqual(store.get('a')['blob'], b'x' * 10)
+        store.delete('a')
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.stats()['sessions'], 0)
+
+    def test_compare_and_set_checks_version(self):
+        store = self.make_store()
+        store.set('a', session())
+        data = store.get('a')
+        data['version'] = 1
+        self.assertTrue(store.compare_and_set('a', data, 0))
+        self.assertEqual(store.get('a')['version'], 1)
+        self.assertFalse(store.compare_and_set('missing', session(1), 0))
+
+    def test_evicts_least_recently_written_over_budget(self):
+        store = self.make_store(max_bytes=3500)
+        evicted = []
+        store.on_evict = evicted.append
+        for i in range(5):
+            store.set(f's{i}', session(payload=900))
+            time.sleep(0.002)
+        self.assertEqual(evicted, ['s0', 's1'])
+        self.assertIsNone(store.get('s0'))
+        self.assertIsNotNone(store.get('s4'))
+        stats = store.stats()
+        self.assertLessEqual(stats['bytes'], 3500)
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_session_larger_than_budget_is_kept(self):
+        store = self.make_store(max_bytes=500)
+        store.set('a', session(payload=100))
+        store.set('big', session(payload=2000))
+        self.assertIsNone(store.get('a'))
+        self.assertIsNotNone(store.get('big'))
+
+
+class MemorySessionStoreTests(StoreContractMixin, SimpleTestCase):
+
+    def make_store(self, ttl=60, max_bytes=0):
+        return MemorySessionStore(ttl, max_bytes)
+
+    def test_compare_and_set_checks_version(self):
+        # 内存存储的 get 返回同一个对象，CAS 只检查会话是否被替换
+        store = self.make_store()
+        store.set('a', session())
+        data = store.get('a')
+        self.assertTrue(store.compare_and_set('a', data, 0))
+        self.assertFalse(store.compare_and_set('a', session(), 0))
+
+    def test_expired_sessions_are_removed(self):
+        store = self.make_store(ttl=60)
+        store.set('a', session())
+        store.set('b', session())
+        with mock.patch('api.session_store.time.time', return_value=time.time() + 120):
+            self.assertIsNone(store.get('a'))
+            self.assertEqual(store.cleanup_expired(), ['b'])
+        self.assertEqual(store.stats()['bytes'], 0)
+
+
+class SQLiteSessionStoreTests(StoreContractMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def make_store(self, ttl=60, max_bytes=0):
+        return SQLiteSessionStore(ttl, os.path.join(self.tmpdir, f'sessions-{ttl}-{max_bytes}.db'), max_bytes)
+
+    def test_compare_and_set_rejects_stale_version(self):
+        store = self.make_store()
+        store.set('a', session())
+        first, second = store.get('a'), store.get('a')
+        first['version'] = second['version'] = 1
+        self.assertTrue(store.compare_and_set('a', first, 0))
+        self.assertFalse(store.compare_and_set('a', second, 0))
+
+    def test_expired_sessions_are_removed(self):
+        store = self.make_store(ttl=60)
+        store.set('a', session())
+        with mock.patch('api.session_store.time.time', return_value=time.time() + 120):
+            self.assertIsNone(store.get('a'))
+            self.assertEqual(store.cleanup_expired(), ['a'])
+
+
+@skipUnless(fakeredis, '需要 fakeredis')
+class RedisSessionStoreTests(StoreContractMixin, SimpleTestCase):
+
+    def make_store(self, ttl=60, max_bytes=0):
+        server = fakeredis.FakeServer()
+        with mock.patch('redis.Redis.from_url', side_effect=lambda url: fakeredis.FakeRedis(server=server)):
+            return RedisSessionStore(ttl, 'redis://test', max_bytes=max_bytes)
+
+    def test_expired_keys_are_dropped_from_stats(self):
+        store = self.make_store()
+        store.set('a', session(payload=100))
+        store.client.delete(store._key('a'))  # 模拟服务端 TTL 过期
+        self.assertEqual(store.cleanup_expired(), ['a'])
+        self.assertEqual(store.stats()['bytes'], 0)
+
+
+class EstimateSessionSizeTests(SimpleTestCase):
+
+    def test_counts_array_and_bytes_payloads(self):
+        small = estimate_session_size({'face': None})
+        self.assertEqual(estimate_session_size({'face': np.zeros(1000, dtype=np.uint8)}), small + 1000)
+        self.assertEqual(estimate_session_size({'face': b'x' * 500}), small + 500)
@@ -0,0 +1,72 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.test import SimpleTestCase, RequestFactory
+
+from api.upload_utils import FrameBuffer, FrameUploadHandler, frame_buffer, use_frame_upload_handler
+
+
+class FrameUploadHandlerTests(SimpleTestCase):
+
+    def upload(self, files, max_bytes=None, max_files=2):
+        request = RequestFactory().post('/upload/', {'session_id': 's1', **files})
+        use_frame_upload_handler(request, max_bytes, max_files)
+        return request, request.upload_handlers[0]
+
+    def test_files_share_one_arena(self):
+        request, handler = self.upload({'frames': [SimpleUploadedFile('a.jpg', b'A' * 100, 'image/jpeg'),
+                                                   SimpleUploadedFile('b.jpg', b'B' * 50, 'image/jpeg')]})
+        frames = request.FILES.getlist('frames')
+        self.assertEqual(request.POST['session_id'], 's1')
+        self.assertEqual([bytes(frame_buffer(f)) for f in frames], [b'A' * 100, b'B' * 50])
+        self.assertIsInstance(frames[0], FrameBuffer)
+        self.assertEqual(frames[0].name, 'a.jpg')
+        # 两帧都是同一块预分配内存的视图，没有拷贝
+        self.assertIs(frames[0].getbuffer().obj, handler.arena)
+        self.assertIs(frames[1].getbuffer().obj, handler.arena)
+        self.assertLessEqual(handler.offset, len(handler.arena))
+
+    def test_oversized_file_is_skipped(self):
+        request, handler = self.upload({'frames': [SimpleUploadedFile('big.jpg', b'x' * 200),
+                                                   SimpleUploadedFile('ok.jpg', b'y' * 20)]}, max_bytes=100)
+        frames = request.FILES.getlist('frames')
+        self.assertEqual([f.name for f in frames], ['ok.jpg'])
+        self.assertEqual(bytes(frame_buffer(frames[0])), b'y' * 20)
+        # 跳过的文件不占用内存
+        self.assertEqual(handler.offset, 20)
+
+    def test_arena_capped_by_file_limits(self):
+        handler = FrameUploadHandler(max_bytes=100, max_files=2)
+        # 伪造的 Content-Length 不会导致按它分配内存
+        handler.handle_raw_input(None, {}, 10 ** 12, b'boundary')
+        self.assertEqual(len(handler.arena), 200)
+
+    def test_files_beyond_arena_collected_separately(self):
+        request, handler = self.upload({'frames': [SimpleUploadedFile('a.jpg', b'A' * 60),
+                                                   SimpleUploadedFile('b.jpg', b'B' * 60)]}, max_bytes=100, max_files=1)
+        frames = request.FILES.getlist('frames')
+        self.assertEqual(len(handler.arena), 100)
+        self.assertEqual([bytes(frame_buffer(f)) for f in frames], [b'A' * 60, b'B' * 60])
+        self.assertIs(frames[0].getbuffer().obj, handler.arena)
+        self.assertIsNot(frames[1].getbuffer().obj, handler.arena)
+
+    def test_without_content_length_collects_chunks(self):
+        handler = FrameUploadHandler(max_bytes=100)
+        handler.handle_raw_input(None, {}, None, b'boundary')
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('frames', 'a.jpg', 'image/jpeg', None)
+        handler.receive_data_chunk(b'abc', 0)
+        handler.receive_data_chunk(b'de', 3)
+        self.assertIsNone(handler.arena)
+        self.assertEqual(bytes(frame_buffer(handler.file_complete(5))), b'abcde')
+
+
+class FrameBufferTests(SimpleTestCase):
+
+    def test_file_interface(self):
+        frame = FrameBuffer(b'0123456789', name='f.jpg')
+        self.assertEqual(frame.size, 10)
+        self.assertEqual(frame.read(4), b'0123')
+        self.assertEqual(frame.read(), b'456789')
+        frame.seek(-3, 2)
+        self.assertEqual(frame.tell(), 7)
+        self.assertEqual(b''.join(bytes(chunk) for chunk in frame.chunks(4)), b'0123456789')
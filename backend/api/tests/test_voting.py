@@ -0,0 +1,88 @@
+from django.test import SimpleTestCase, override_settings
+
+from api.voting_utils import (
+    VOTING, LIVENESS_PASSED, LIVENESS_FAILED,
+    record_vote, evaluate_votes, is_liveness_passed, sprt_log_likelihood_ratio,
+)
+
+
+def new_session(num_votes=5, live_threshold=0.6):
+    return {'session_id': 'test', 'num_votes': num_votes, 'live_threshold': live_threshold,
+            'total_votes': 0, 'votes_passed': 0}
+
+
+def vote_all(session_data, scores):
+    """依次计票，返回每一票之后的状态"""
+    statuses = []
+    for score in scores:
+        record_vote(session_data, score)
+        statuses.append(evaluate_votes(session_data))
+    return statuses
+
+
+@override_settings(LIVENESS_VOTING_MODE='majority', LIVENESS_EARLY_STOP=True)
+class MajorityVotingTests(SimpleTestCase):
+
+    def test_record_vote_counts_missing_face_as_failed(self):
+        session_data = new_session()
+        self.assertEqual(record_vote(session_data, None), 'failed')
+        self.assertEqual(record_vote(session_data, 0.9), 'passed')
+        self.assertEqual(record_vote(session_data, 0.1), 'failed')
+        self.assertEqual((session_data['total_votes'], session_data['votes_passed']), (3, 1))
+        self.assertEqual(session_data['liveness_scores'], [0.9, 0.1])
+
+    def test_passes_as_soon_as_majority_reached(self):
+        session_data = new_session(num_votes=5)
+        self.assertEqual(vote_all(session_data, [0.9, 0.9, 0.9]), [VOTING, VOTING, LIVENESS_PASSED])
+        self.assertEqual(session_data['liveness_decision'], LIVENESS_PASSED)
+        self.assertTrue(is_liveness_passed(session_data))
+
+    def test_fails_once_majority_is_unreachable(self):
+        session_data = new_session(num_votes=5)
+        self.assertEqual(vote_all(session_data, [0.1, None, 0.2]), [VOTING, VOTING, LIVENESS_FAILED])
+        self.assertFalse(is_liveness_passed(session_data))
+
+    def test_decision_does_not_change_after_it_is_made(self):
+        session_data = new_session(num_votes=5)
+        vote_all(session_data, [0.1, 0.1, 0.1])
+        self.assertEqual(vote_all(session_data, [0.9, 0.9]), [LIVENESS_FAILED, LIVENESS_FAILED])
+
+    @override_settings(LIVENESS_EARLY_STOP=False)
+    def test_without_early_stop_waits_for_all_votes(self):
+        session_data = new_session(num_votes=5)
+        self.assertEqual(vote_all(session_data, [0.9, 0.9, 0.9, 0.1, 0.1]),
+                         [VOTING, VOTING, VOTING, VOTING, LIVENESS_PASSED])
+
+
+@override_settings(LIVENESS_VOTING_MODE='sequential', LIVENESS_EARLY_STOP=True, LIVENESS_SPRT_MIN_VOTES=3,
+                   LIVENESS_SPRT_P_LIVE=0.8, LIVENESS_SPRT_P_SPOOF=0.3,
+                   LIVENESS_SPRT_ALPHA=0.05, LIVENESS_SPRT_BETA=0.05)
+class SequentialVotingTests(SimpleTestCase):
+
+    def test_log_likelihood_ratio_sign(self):
+        self.assertGreater(sprt_log_likelihood_ratio([1.0], 0.8, 0.3), 0)
+        self.assertLess(sprt_log_likelihood_ratio([0.0], 0.8, 0.3), 0)
+        self.assertEqual(sprt_log_likelihood_ratio([], 0.8, 0.3), 0.0)
+        # 超出 [0, 1] 的分数按边界处理
+        self.assertEqual(sprt_log_likelihood_ratio([1.5], 0.8, 0.3), sprt_log_likelihood_ratio([1.0], 0.8, 0.3))
+
+    def test_confident_live_scores_pass_before_majority(self):
+        session_data = new_session(num_votes=15)
+        statuses = vote_all(session_data, [1.0] * 8)
+        # 多数投票需要 8 票，SPRT 在最少票数之后即可确定
+        self.assertEqual(statuses[:2], [VOTING, VOTING])
+        self.assertIn(LIVENESS_PASSED, statuses[2:7])
+        self.assertGreater(session_data['liveness_llr'], 0)
+
+    def test_confident_spoof_scores_fail(self):
+        session_data = new_session(num_votes=15)
+        statuses = vote_all(session_data, [0.0] * 5)
+        self.assertEqual(statuses[-1], LIVENESS_FAILED)
+        self.assertEqual(statuses[:2], [VOTING, VOTING])
+
+    def test_undecided_scores_fall_back_to_majority(self):
+        session_data = new_session(num_votes=5, live_threshold=0.5)
+        statuses = vote_all(session_data, [0.55, 0.5, 0.55])
+        # 分数接近 0.5 时 SPRT 无法确定，由多数投票在第 3 票通过
+        self.assertLess(abs(session_data['liveness_llr']), 1.0)
+        self.assertEqual(statuses, [VOTING, VOTING, LIVENESS_PASSED])
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api import ws_recognition
+from api.async_utils import InferenceExecutorSaturated
+from api.voting_utils import VOTING, LIVENESS_PASSED
+from api.ws_recognition import CLOSE_BAD_REQUEST, CLOSE_NORMAL, CLOSE_SESSION_NOT_FOUND, recognition_websocket
+
+
+def run_socket(messages, query=b'session_id=s1'):
+    """按顺序把 messages 交给 WebSocket 处理函数，返回它发送的全部消息"""
+    incoming = [{'type': 'websocket.connect'}, *messages, {'type': 'websocket.disconnect'}]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(recognition_websocket({'type': 'websocket', 'query_string': query}, receive, send))
+    return sent
+
+
+def texts(sent):
+    return [json.loads(message['text']) for message in sent if message['type'] == 'websocket.send']
+
+
+def frame(data=b'jpeg'):
+    return {'type': 'websocket.receive', 'bytes': data}
+
+
+class RecognitionWebSocketTests(SimpleTestCase):
+
+    def setUp(self):
+        self.statuses = [VOTING, LIVENESS_PASSED]
+        self.frames = []
+        patchers = [
+            mock.patch.object(ws_recognition, 'get_recognition_session',
+                              side_effect=lambda sid: {'session_id': sid} if sid == 's1' else None),
+            mock.patch.object(ws_recognition, 'process_frame_for_session', side_effect=self._process),
+            mock.patch.object(ws_recognition, 'finalize_session', return_value={'success': True}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _process(self, session_id, frame_file):
+        self.frames.append(bytes(frame_file.getbuffer()))
+        return {'frame_result': {'success': True}, 'session_status': self.statuses.pop(0)}
+
+    def test_missing_session_id_is_rejected(self):
+        sent = run_socket([], query=b'')
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': CLOSE_BAD_REQUEST}])
+
+    def test_unknown_session_is_rejected(self):
+        sent = run_socket([], query=b'session_id=other')
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': CLOSE_SESSION_NOT_FOUND}])
+
+    def test_frames_until_decided_then_final_result(self):
+        sent = run_socket([frame(b'one'), frame(b'two'), frame(b'three')])
+        self.assertEqual(sent[0], {'type': 'websocket.accept'})
+        self.assertEqual([m['type'] for m in texts(sent)], ['frame', 'frame', 'final'])
+        self.assertEqual(texts(sent)[1]['session_status'], LIVENESS_PASSED)
+        self.assertEqual(texts(sent)[2]['final_result'], {'success': True})
+        self.assertEqual(sent[-1], {'type': 'websocket.close', 'code': CLOSE_NORMAL})
+        # 投票结束后连接关闭，之后的帧不再处理
+        self.assertEqual(self.frames, [b'one', b'two'])
+
+    def test_finalize_action(self):
+        sent = run_socket([{'type': 'websocket.receive', 'text': json.dumps({'action': 'finalize'})}])
+        self.assertEqual([m['type'] for m in texts(sent)], ['final'])
+        self.assertEqual(sent[-1]['code'], CLOSE_NORMAL)
+
+    def test_bad_messages_keep_connection_open(self):
+        sent = run_socket([{'type': 'websocket.receive', 'text': 'not json'},
+                           {'type': 'websocket.receive', 'text': json.dumps({'action': 'dance'})},
+                           frame()])
+        self.assertEqual([m['type'] for m in texts(sent)], ['error', 'error', 'frame'])
+        self.assertNotEqual(sent[-1]['type'], 'websocket.close')
+
+    def test_busy_pool_reports_retry(self):
+        real_run_inference = ws_recognition.run_inference
+
+        async def saturated(fn, *args):
+            if fn is ws_recognition.process_frame_for_session:
+                raise InferenceExecutorSaturated()
+            return await real_run_inference(fn, *args)
+
+        with mock.patch.object(ws_recognition, 'run_inference', side_effect=saturated):
+            sent = run_socket([frame()])
+        self.assertEqual(texts(sent), [{'type': 'busy', 'retry_after': 1}])
@@ -0,0 +1,119 @@
+# upload_utils.py
+# 零拷贝帧上传：整个请求的文件数据写入一块预分配的内存，
+# 每个上传文件只是这块内存上的 memoryview 切片，解码时直接用 np.frombuffer 读取
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, SkipFile
+
+
+class FrameBuffer:
+    """内存中的一帧 (或一段视频)：对外提供 memoryview，同时兼容 read()/seek() 的文件接口"""
+
+    def __init__(self, data, name='frame.jpg', content_type='image/jpeg', field_name=None):
+        self._view = data if isinstance(data, memoryview) else memoryview(data)
+        self.name = name
+        self.content_type = content_type
+        self.field_name = field_name
+        self.charset = None
+        self.content_type_extra = None
+        self._pos = 0
+
+    @property
+    def size(self):
+        return self._view.nbytes
+
+    def getbuffer(self):
+        """返回底层数据的 memoryview (不拷贝)"""
+        return self._view
+
+    def read(self, size=-1):
+        # 仅供仍按文件方式读取的旧代码使用，会产生一次拷贝
+        end = self.size if size is None or size < 0 else min(self.size, self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self.size
+        self._pos = max(0, min(pos, self.size))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def chunks(self, chunk_size=64 * 1024):
+        for start in range(0, self.size, chunk_size):
+            yield self._view[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def frame_buffer(frame_file):
+    """取得上传帧数据的只读缓冲区；FrameBuffer 直接返回其 memoryview，其他文件对象读取一次"""
+    if hasattr(frame_file, 'getbuffer'):
+        return frame_file.getbuffer()
+    frame_file.seek(0)
+    return frame_file.read()
+
+
+class FrameUploadHandler(FileUploadHandler):
+    """把请求中的所有文件写入同一块预分配内存
+
+    内存按 Content-Length 分配，但不超过 max_files 个文件各 max_bytes 的总和 (请求头由客户端填写，
+    不能据此无限分配)；写满后剩余的文件单独收集。不会落盘到临时文件，单个文件超过 max_bytes 时跳过该文件
+    """
+
+    def __init__(self, request=None, max_bytes=None, max_files=1):
+        super().__init__(request)
+        self.max_bytes = max_bytes or getattr(settings, 'RECOGNITION_FRAME_MAX_BYTES', 10 * 1024 * 1024)
+        self.max_files = max(1, max_files or 1)
+        self.arena = None
+        self.offset = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # 所有文件的总大小不会超过请求体长度，按它一次分配整块内存
+        if content_length and content_length > 0:
+            self.arena = bytearray(min(content_length, self.max_files * self.max_bytes))
+        self.offset = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.start = self.offset
+        self.chunks_data = None if self.arena is not None else bytearray()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        length = len(raw_data)
+        if self.offset + length - self.start > self.max_bytes:
+            # 跳过的文件不占用内存，后续文件从它的起点继续写
+            self.offset = self.start
+            raise SkipFile()
+        if self.chunks_data is None and self.offset + length > len(self.arena):
+            # 预分配的内存已写满，当前文件改为单独收集
+            self.chunks_data = bytearray(self.arena[self.start:self.offset])
+            self.offset = self.start
+        if self.chunks_data is not None:
+            self.chunks_data += raw_data
+        else:
+            self.arena[self.offset:self.offset + length] = raw_data
+            self.offset += length
+        return None
+
+    def file_complete(self, file_size):
+        if self.chunks_data is not None:
+            data = memoryview(self.chunks_data)
+        else:
+            data = memoryview(self.arena)[self.start:self.offset]
+        return FrameBuffer(data, self.file_name, self.content_type, self.field_name)
+
+
+def use_frame_upload_handler(request, max_bytes=None, max_files=1):
+    """在读取 request.POST / request.FILES 之前调用，为该请求启用零拷贝上传
+
+    max_files 为该接口最多接受的文件数，用于限制预分配内存的大小
+    """
+    request.upload_handlers = [FrameUploadHandler(request, max_bytes, max_files)]
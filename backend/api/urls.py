@@ -11,7 +11,11 @@ urlpatterns = [
     # 人脸识别API - 修复路径
     path('recognition/start/', views.recognition_start_api, name='recognition_start'),
     path('recognition/process_frame/', views.recognition_process_frame_api, name='recognition_process_frame'),
+    path('recognition/process_burst/', views.recognition_process_burst_api, name='recognition_process_burst'),
+    path('recognition/process_clip/', views.recognition_process_clip_api, name='recognition_process_clip'),
     path('recognition/finalize/', views.recognition_finalize_api, name='recognition_finalize'),
+    path('recognition/quality_config/', views.recognition_quality_config_api, name='recognition_quality_config'),
+    path('recognition/identify/', views.recognition_identify_api, name='recognition_identify'),
     
     # 保持原有路径兼容性
     path('recognition_start/', views.recognition_start_api, name='recognition_start_old'),
@@ -21,7 +25,10 @@ urlpatterns = [
     path('users/', views.users_api, name='users'),
     path('audit_logs/', views.audit_logs_api, name='audit_logs'),
     path('alert_logs/', views.alert_logs_api, name='alert_logs'),
+    path('stats/', views.audit_stats_api, name='audit_stats'),
     path('create_admin/', views.create_admin_api, name='create_admin'),
     path('delete_user/', views.delete_user, name='delete_user'),
+    path('models/', views.models_api, name='models'),
+    path('models/activate/', views.models_activate_api, name='models_activate'),
     path('log_operation/', views.log_operation_api, name='log_operation'),  # 新增
 ]
@@ -1,14 +1,20 @@
 import os
 import sys
+import struct
+import hashlib
+import tempfile
+import threading
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from django.conf import settings
-from django.contrib.auth.models import User
-from .models import AuditLog
+from .audit_utils import add_audit_log_entry, get_audit_log_writer
 
-# 修复NumPy导入问题
+# 修复NumPy导入问题 (serve_recognition 会按 CPU 核数和工作进程数预先设置线程数)
 try:
-    os.environ['OPENBLAS_NUM_THREADS'] = '1'
-    os.environ['MKL_NUM_THREADS'] = '1'
+    os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+    os.environ.setdefault('MKL_NUM_THREADS', '1')
     
     import numpy as np
     import cv2
@@ -18,59 +24,114 @@ except ImportError as e:
     OPENCV_AVAILABLE = False
     print(f"❌ OpenCV/NumPy导入失败: {e}")
 
-# 检查深度学习库依赖
-try:
-    from deepface import DeepFace
-    DEEPFACE_AVAILABLE = True
-    print("✅ DeepFace导入成功")
-except ImportError as e:
-    DEEPFACE_AVAILABLE = False
-    print(f"❌ DeepFace导入失败: {e}")
+from .detector_utils import detect_faces_tracked, largest_face, crop_face
+# 活体模型、DeepFace 和人脸检测器的预热都由模型管理器延迟完成，导入本模块不会加载 TensorFlow
+from .model_manager import get_model_manager, ModelVersionUnavailable, TENSORFLOW_INSTALLED as TENSORFLOW_AVAILABLE
 
-try:
-    import tensorflow as tf
-    from tensorflow.keras.models import load_model
-    TENSORFLOW_AVAILABLE = True
-    print(f"✅ TensorFlow导入成功 (版本: {tf.__version__})")
-    
-    # 尝试加载活体检测模型
-    model_path = os.path.join(settings.BASE_DIR, 'anandfinal.hdf5')
-    if os.path.exists(model_path):
-        try:
-            LIVENESS_MODEL = load_model(model_path)
-            print(f"✅ 活体检测模型加载成功: {model_path}")
-            MODEL_LOADED = True
-        except Exception as e:
-            print(f"❌ 模型加载失败: {e}")
-            LIVENESS_MODEL = None
-            MODEL_LOADED = False
-    else:
-        print(f"❌ 模型文件不存在: {model_path}")
-        LIVENESS_MODEL = None
-        MODEL_LOADED = False
-        
-except ImportError as e:
-    TENSORFLOW_AVAILABLE = False
-    MODEL_LOADED = False
-    LIVENESS_MODEL = None
-    print(f"❌ TensorFlow导入失败: {e}")
+from .embedding_utils import (
+    get_embedding_config,
+    compute_embedding,
+    save_identity_embedding,
+    get_or_create_identity_embedding,
+    load_identity_embedding,
+    embedding_distance,
+    incremental_embedding_enabled,
+    update_running_mean,
+    submit_session_embedding,
+    discard_session_embeddings
+)
+from .index_utils import get_embedding_index, metric_distance
+from .session_store import get_session_store, session_lock
+from .async_utils import get_inference_executor
+from .upload_utils import FrameBuffer, frame_buffer
+from .quality_utils import (
+    REJECT_DUPLICATE,
+    REJECT_NO_FACE,
+    REJECT_MULTIPLE_FACES,
+    get_quality_config,
+    assess_frame_quality,
+    is_duplicate_frame,
+    rejection_analysis
+)
+from .voting_utils import VOTING, record_vote, evaluate_votes, is_liveness_passed, required_votes as get_required_votes
+from .inference_utils import (
+    LIVENESS_INPUT_SIZE,
+    preprocess_liveness_frame,
+    preprocess_liveness_face
+)
 
-def add_audit_log_entry(username, action, status, compare_result=None, score=0.0, image_path=None):
-    """添加审计日志条目"""
-    try:
-        user = User.objects.get(username=username)
-        AuditLog.objects.create(
-            user=user,
-            action=action,
-            liveness_status=status,
-            compare_result=compare_result,
-            score=score,
-            image_path=image_path
-        )
-    except User.DoesNotExist:
-        print(f"用户 {username} 不存在，无法记录审计日志")
-    except Exception as e:
-        print(f"记录审计日志失败: {e}")
+model_manager = get_model_manager()
+
+def predict_liveness(face_tensor, version=None):
+    """对单张预处理后的人脸张量做活体推理，返回模型输出的一行 [假, 真]
+
+    version 为会话固定的活体模型版本 (见 session_frame_hints)
+    """
+    return model_manager.predict_liveness(face_tensor, version)
+
+def session_embedding_config(session_data):
+    """会话创建时固定的人脸特征模型配置"""
+    return get_embedding_config((session_data.get('model_versions') or {}).get('embedding'))
+
+def face_payload_size(face_data):
+    """会话中有效人脸数据的字节数 (可能是解码后的数组或原始字节)"""
+    if face_data is None:
+        return 0
+    return int(getattr(face_data, 'nbytes', len(face_data)))
+
+def decode_face_payload(face_data):
+    """把会话中的有效人脸转换为 BGR 数组；已是数组时直接返回"""
+    if isinstance(face_data, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(face_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return face_data
+
+def _accumulate_session_embedding(session_id, embedding):
+    """后台特征提取完成后并入会话的特征均值；提取失败 (embedding 为 None) 时只计数"""
+    def accumulate(data):
+        if embedding is None:
+            data['embedding_failed'] = data.get('embedding_failed', 0) + 1
+        else:
+            update_running_mean(data, embedding)
+    mutate_recognition_session(session_id, accumulate)
+
+def submit_embedding_faces(session_data, faces):
+    """会话修改提交 (CAS 成功) 之后再提交后台特征提取，CAS 重试不会重复提交同一帧"""
+    config = session_embedding_config(session_data) if faces else None
+    for face in faces:
+        submit_session_embedding(session_data['session_id'], face, _accumulate_session_embedding, config)
+
+def wait_session_embeddings(session_data, timeout):
+    """等待会话已提交的特征提取全部完成，返回最新的会话数据
+
+    以会话记录中的计数 (embedding_count + embedding_failed 达到 embedding_frames) 判断，
+    特征提取可能在其他进程中进行；超时后使用已完成的部分
+    """
+    deadline = time.monotonic() + timeout
+    interval = getattr(settings, 'RECOGNITION_EMBEDDING_POLL_INTERVAL', 0.05)
+    while True:
+        done = session_data.get('embedding_count', 0) + session_data.get('embedding_failed', 0)
+        if done >= session_data.get('embedding_frames', 0):
+            return session_data
+        if time.monotonic() >= deadline:
+            print(f"⚠️ 会话 {session_data['session_id']} 的特征提取未全部完成: {done}/{session_data['embedding_frames']}")
+            return session_data
+        time.sleep(interval)
+        session_data = get_recognition_session(session_data['session_id']) or session_data
+
+def get_session_live_embedding(session_data):
+    """获取会话的实时人脸特征；没有有效人脸时返回 None"""
+    if session_data.get('embedding_frames'):
+        session_data = wait_session_embeddings(
+            get_recognition_session(session_data['session_id']) or session_data,
+            getattr(settings, 'RECOGNITION_EMBEDDING_WAIT_TIMEOUT', 10))
+        if session_data.get('embedding_mean') is not None:
+            return np.asarray(session_data['embedding_mean'], dtype=np.float32)
+    
+    face_data = session_data.get('last_valid_face')
+    if face_payload_size(face_data) == 0:
+        return None
+    live_face = decode_face_payload(face_data)
+    return compute_embedding(live_face, session_embedding_config(session_data)) if live_face is not None else None
 
 def save_identity_photo(username, image_bytes):
     """保存用户身份照片"""
@@ -82,89 +143,242 @@ def save_identity_photo(username, image_bytes):
         with open(photo_path, 'wb') as f:
             f.write(image_bytes)
         
+        # 注册时计算一次身份特征，识别时不再重复检测和提取照片特征
+        if model_manager.deepface_available and OPENCV_AVAILABLE:
+            try:
+                image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+                embedding = compute_embedding(image if image is not None else photo_path)
+                save_identity_embedding(username, embedding)
+                get_embedding_index().add(username, embedding)
+            except Exception as e:
+                # 特征计算失败不影响注册，首次识别时会从照片重新生成
+                print(f"计算身份特征失败 {username}: {e}")
+        
         return True, photo_path
     except Exception as e:
         return False, str(e)
 
-def process_single_frame_real(frame_file, session_data):
-    """真实的AI模型处理"""
+def frame_decode_flags(nbytes):
+    """大尺寸输入可选择以一半分辨率解码 (IMREAD_REDUCED_COLOR_2)，解码更快、内存更少"""
+    if (getattr(settings, 'RECOGNITION_REDUCED_DECODE', False)
+            and nbytes >= getattr(settings, 'RECOGNITION_REDUCED_DECODE_MIN_BYTES', 256 * 1024)):
+        return cv2.IMREAD_REDUCED_COLOR_2
+    return cv2.IMREAD_COLOR
+
+def decode_frame(frame_file):
+    """解码上传的帧；无法解码时返回 None"""
+    # 直接在上传缓冲区上解码，不再拷贝帧数据
+    buffer = frame_buffer(frame_file)
+    return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), frame_decode_flags(len(buffer)))
+
+def session_frame_hints(session_data):
+    """从会话中取出分析下一帧所需的上下文：上一帧的感知哈希、人脸跟踪框和固定的活体模型版本"""
+    hints = {
+        'previous_hash': session_data.get('last_frame_hash'),
+        'track_box': None,
+        'liveness_version': (session_data.get('model_versions') or {}).get('liveness'),
+    }
+    track = session_data.get('face_track')
+    # 连续跟踪若干帧后做一次整帧检测，以便发现画面中新出现的人脸
+    if (track and getattr(settings, 'FACE_TRACKING_ENABLED', True)
+            and track['streak'] < getattr(settings, 'FACE_TRACKING_REDETECT_EVERY', 5)):
+        hints['track_box'] = track['box']
+    return hints
+
+def inspect_frame(frame, hints=None):
+    """先做质量检查，通过后再检测人脸，返回 (帧, 人脸框, 质量检查结果, 是否命中跟踪区域)
+
+    质量检查未通过时人脸框为 None；关闭质量检查时质量检查结果为 None
+    """
+    hints = hints or {}
+    quality = None
+    if get_quality_config()['enabled']:
+        quality = assess_frame_quality(frame, hints.get('previous_hash'))
+        if quality['reason']:
+            return frame, None, quality, False
+    # 人脸检测：先在上一帧人脸附近查找，丢失时再检测整帧
+    faces, tracked = detect_faces_tracked(frame, hints.get('track_box'),
+                                          getattr(settings, 'FACE_TRACKING_PADDING', 0.5))
+    return frame, faces, quality, tracked
+
+def decode_and_inspect(frame_file, hints=None):
+    """解码、质量检查和人脸检测；无法解码时帧为 None"""
+    frame = decode_frame(frame_file)
+    if frame is None:
+        return None, None, None, False
+    return inspect_frame(frame, hints)
+
+def select_liveness_face(faces, quality=None):
+    """选出用于活体推理的人脸框；质量不合格、没有人脸或 (默认) 有多张人脸时返回拒绝结果
+
+    返回 (人脸框, None) 或 (None, 分析结果)
+    """
+    if quality is not None and quality['reason']:
+        return None, rejection_analysis(quality['reason'], quality)
+    if len(faces) == 0:
+        return None, rejection_analysis(REJECT_NO_FACE, quality)
+    if len(faces) > 1 and getattr(settings, 'LIVENESS_REJECT_MULTIPLE_FACES', True):
+        return None, rejection_analysis(REJECT_MULTIPLE_FACES, quality, len(faces))
+    return largest_face(faces), None
+
+def prepare_liveness_input(frame, box, out=None):
+    """生成活体模型输入：默认只用人脸 ROI，LIVENESS_FACE_ROI=False 时使用整帧"""
+    if getattr(settings, 'LIVENESS_FACE_ROI', True):
+        return preprocess_liveness_face(frame, box, getattr(settings, 'LIVENESS_FACE_MARGIN', 0.25), out)
+    tensor = preprocess_liveness_frame(frame)
+    if out is not None:
+        out.reshape(tensor.shape)[...] = tensor
+    return tensor
+
+def build_frame_analysis(frame, box, prediction, quality=None, tracked=False):
+    """由人脸框和活体推理输出组装单帧分析结果"""
+    # 会话只保留人脸的小尺寸裁剪图，而不是整帧
+    crop_size = getattr(settings, 'RECOGNITION_FACE_CROP_SIZE', 160)
+    face_crop = crop_face(frame, box, (crop_size, crop_size),
+                          getattr(settings, 'RECOGNITION_FACE_CROP_MARGIN', 0.2))
+    analysis = {
+        'face_detected': True,
+        'real_score': float(prediction[1]),  # 真实人脸的概率
+        'face': face_crop,
+        'face_box': [int(v) for v in box],
+        'tracked': tracked
+    }
+    if quality is not None:
+        analysis['frame_hash'] = quality['frame_hash']
+    return analysis
+
+def analyze_frame_real(frame_file, hints=None):
+    """真实的AI模型分析：解码、质量检查、人脸检测和活体推理 (不修改会话)
+
+    hints 由 session_frame_hints 生成，用于跳过重复帧和在上一帧人脸附近检测
+    """
     try:
-        if not MODEL_LOADED or not OPENCV_AVAILABLE:
-            return process_single_frame_simple(frame_file, session_data)
-        
-        # 读取和预处理图像
-        frame_file.seek(0)  # 重置文件指针
-        file_bytes = np.asarray(bytearray(frame_file.read()), dtype=np.uint8)
-        frame = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        if not model_manager.model_loaded or not OPENCV_AVAILABLE:
+            return analyze_frame_simple(frame_file)
         
+        frame, faces, quality, tracked = decode_and_inspect(frame_file, hints)
         if frame is None:
-            return process_single_frame_simple(frame_file, session_data)
-        
-        # 人脸检测
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        if len(faces) == 0:
-            session_data['total_votes'] += 1
-            return {
-                'frame_result': {
-                    'success': False,
-                    'message': '未检测到人脸'
-                },
-                'session_data': session_data,
-                'session_status': 'voting'
-            }
-        
-        # 活体检测
-        resized_frame = cv2.resize(frame, (128, 128))
-        resized_frame = resized_frame.astype("float") / 255.0
-        resized_frame = np.expand_dims(resized_frame, axis=0)
-        
-        prediction = LIVENESS_MODEL.predict(resized_frame)
-        real_score = prediction[0][1]  # 真实人脸的概率
-        
-        # 更新投票统计
-        session_data['total_votes'] += 1
-        if real_score >= session_data['live_threshold']:
-            session_data['votes_passed'] += 1
-            vote_result = 'passed'
-            
-            # 保存有效人脸 - 重新读取文件内容
-            frame_file.seek(0)
-            session_data['last_valid_face'] = frame_file.read()
-        else:
-            vote_result = 'failed'
+            return analyze_frame_simple(frame_file)
+        box, rejection = select_liveness_face(faces, quality)
+        if rejection is not None:
+            return rejection
         
-        # 检查是否完成所有投票
-        if session_data['total_votes'] >= session_data['num_votes']:
-            required_votes = (session_data['num_votes'] // 2) + 1
-            if session_data['votes_passed'] >= required_votes:
-                session_status = 'liveness_passed'
-            else:
-                session_status = 'liveness_failed'
-        else:
-            session_status = 'voting'
-        
-        return {
-            'frame_result': {
-                'success': True,
-                'liveness_score': float(real_score),
-                'vote_result': vote_result,
-                'votes_passed': session_data['votes_passed'],
-                'total_votes': session_data['total_votes'],
-                'face_detected': True
-            },
-            'session_data': session_data,
-            'session_status': session_status
-        }
+        # 活体检测 (只用人脸区域)
+        prediction = predict_liveness(prepare_liveness_input(frame, box), (hints or {}).get('liveness_version'))
+        return build_frame_analysis(frame, box, prediction, quality, tracked)
         
+    except ModelVersionUnavailable:
+        # 会话固定的模型版本不可用时整个请求失败，不能退回到模拟结果
+        raise
     except Exception as e:
         print(f"真实AI处理错误: {e}")
-        return process_single_frame_simple(frame_file, session_data)
+        return analyze_frame_simple(frame_file)
 
-def process_single_frame_simple(frame_file, session_data):
-    """简化版本的单帧处理 - 模拟模式"""
+_burst_executor = None
+_burst_executor_lock = threading.Lock()
+
+def _get_burst_executor():
+    global _burst_executor
+    if _burst_executor is None:
+        with _burst_executor_lock:
+            if _burst_executor is None:
+                _burst_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'RECOGNITION_BURST_WORKERS', None) or os.cpu_count() or 1,
+                    thread_name_prefix='burst-decode'
+                )
+    return _burst_executor
+
+def analyze_frames_real(frame_files, hints=None):
+    """多帧分析：并行解码、质量检查和检测，所有检测到人脸的帧一次批量做活体推理
+
+    返回与逐帧调用 analyze_frame_real 相同格式的分析结果列表
+    """
+    if not model_manager.model_loaded or not OPENCV_AVAILABLE:
+        return [analyze_frame_simple(f) for f in frame_files]
+    
+    # 各帧并行检测，不使用跟踪框；重复帧在 _score_detections 中按顺序判断
+    futures = [_get_burst_executor().submit(decode_and_inspect, f) for f in frame_files]
+    return _score_detections(futures, lambda i: analyze_frame_simple(frame_files[i]), hints)
+
+def analyze_video_frames_real(frames, hints=None):
+    """已解码视频帧的多帧分析：并行质量检查和人脸检测，再批量做活体推理"""
+    futures = [_get_burst_executor().submit(inspect_frame, f) for f in frames]
+    return _score_detections(futures, lambda i: analyze_frame_simple(FrameBuffer(frames[i].reshape(-1))), hints)
+
+def _score_detections(futures, fallback, hints=None):
+    """收集 (帧, 人脸框, 质量检查结果, _)，合格的帧一次批量推理；失败的帧用 fallback(i) 代替
+
+    重复帧需要按顺序与前一帧比较，所以在并行检测之后、批量推理之前判断
+    """
+    hints = hints or {}
+    previous_hash = hints.get('previous_hash')
+    analyses = [None] * len(futures)
+    detections = []
+    for i, future in enumerate(futures):
+        try:
+            frame, faces, quality, _ = future.result()
+        except Exception as e:
+            print(f"真实AI处理错误: {e}")
+            frame, faces, quality = None, None, None
+        if frame is None:
+            analyses[i] = fallback(i)
+            continue
+        if quality is not None:
+            if not quality['reason'] and is_duplicate_frame(quality['frame_hash'], previous_hash):
+                quality['reason'] = REJECT_DUPLICATE
+            previous_hash = quality['frame_hash']
+        box, rejection = select_liveness_face(faces, quality)
+        if rejection is not None:
+            analyses[i] = rejection
+        else:
+            detections.append((i, frame, box, quality))
+    
+    if detections:
+        try:
+            # 各帧直接预处理到批次缓冲区的对应行
+            width, height = LIVENESS_INPUT_SIZE
+            batch = np.empty((len(detections), height, width, 3), dtype=np.float32)
+            for row, (_, frame, box, _) in enumerate(detections):
+                prepare_liveness_input(frame, box, out=batch[row])
+            predictions = model_manager.predict_liveness_batch(batch, hints.get('liveness_version'))
+            for (i, frame, box, quality), prediction in zip(detections, predictions):
+                analyses[i] = build_frame_analysis(frame, box, prediction, quality)
+        except ModelVersionUnavailable:
+            raise
+        except Exception as e:
+            print(f"批量活体推理错误: {e}")
+            for i, _, _, _ in detections:
+                analyses[i] = fallback(i)
+    return analyses
+
+def iter_clip_frames(clip_file, stride):
+    """用 cv2.VideoCapture 逐帧解码短视频，每 stride 帧产出一帧 (生成器，按需解码)
+
+    跳过的帧只调用 grab()，不做颜色转换和拷贝；上传内容写入临时文件后由 OpenCV 读取，
+    生成器关闭时释放解码器并删除临时文件
+    """
+    suffix = os.path.splitext(getattr(clip_file, 'name', '') or '')[1] or '.webm'
+    tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with tmp:
+            tmp.write(frame_buffer(clip_file))
+        
+        cap = cv2.VideoCapture(tmp.name)
+        try:
+            index = 0
+            while cap.grab():
+                if index % stride == 0:
+                    ok, frame = cap.retrieve()
+                    if ok and frame is not None:
+                        yield frame
+                index += 1
+        finally:
+            cap.release()
+    finally:
+        os.remove(tmp.name)
+
+def analyze_frame_simple(frame_file):
+    """简化版本的单帧分析 - 模拟模式"""
     try:
         # 模拟处理结果，避免复杂的AI模型依赖
         import random
@@ -174,77 +388,147 @@ def process_single_frame_simple(frame_file, session_data):
         variance = 0.2    # 变化范围
         liveness_score = random.uniform(base_score - variance, base_score + variance)
         
-        # 更新投票统计
-        session_data['total_votes'] += 1
-        if liveness_score >= session_data['live_threshold']:
-            session_data['votes_passed'] += 1
-            vote_result = 'passed'
-            
-            # 确保保存有效人脸数据
-            try:
-                frame_file.seek(0)
-                frame_data = frame_file.read()
-                if frame_data and len(frame_data) > 0:
-                    session_data['last_valid_face'] = frame_data
-                    print(f"✅ 保存有效人脸数据: {len(frame_data)} 字节")
-                else:
-                    # 如果没有真实数据，创建模拟数据
-                    session_data['last_valid_face'] = b'MOCK_FACE_DATA_' + str(random.randint(1000, 9999)).encode()
-                    print("📝 创建模拟人脸数据")
-            except Exception as e:
-                print(f"保存人脸数据时出错: {e}")
-                # 创建备用模拟数据
-                session_data['last_valid_face'] = b'BACKUP_FACE_DATA_' + str(random.randint(1000, 9999)).encode()
-        else:
-            vote_result = 'failed'
-        
-        # 检查是否完成所有投票
-        if session_data['total_votes'] >= session_data['num_votes']:
-            required_votes = (session_data['num_votes'] // 2) + 1
-            if session_data['votes_passed'] >= required_votes:
-                session_status = 'liveness_passed'
+        # 模拟模式不做真实匹配，会话只保存帧的摘要作为有效人脸标记
+        try:
+            frame_data = frame_buffer(frame_file)
+            if len(frame_data):
+                frame_data = b'SIMULATED_FACE:' + hashlib.sha1(frame_data).hexdigest().encode()
             else:
-                session_status = 'liveness_failed'
-        else:
-            session_status = 'voting'
+                # 如果没有真实数据，创建模拟数据
+                frame_data = b'MOCK_FACE_DATA_' + str(random.randint(1000, 9999)).encode()
+                print("📝 创建模拟人脸数据")
+        except Exception as e:
+            print(f"读取人脸数据时出错: {e}")
+            # 创建备用模拟数据
+            frame_data = b'BACKUP_FACE_DATA_' + str(random.randint(1000, 9999)).encode()
         
         return {
-            'frame_result': {
-                'success': True,
-                'liveness_score': liveness_score,
-                'vote_result': vote_result,
-                'votes_passed': session_data['votes_passed'],
-                'total_votes': session_data['total_votes'],
-                'face_detected': True,
-                'simulation_mode': True  # 标记为模拟模式
-            },
-            'session_data': session_data,
-            'session_status': session_status
+            'face_detected': True,
+            'real_score': liveness_score,
+            'face': frame_data,
+            'simulation_mode': True  # 标记为模拟模式
         }
-        
     except Exception as e:
+        return {'error': f'处理错误: {str(e)}', 'simulation_mode': True}
+
+def apply_frame_analysis(session_data, analysis, embedding_faces=None):
+    """把单帧分析结果计入会话投票，返回 (frame_result, session_status)
+
+    只做轻量的状态修改，调用方需保证对同一会话的调用是原子的；
+    启用增量特征时需要提取特征的人脸追加到 embedding_faces，由调用方在修改提交后用
+    submit_embedding_faces 提交 (未传入时立即提交)
+    """
+    decision = session_data.get('liveness_decision')
+    if decision:
+        # 投票已提前结束 (或并发的其他帧已决定结果)，本帧不再计票
+        return {'success': False, 'message': '活体检测已结束'}, decision
+    
+    if analysis.get('error'):
+        return {'success': False, 'message': analysis['error']}, 'error'
+    
+    # 与会话中上一帧比较 (并发上传时以计票顺序为准)
+    frame_hash = analysis.get('frame_hash')
+    if frame_hash is not None:
+        previous_hash = session_data.get('last_frame_hash')
+        session_data['last_frame_hash'] = frame_hash
+        if not analysis.get('rejected') and is_duplicate_frame(frame_hash, previous_hash):
+            analysis = rejection_analysis(REJECT_DUPLICATE)
+    
+    if analysis.get('rejected'):
+        # 质量不合格的帧快速返回，不计票
+        session_data['frames_rejected'] = session_data.get('frames_rejected', 0) + 1
+        frame_result = {'success': False, 'rejected': True, 'reason': analysis['reason'], 'message': analysis['message']}
+        if 'quality' in analysis:
+            frame_result['quality'] = analysis['quality']
+        return frame_result, evaluate_votes(session_data)
+    
+    # 记住人脸位置，下一帧先在附近检测；人脸丢失时下一帧回退到整帧检测
+    if 'face_box' in analysis:
+        track = session_data.get('face_track') or {}
+        streak = track.get('streak', 0) + 1 if analysis.get('tracked') else 0
+        session_data['face_track'] = {'box': analysis['face_box'], 'streak': streak}
+    elif analysis.get('reason') in (REJECT_NO_FACE, REJECT_MULTIPLE_FACES):
+        session_data.pop('face_track', None)
+    
+    if not analysis['face_detected']:
+        record_vote(session_data, None)
         return {
-            'frame_result': {'success': False, 'message': f'处理错误: {str(e)}'},
-            'session_data': session_data,
-            'session_status': 'error'
-        }
+            'success': False,
+            'reason': analysis.get('reason', REJECT_NO_FACE),
+            'message': analysis.get('message', '未检测到人脸')
+        }, evaluate_votes(session_data)
+    
+    # 更新投票统计
+    vote_result = record_vote(session_data, analysis['real_score'])
+    if vote_result == 'passed':
+        face = analysis['face']
+        if analysis.get('simulation_mode'):
+            session_data['last_valid_face'] = face
+            print(f"✅ 保存有效人脸数据: {face_payload_size(face)} 字节")
+        elif incremental_embedding_enabled() and model_manager.deepface_available:
+            # 后台提取该帧特征并累积到会话均值中，会话不再保存原始帧
+            session_data['embedding_frames'] = session_data.get('embedding_frames', 0) + 1
+            if embedding_faces is None:
+                submit_embedding_faces(session_data, [face])
+            else:
+                embedding_faces.append(face)
+        else:
+            # 写入会话预分配的人脸缓冲区，识别阶段直接复用，无需再次解码
+            buffer = session_data.get('last_valid_face')
+            if not isinstance(buffer, np.ndarray) or buffer.shape != face.shape:
+                buffer = np.empty(face.shape, dtype=np.uint8)
+                session_data['last_valid_face'] = buffer
+            np.copyto(buffer, face)
+    
+    # 结果确定后提前结束投票
+    session_status = evaluate_votes(session_data)
+    
+    frame_result = {
+        'success': True,
+        'liveness_score': analysis['real_score'],
+        'vote_result': vote_result,
+        'votes_passed': session_data['votes_passed'],
+        'total_votes': session_data['total_votes'],
+        'face_detected': True
+    }
+    if analysis.get('simulation_mode'):
+        frame_result['simulation_mode'] = True
+    return frame_result, session_status
+
+def process_single_frame_real(frame_file, session_data):
+    """真实的AI模型处理"""
+    frame_result, session_status = apply_frame_analysis(
+        session_data, analyze_frame_real(frame_file, session_frame_hints(session_data)))
+    return {
+        'frame_result': frame_result,
+        'session_data': session_data,
+        'session_status': session_status
+    }
+
+def process_single_frame_simple(frame_file, session_data):
+    """简化版本的单帧处理 - 模拟模式"""
+    frame_result, session_status = apply_frame_analysis(session_data, analyze_frame_simple(frame_file))
+    return {
+        'frame_result': frame_result,
+        'session_data': session_data,
+        'session_status': session_status
+    }
 
 def finalize_face_recognition_real(session_data):
     """真实的AI人脸识别"""
     try:
-        if not DEEPFACE_AVAILABLE or not OPENCV_AVAILABLE:
+        if not model_manager.deepface_available or not OPENCV_AVAILABLE:
             return finalize_face_recognition_simple(session_data)
         
         username = session_data['username']
         
         # 检查活体检测是否通过
-        required_votes = (session_data['num_votes'] // 2) + 1
-        if session_data['votes_passed'] < required_votes:
+        if not is_liveness_passed(session_data):
             add_audit_log_entry(username, "face_recognition", "FAIL", "LIVENESS_FAILED", 
-                              score=session_data['votes_passed']/session_data['num_votes'])
+                              score=session_data['votes_passed']/max(session_data['total_votes'], 1))
             return {
                 'success': False,
-                'message': f"活体检测失败: {session_data['votes_passed']}/{session_data['num_votes']}"
+                'message': f"活体检测失败: {session_data['votes_passed']}/{session_data['total_votes']}"
             }
         
         # 获取用户身份照片路径
@@ -253,31 +537,20 @@ def finalize_face_recognition_real(session_data):
             add_audit_log_entry(username, "face_recognition", "FAIL", "NO_IDENTITY_PHOTO")
             return {'success': False, 'message': '找不到用户身份照片'}
         
-        # 检查是否有有效人脸
-        if not session_data.get('last_valid_face'):
-            add_audit_log_entry(username, "face_recognition", "FAIL", "NO_VALID_FACE")
-            return {'success': False, 'message': '没有有效人脸用于匹配'}
-        
         # 使用DeepFace进行人脸匹配
         try:
-            # 保存临时图像进行比较
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-                tmp_file.write(session_data['last_valid_face'])
-                tmp_path = tmp_file.name
-            
-            result = DeepFace.verify(
-                img1_path=tmp_path,
-                img2_path=identity_path,
-                enforce_detection=False,
-                model_name="Facenet"
-            )
+            # 实时人脸特征：优先使用投票阶段累积的均值，否则从内存中的有效人脸提取
+            live_embedding = get_session_live_embedding(session_data)
+            if live_embedding is None:
+                add_audit_log_entry(username, "face_recognition", "FAIL", "NO_VALID_FACE")
+                return {'success': False, 'message': '没有有效人脸用于匹配'}
             
-            # 清理临时文件
-            os.unlink(tmp_path)
+            # 身份特征在注册时已计算，这里只需计算一次距离
+            embedding_config = session_embedding_config(session_data)
+            identity_embedding = get_or_create_identity_embedding(username, identity_path, embedding_config)
             
-            verified = result.get("verified", False)
-            distance = result.get("distance", 0.0)
+            distance = embedding_distance(live_embedding, identity_embedding, embedding_config['distance_metric'])
+            verified = distance <= embedding_config['threshold']
             score = 1.0 - distance  # 转换为相似度分数
             
             if verified:
@@ -309,21 +582,21 @@ def finalize_face_recognition_simple(session_data):
         username = session_data['username']
         
         # 检查活体检测是否通过
-        required_votes = (session_data['num_votes'] // 2) + 1
-        if session_data['votes_passed'] < required_votes:
+        required_votes = get_required_votes(session_data)
+        if not is_liveness_passed(session_data):
             add_audit_log_entry(username, "face_recognition", "FAIL", "LIVENESS_FAILED", 
-                              score=session_data['votes_passed']/session_data['num_votes'])
+                              score=session_data['votes_passed']/max(session_data['total_votes'], 1))
             return {
                 'success': False,
-                'message': f"活体检测失败: {session_data['votes_passed']}/{session_data['num_votes']}",
+                'message': f"活体检测失败: {session_data['votes_passed']}/{session_data['total_votes']}",
                 'simulation_mode': True
             }
         
         # 强化有效人脸检查逻辑
         last_valid_face = session_data.get('last_valid_face')
-        print(f"🔍 检查有效人脸: type={type(last_valid_face)}, has_data={bool(last_valid_face)}")
+        print(f"🔍 检查有效人脸: type={type(last_valid_face)}, size={face_payload_size(last_valid_face)}")
         
-        if not last_valid_face:
+        if face_payload_size(last_valid_face) == 0:
             # 如果没有有效人脸，尝试创建一个
             if session_data['votes_passed'] > 0:
                 # 如果有通过的投票，创建模拟人脸数据
@@ -369,7 +642,7 @@ def finalize_face_recognition_simple(session_data):
                 'message': '身份验证成功 (模拟)', 
                 'score': match_score,
                 'simulation_mode': True,
-                'debug_info': f'face_data_size: {len(last_valid_face)} bytes'
+                'debug_info': f'face_data_size: {face_payload_size(last_valid_face)} bytes'
             }
         else:
             match_score = random.uniform(0.15, 0.45)  # 失败时的低分数
@@ -389,21 +662,281 @@ def finalize_face_recognition_simple(session_data):
             'simulation_mode': True
         }
 
+def identify_face(face_data=None, session_data=None):
+    """1:N 人脸识别：在所有已注册用户中查找最匹配的身份，只返回最佳匹配
+
+    只有活体检测已通过的会话 (session_data) 才记录识别成功的审计日志；
+    直接传入单帧 (face_data) 时没有活体检测，不记录
+    """
+    try:
+        if not model_manager.deepface_available or not OPENCV_AVAILABLE:
+            return {'success': False, 'message': '人脸识别组件不可用', 'simulation_mode': True}
+        
+        # 阈值、度量和检索索引都使用会话固定的特征模型版本
+        if session_data is not None:
+            embedding_config = session_embedding_config(session_data)
+            live_embedding = get_session_live_embedding(session_data)
+        else:
+            embedding_config = get_embedding_config()
+            live_face = decode_face_payload(face_data)
+            live_embedding = compute_embedding(live_face, embedding_config) if live_face is not None else None
+        if live_embedding is None:
+            return {'success': False, 'message': '没有有效人脸用于识别'}
+        
+        # 取前 FACE_IDENTIFY_TOP_K 个候选，按会话的距离度量重新计算并排序：
+        # 未归一化的欧氏距离与索引使用的余弦距离排序不一致，余弦最近的不一定是欧氏最近的
+        candidates = get_embedding_index().search(live_embedding, None, embedding_config)
+        if not candidates:
+            return {'success': False, 'message': '没有已注册的用户'}
+        
+        metric = embedding_config['distance_metric']
+        ranked = []
+        for username, cosine_distance in candidates:
+            distance = metric_distance(cosine_distance, metric)
+            if distance is None:
+                identity_embedding = load_identity_embedding(username, embedding_config)
+                if identity_embedding is None:
+                    continue
+                distance = embedding_distance(live_embedding, identity_embedding, metric)
+            ranked.append((distance, username))
+        if not ranked:
+            return {'success': False, 'message': '未找到匹配的用户'}
+        best_distance, best_username = min(ranked)
+        score = 1.0 - best_distance
+        if best_distance <= embedding_config['threshold']:
+            if session_data is not None:
+                add_audit_log_entry(best_username, "face_identification", "SUCCESS", "MATCH", score=score)
+            return {
+                'success': True,
+                'message': '身份识别成功',
+                'username': best_username,
+                'score': score
+            }
+        return {
+            'success': False,
+            'message': '未找到匹配的用户'
+        }
+    except Exception as e:
+        return {'success': False, 'message': f'身份识别出错: {str(e)}'}
+
 # 主要处理函数 - 自动选择真实或模拟模式
+def analyze_frame(frame_file, hints=None):
+    """自动选择分析模式；hints 由 session_frame_hints 生成"""
+    if model_manager.model_loaded and OPENCV_AVAILABLE:
+        return analyze_frame_real(frame_file, hints)
+    else:
+        return analyze_frame_simple(frame_file)
+
 def process_single_frame(frame_file, session_data):
     """自动选择处理模式"""
-    if MODEL_LOADED and OPENCV_AVAILABLE and TENSORFLOW_AVAILABLE:
-        return process_single_frame_real(frame_file, session_data)
+    if session_data.get('liveness_decision'):
+        # 投票已提前结束，不再消耗推理
+        frame_result, session_status = apply_frame_analysis(session_data, {})
+    else:
+        frame_result, session_status = apply_frame_analysis(
+            session_data, analyze_frame(frame_file, session_frame_hints(session_data)))
+    return {
+        'frame_result': frame_result,
+        'session_data': session_data,
+        'session_status': session_status
+    }
+
+def analyze_frames(frame_files, hints=None):
+    """自动选择多帧分析模式"""
+    if model_manager.model_loaded and OPENCV_AVAILABLE:
+        return analyze_frames_real(frame_files, hints)
+    else:
+        return [analyze_frame_simple(f) for f in frame_files]
+
+def process_burst_for_session(session_id, frame_files, finalize=False):
+    """一次处理一个会话的多帧：批量分析后按顺序计票，投票结束时可选地直接完成识别
+
+    每帧结果与 recognition/process_frame/ 逐帧调用时一致；会话不存在时返回 None
+    """
+    session_data = get_recognition_session(session_id)
+    if session_data is None:
+        return None
+    
+    # 投票已结束时不再消耗推理，每帧返回与单帧接口相同的结果
+    if session_data.get('liveness_decision'):
+        analyses = [{}] * len(frame_files)
     else:
-        return process_single_frame_simple(frame_file, session_data)
+        analyses = analyze_frames(frame_files, session_frame_hints(session_data))
+    return apply_analyses_to_session(session_id, analyses, finalize)
+
+def process_clip_for_session(session_id, clip_file, stride=None, finalize=False):
+    """处理一个会话的短视频：按步长抽帧后走与多帧上传相同的投票流程
+
+    每次只解码剩余投票需要的帧数，被质量检查拒绝的帧不计票，继续解码后续的帧，
+    直到投票够数、结果确定或视频结束；RECOGNITION_BURST_MAX_FRAMES 只是解码帧数的硬上限。
+    会话不存在时返回 None；视频无法解码时抛出 ValueError
+    """
+    session_data = get_recognition_session(session_id)
+    if session_data is None:
+        return None
+    
+    if not OPENCV_AVAILABLE:
+        raise ValueError('OpenCV 不可用，无法解码视频')
+    
+    stride = max(1, int(stride or getattr(settings, 'RECOGNITION_CLIP_FRAME_STRIDE', 5)))
+    max_frames = getattr(settings, 'RECOGNITION_BURST_MAX_FRAMES', 32)
+    frames = iter_clip_frames(clip_file, stride)
+    frame_results = []
+    clip_result = None
+    try:
+        while len(frame_results) < max_frames:
+            remaining = max(1, session_data['num_votes'] - session_data['total_votes'])
+            chunk = list(islice(frames, min(remaining, max_frames - len(frame_results))))
+            if not chunk:
+                break
+            
+            if session_data.get('liveness_decision'):
+                analyses = [{}] * len(chunk)
+            elif model_manager.model_loaded and OPENCV_AVAILABLE:
+                analyses = analyze_video_frames_real(chunk, session_frame_hints(session_data))
+            else:
+                analyses = [analyze_frame_simple(FrameBuffer(frame.reshape(-1))) for frame in chunk]
+            clip_result = apply_analyses_to_session(session_id, analyses)
+            if clip_result is None:
+                return None
+            frame_results.extend(clip_result['frame_results'])
+            session_data = clip_result['session_data']
+            if clip_result['session_status'] != VOTING or session_data['total_votes'] >= session_data['num_votes']:
+                break
+    finally:
+        frames.close()
+    
+    if clip_result is None:
+        raise ValueError('无法从视频中解码出帧')
+    clip_result['frame_results'] = frame_results
+    if finalize and clip_result['session_status'] != VOTING:
+        clip_result['final_result'] = finalize_face_recognition(session_data)
+    return clip_result
+
+def apply_analyses_to_session(session_id, analyses, finalize=False):
+    """按顺序把多帧分析结果原子地计入会话投票，投票结束时可选地直接完成识别"""
+    embedding_faces = []
+    
+    def apply_all(data):
+        embedding_faces.clear()  # CAS 冲突重试时重新收集
+        return [apply_frame_analysis(data, analysis, embedding_faces) for analysis in analyses]
+    
+    updated = mutate_recognition_session(session_id, apply_all)
+    if updated is None:
+        return None
+    session_data, results = updated
+    submit_embedding_faces(session_data, embedding_faces)
+    log_session_update(session_id, session_data)
+    
+    burst_result = {
+        'frame_results': [frame_result for frame_result, _ in results],
+        'session_status': results[-1][1],
+        'session_data': session_data
+    }
+    if finalize and burst_result['session_status'] != VOTING:
+        burst_result['final_result'] = finalize_face_recognition(session_data)
+    return burst_result
+
+class FrameDataTooLarge(ValueError):
+    """长度前缀格式的请求体中帧数或单帧大小超过上限"""
+
+def _read_exact(stream, size):
+    """从流中读取 size 字节，流提前结束时返回已读取的部分"""
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def read_length_prefixed_frames(stream, max_frames, max_frame_bytes):
+    """从请求流中逐帧解析长度前缀格式的多帧请求体: 重复的 [uint32 小端长度][JPEG 数据]
+
+    不经过 request.body (超过 DATA_UPLOAD_MAX_MEMORY_SIZE 时抛出 RequestDataTooBig)，
+    帧数或单帧大小超限时在读取该帧之前抛出 FrameDataTooLarge
+    """
+    frames = []
+    while True:
+        prefix = _read_exact(stream, 4)
+        if not prefix:
+            return frames
+        if len(prefix) < 4:
+            raise ValueError('帧长度前缀不完整')
+        (length,) = struct.unpack('<I', prefix)
+        if len(frames) >= max_frames:
+            raise FrameDataTooLarge(f'单次最多上传 {max_frames} 帧')
+        if length > max_frame_bytes:
+            raise FrameDataTooLarge(f'单帧不能超过 {max_frame_bytes} 字节')
+        data = _read_exact(stream, length)
+        if len(data) < length:
+            raise ValueError('帧数据长度不足')
+        frames.append(FrameBuffer(data, name=f'frame{len(frames)}.jpg'))
+
+def process_frame_for_session(session_id, frame_file):
+    """并发安全的单帧处理：推理在锁外进行，计票在会话锁内原子完成
+
+    同一会话可以同时有多帧在处理中；会话不存在时返回 None
+    """
+    session_data = get_recognition_session(session_id)
+    if session_data is None:
+        return None
+    
+    decision = session_data.get('liveness_decision')
+    if decision:
+        return {
+            'frame_result': {'success': False, 'message': '活体检测已结束'},
+            'session_data': session_data,
+            'session_status': decision
+        }
+    
+    analysis = analyze_frame(frame_file, session_frame_hints(session_data))
+    embedding_faces = []
+    
+    def apply(data):
+        embedding_faces.clear()  # CAS 冲突重试时重新收集
+        return apply_frame_analysis(data, analysis, embedding_faces)
+    
+    updated = mutate_recognition_session(session_id, apply)
+    if updated is None:
+        return None
+    session_data, (frame_result, session_status) = updated
+    submit_embedding_faces(session_data, embedding_faces)
+    log_session_update(session_id, session_data)
+    return {
+        'frame_result': frame_result,
+        'session_data': session_data,
+        'session_status': session_status
+    }
+
+def finalize_identification(session_data):
+    """1:N 识别会话 (创建时未指定用户名) 的最终结果：活体检测通过后在所有用户中识别，
+    不按用户名做 1:1 比对，也不以空用户名记录审计日志
+    """
+    if not is_liveness_passed(session_data):
+        return {
+            'success': False,
+            'message': f"活体检测失败: {session_data['votes_passed']}/{session_data['total_votes']}"
+        }
+    return identify_face(session_data=session_data)
 
 def finalize_face_recognition(session_data):
-    """自动选择识别模式"""
-    if MODEL_LOADED and DEEPFACE_AVAILABLE and OPENCV_AVAILABLE:
+    """自动选择识别模式；1:N 识别会话交给 finalize_identification"""
+    if session_data.get('username') is None:
+        return finalize_identification(session_data)
+    if model_manager.model_loaded and model_manager.deepface_available and OPENCV_AVAILABLE:
         return finalize_face_recognition_real(session_data)
     else:
         return finalize_face_recognition_simple(session_data)
 
+def finalize_session(session_id):
+    """按会话ID完成识别；会话不存在或已过期时返回 None"""
+    session_data = get_recognition_session(session_id)
+    if not session_data:
+        return None
+    return finalize_face_recognition(session_data)
+
 # 为了向后兼容，添加views.py需要的函数别名
 def perform_liveness_check_and_match(frame_file, session_data):
     """向后兼容的函数名 - 重定向到process_single_frame"""
@@ -420,16 +953,23 @@ def get_system_status():
         'simulation_mode': True,
         'ai_components': {
             'tensorflow': TENSORFLOW_AVAILABLE,
-            'deepface': DEEPFACE_AVAILABLE,
+            'deepface': model_manager.deepface_available,
             'opencv': OPENCV_AVAILABLE,
-            'model_loaded': MODEL_LOADED
+            'model_loaded': model_manager.model_loaded
         },
-        'model_path': os.path.join(settings.BASE_DIR, 'anandfinal.hdf5'),
-        'faces_db_path': settings.FACES_DATABASE_PATH
+        'model_path': model_manager.liveness.model_path if model_manager.model_loaded else settings.LIVENESS_MODEL_PATH,
+        'liveness_backend': model_manager.liveness.name if model_manager.model_loaded else None,
+        'liveness_batching': model_manager.scheduler.get_metrics() if model_manager.scheduler else {'enabled': False},
+        'model_manager': model_manager.status(),
+        'model_versions': model_manager.versions_status(),
+        'faces_db_path': settings.FACES_DATABASE_PATH,
+        'session_store': get_recognition_session_store().stats(),
+        'inference_executor': get_inference_executor().get_metrics(),
+        'audit_log_writer': get_audit_log_writer().get_metrics()
     }
     
     # 如果所有AI组件都可用，则不是模拟模式
-    if TENSORFLOW_AVAILABLE and DEEPFACE_AVAILABLE and OPENCV_AVAILABLE and MODEL_LOADED:
+    if model_manager.deepface_available and OPENCV_AVAILABLE and model_manager.model_loaded:
         status['simulation_mode'] = False
     
     return status
@@ -465,13 +1005,19 @@ def get_failed_faces():
         print(f"获取失败图片列表错误: {e}")
         return []
 
-# 添加会话管理功能
-recognition_sessions = {}
+# 会话管理 - 存储后端由 settings.RECOGNITION_SESSION_BACKEND 决定 (memory / sqlite / redis)
+def get_recognition_session_store():
+    """获取会话存储，过期会话的后台特征任务一并丢弃"""
+    return get_session_store(on_expired=discard_session_embeddings)
 
 def create_recognition_session(session_id, username, num_votes=10, live_threshold=0.6):
     """创建识别会话"""
-    # 调整参数以提高成功率
-    adjusted_threshold = min(live_threshold, 0.6)  # 确保阈值不会太高
+    # 会话固定使用创建时的模型版本，切换版本不影响进行中的会话
+    model_versions = model_manager.active_versions()
+    
+    # 调整参数以提高成功率 (上限由活体模型清单中的阈值决定，默认 0.6)
+    max_threshold = model_manager.liveness_manifest(model_versions['liveness'])['thresholds']['live']
+    adjusted_threshold = min(live_threshold, max_threshold)  # 确保阈值不会太高
     
     session_data = {
         'session_id': session_id,
@@ -482,38 +1028,55 @@ def create_recognition_session(session_id, username, num_votes=10, live_threshol
         'votes_passed': 0,
         'last_valid_face': None,  # 确保初始化为None
         'created_at': datetime.now(),
-        'status': 'active'
+        'status': 'active',
+        'model_versions': model_versions
     }
-    recognition_sessions[session_id] = session_data
+    get_recognition_session_store().set(session_id, session_data)
     print(f"📝 创建识别会话: {session_id}, 用户: {username}, 阈值: {adjusted_threshold}")
     return session_data
 
 def get_recognition_session(session_id):
     """获取识别会话"""
-    return recognition_sessions.get(session_id)
+    return get_recognition_session_store().get(session_id)
+
+def mutate_recognition_session(session_id, mutator):
+    """原子地修改会话，返回 (session_data, mutator 的返回值)；会话不存在时返回 None
+
+    同一进程内由分片锁串行化；跨进程 (sqlite / redis) 通过版本号比较并交换，冲突时重试
+    """
+    store = get_recognition_session_store()
+    retries = getattr(settings, 'RECOGNITION_SESSION_CAS_RETRIES', 10)
+    with session_lock(session_id):
+        for _ in range(retries):
+            session_data = store.get(session_id)
+            if session_data is None:
+                return None
+            version = session_data.get('version', 0)
+            result = mutator(session_data)
+            session_data['version'] = version + 1
+            if store.compare_and_set(session_id, session_data, version):
+                return session_data, result
+    raise RuntimeError(f'会话 {session_id} 并发更新冲突')
 
 def update_recognition_session(session_id, session_data):
-    """更新识别会话"""
-    recognition_sessions[session_id] = session_data
+    """更新识别会话 (同时刷新过期时间)"""
+    get_recognition_session_store().set(session_id, session_data)
+    log_session_update(session_id, session_data)
+
+def log_session_update(session_id, session_data):
+    """输出会话投票状态"""
     # 增强调试信息
-    face_data = session_data.get('last_valid_face')
-    if face_data:
-        face_info = f"有 ({len(face_data)} 字节)"
+    face_size = face_payload_size(session_data.get('last_valid_face'))
+    if face_size:
+        face_info = f"有 ({face_size} 字节)"
     else:
         face_info = "无"
     
     print(f"🔄 更新会话 {session_id}: 投票 {session_data['votes_passed']}/{session_data['total_votes']}, 有效人脸: {face_info}")
 
 def cleanup_old_sessions():
-    """清理超时的会话"""
-    current_time = datetime.now()
-    expired_sessions = []
-    
-    for session_id, session_data in recognition_sessions.items():
-        # 30分钟超时
-        if (current_time - session_data['created_at']).seconds > 1800:
-            expired_sessions.append(session_id)
-    
+    """清理超时的会话 (后台清理线程也会定期执行)"""
+    expired_sessions = get_recognition_session_store().cleanup_expired()
     for session_id in expired_sessions:
-        del recognition_sessions[session_id]
-
+        discard_session_embeddings(session_id)
+    return len(expired_sessions)
@@ -1,11 +1,21 @@
 import json
 import uuid
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.db import IntegrityError
-from .models import AuditLog
+from django.core.exceptions import RequestDataTooBig
+from .embedding_utils import delete_identity_embedding
+from .index_utils import get_embedding_index
+from .voting_utils import LIVENESS_PASSED
+from .async_utils import async_csrf_exempt, run_inference, InferenceExecutorSaturated
+from .upload_utils import use_frame_upload_handler, frame_buffer
+from .quality_utils import get_quality_config, REJECT_MESSAGES
+from .model_manager import get_model_manager
+from .audit_utils import ALERT_STATUSES, query_audit_logs, query_audit_stats
+from .model_registry import MODEL_KINDS, DEFAULT_VERSION, list_versions
 from .utils_recognition import (
     add_audit_log_entry, 
     save_identity_photo,
@@ -14,7 +24,14 @@ from .utils_recognition import (
     get_recognition_session,
     update_recognition_session,
     process_single_frame,
-    finalize_face_recognition
+    process_frame_for_session,
+    process_burst_for_session,
+    process_clip_for_session,
+    read_length_prefixed_frames,
+    FrameDataTooLarge,
+    finalize_face_recognition,
+    finalize_session,
+    identify_face
 )
 
 def json_response(success=True, data=None, message='', status=200):
@@ -27,6 +44,12 @@ def json_response(success=True, data=None, message='', status=200):
         response_data.update(data)
     return JsonResponse(response_data, status=status)
 
+def saturated_response():
+    """推理线程池已满时返回 503，并提示客户端稍后重试"""
+    response = json_response(False, message='服务器繁忙，请稍后重试', status=503)
+    response['Retry-After'] = str(getattr(settings, 'RECOGNITION_RETRY_AFTER', 1))
+    return response
+
 @csrf_exempt
 def login_api(request):
     """用户登录API"""
@@ -129,8 +152,10 @@ def recognition_start_api(request):
     try:
         data = json.loads(request.body)
         username = data.get('username')
+        mode = data.get('mode', 'verify')
         
-        if not username:
+        # 1:N 识别会话不需要用户名
+        if not username and mode != 'identify':
             return json_response(False, message='用户名不能为空', status=400)
         
         session_id = str(uuid.uuid4())
@@ -145,36 +170,142 @@ def recognition_start_api(request):
     except Exception as e:
         return json_response(False, message=f'创建识别会话失败: {str(e)}', status=500)
 
-@csrf_exempt
-def recognition_process_frame_api(request):
-    """处理视频帧API"""
+@async_csrf_exempt
+async def recognition_process_frame_api(request):
+    """处理视频帧API (异步，推理在有界线程池中执行)"""
     if request.method != 'POST':
         return json_response(False, message='Method not allowed', status=405)
     
     try:
+        # 帧数据保留在一块内存中，解码时不再拷贝
+        use_frame_upload_handler(request)
         session_id = request.POST.get('session_id')
         frame_file = request.FILES.get('frame')
         
         if not session_id or not frame_file:
             return json_response(False, message='会话ID和帧数据不能为空', status=400)
         
-        session_data = get_recognition_session(session_id)
-        if not session_data:
+        # 推理在锁外进行，计票原子完成，同一会话可以同时上传多帧
+        result = await run_inference(process_frame_for_session, session_id, frame_file)
+        if result is None:
             return json_response(False, message='会话不存在或已过期', status=404)
         
-        result = process_single_frame(frame_file, session_data)
-        update_recognition_session(session_id, result['session_data'])
-        
         return json_response(True, {
             'result': result['frame_result'],
             'session_status': result['session_status']
         }, '帧处理成功')
+    except InferenceExecutorSaturated:
+        return saturated_response()
     except Exception as e:
         return json_response(False, message=f'处理帧失败: {str(e)}', status=500)
 
+@async_csrf_exempt
+async def recognition_process_burst_api(request):
+    """一次上传一个会话的多帧API
+
+    multipart: session_id + 多个 frames 文件字段；
+    application/octet-stream: 请求体为重复的 [uint32 小端长度][JPEG]，session_id 放在查询参数中。
+    finalize=1 时投票结束后直接返回最终识别结果
+    """
+    if request.method != 'POST':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    try:
+        max_frames = getattr(settings, 'RECOGNITION_BURST_MAX_FRAMES', 32)
+        if request.content_type == 'application/octet-stream':
+            session_id = request.GET.get('session_id')
+            finalize = request.GET.get('finalize')
+            # 边读边检查帧数和单帧大小，超限时立即停止解析；WSGI 下超限的请求体不会整体读入内存，
+            # ASGI 下 Django 在调用视图前已把请求体完整接收到临时文件 (较小时在内存中)，这里只能省去解析和解码
+            frame_files = read_length_prefixed_frames(
+                request, max_frames, getattr(settings, 'RECOGNITION_FRAME_MAX_BYTES', 10 * 1024 * 1024))
+        else:
+            use_frame_upload_handler(request, max_files=max_frames)
+            session_id = request.POST.get('session_id')
+            finalize = request.POST.get('finalize', request.GET.get('finalize'))
+            frame_files = request.FILES.getlist('frames')
+        
+        if not session_id or not frame_files:
+            return json_response(False, message='会话ID和帧数据不能为空', status=400)
+        
+        if len(frame_files) > max_frames:
+            return json_response(False, message=f'单次最多上传 {max_frames} 帧', status=413)
+        
+        result = await run_inference(process_burst_for_session, session_id, frame_files,
+                                     finalize in ('1', 'true', 'True'))
+        if result is None:
+            return json_response(False, message='会话不存在或已过期', status=404)
+        
+        response_data = {
+            'results': result['frame_results'],
+            'session_status': result['session_status']
+        }
+        if 'final_result' in result:
+            response_data['final_result'] = result['final_result']
+        return json_response(True, response_data, '帧处理成功')
+    except (FrameDataTooLarge, RequestDataTooBig) as e:
+        return json_response(False, message=f'帧数据过大: {str(e)}', status=413)
+    except ValueError as e:
+        return json_response(False, message=f'无效的帧数据: {str(e)}', status=400)
+    except InferenceExecutorSaturated:
+        return saturated_response()
+    except Exception as e:
+        return json_response(False, message=f'处理帧失败: {str(e)}', status=500)
+
+@async_csrf_exempt
+async def recognition_process_clip_api(request):
+    """上传一段短视频 (webm/mp4) 完成活体投票API
+
+    session_id + clip 文件字段；stride 为抽帧步长，finalize=1 时投票结束后直接返回最终识别结果
+    """
+    if request.method != 'POST':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    try:
+        # 超过大小上限的视频在上传阶段即被跳过
+        max_bytes = getattr(settings, 'RECOGNITION_CLIP_MAX_BYTES', 20 * 1024 * 1024)
+        use_frame_upload_handler(request, max_bytes)
+        session_id = request.POST.get('session_id')
+        clip_file = request.FILES.get('clip')
+        stride = request.POST.get('stride')
+        finalize = request.POST.get('finalize')
+        
+        if not session_id or not clip_file:
+            return json_response(False, message=f'会话ID和视频数据不能为空 (视频不能超过 {max_bytes} 字节)', status=400)
+        
+        result = await run_inference(process_clip_for_session, session_id, clip_file,
+                                     int(stride) if stride else None, finalize in ('1', 'true', 'True'))
+        if result is None:
+            return json_response(False, message='会话不存在或已过期', status=404)
+        
+        response_data = {
+            'results': result['frame_results'],
+            'session_status': result['session_status']
+        }
+        if 'final_result' in result:
+            response_data['final_result'] = result['final_result']
+        return json_response(True, response_data, '视频处理成功')
+    except ValueError as e:
+        return json_response(False, message=f'无效的视频数据: {str(e)}', status=400)
+    except InferenceExecutorSaturated:
+        return saturated_response()
+    except Exception as e:
+        return json_response(False, message=f'处理视频失败: {str(e)}', status=500)
+
 @csrf_exempt
-def recognition_finalize_api(request):
-    """完成识别API"""
+def recognition_quality_config_api(request):
+    """帧质量检查配置API - 前端据此在上传前跳过不合格的帧"""
+    if request.method != 'GET':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    return json_response(True, {
+        'quality': get_quality_config(),
+        'reasons': REJECT_MESSAGES
+    })
+
+@async_csrf_exempt
+async def recognition_finalize_api(request):
+    """完成识别API (异步，特征比对在有界线程池中执行)"""
     if request.method != 'POST':
         return json_response(False, message='Method not allowed', status=405)
     
@@ -185,15 +316,49 @@ def recognition_finalize_api(request):
         if not session_id:
             return json_response(False, message='会话ID不能为空', status=400)
         
-        session_data = get_recognition_session(session_id)
-        if not session_data:
+        final_result = await run_inference(finalize_session, session_id)
+        if final_result is None:
             return json_response(False, message='会话不存在或已过期', status=404)
         
-        final_result = finalize_face_recognition(session_data)
         return json_response(True, {'final_result': final_result}, '识别完成')
+    except InferenceExecutorSaturated:
+        return saturated_response()
     except Exception as e:
         return json_response(False, message=f'完成识别失败: {str(e)}', status=500)
 
+@async_csrf_exempt
+async def recognition_identify_api(request):
+    """1:N 人脸识别API - 不需要用户名
+
+    需要传入活体检测已通过的会话ID (session_id)；RECOGNITION_IDENTIFY_ALLOW_FRAME 开启时也可直接上传一帧 (frame)，
+    单帧没有活体检测，只返回识别结果，不记录识别成功的审计日志
+    """
+    if request.method != 'POST':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    try:
+        use_frame_upload_handler(request)
+        session_id = request.POST.get('session_id')
+        frame_file = request.FILES.get('frame')
+        
+        if session_id:
+            session_data = await run_inference(get_recognition_session, session_id)
+            if not session_data:
+                return json_response(False, message='会话不存在或已过期', status=404)
+            if session_data.get('liveness_decision') != LIVENESS_PASSED:
+                return json_response(False, message='活体检测未通过', status=400)
+            identify_result = await run_inference(identify_face, session_data=session_data)
+        elif frame_file and getattr(settings, 'RECOGNITION_IDENTIFY_ALLOW_FRAME', False):
+            identify_result = await run_inference(identify_face, frame_buffer(frame_file))
+        else:
+            return json_response(False, message='需要活体检测已通过的会话ID', status=400)
+        
+        return json_response(True, {'identify_result': identify_result}, '识别完成')
+    except InferenceExecutorSaturated:
+        return saturated_response()
+    except Exception as e:
+        return json_response(False, message=f'身份识别失败: {str(e)}', status=500)
+
 @csrf_exempt
 def users_api(request):
     """用户列表API"""
@@ -217,56 +382,67 @@ def users_api(request):
     except Exception as e:
         return json_response(False, message=f'获取用户列表失败: {str(e)}', status=500)
 
+def audit_log_to_dict(log):
+    """审计日志的 JSON 表示"""
+    return {
+        'id': log.id,
+        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'username': log.user.username,
+        'action': log.action,
+        'liveness_status': log.liveness_status,
+        'compare_result': log.compare_result,
+        'score': log.score,
+        'image_path': log.image_path
+    }
+
 @csrf_exempt
 def audit_logs_api(request):
-    """审计日志API"""
+    """审计日志API - 键集分页 (?before=<next_cursor>)，可按 user/action/status/start/end 过滤"""
     if request.method != 'GET':
         return json_response(False, message='Method not allowed', status=405)
     
     try:
-        limit = int(request.GET.get('limit', 50))
-        logs = AuditLog.objects.select_related('user').order_by('-timestamp')[:limit]
-        
-        log_list = [{
-            'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'username': log.user.username,
-            'action': log.action,
-            'liveness_status': log.liveness_status,
-            'compare_result': log.compare_result,
-            'score': log.score,
-            'image_path': log.image_path
-        } for log in logs]
-        
-        return json_response(True, {'logs': log_list})
+        try:
+            logs, next_cursor = query_audit_logs(request.GET, default_limit=50)
+        except ValueError as e:
+            return json_response(False, message=f'无效的查询参数: {str(e)}', status=400)
+        
+        return json_response(True, {'logs': [audit_log_to_dict(log) for log in logs], 'next_cursor': next_cursor})
     except Exception as e:
         return json_response(False, message=f'获取审计日志失败: {str(e)}', status=500)
 
 @csrf_exempt
 def alert_logs_api(request):
-    """警报日志API"""
+    """警报日志API - 状态为 FAIL/ERROR 的审计日志，分页和过滤参数同 audit_logs"""
     if request.method != 'GET':
         return json_response(False, message='Method not allowed', status=405)
     
     try:
-        limit = int(request.GET.get('limit', 10))
-        logs = AuditLog.objects.select_related('user').filter(
-            liveness_status__in=['FAIL', 'ERROR']
-        ).order_by('-timestamp')[:limit]
-        
-        log_list = [{
-            'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'username': log.user.username,
-            'action': log.action,
-            'liveness_status': log.liveness_status,
-            'compare_result': log.compare_result,
-            'score': log.score,
-            'image_path': log.image_path
-        } for log in logs]
-        
-        return json_response(True, {'logs': log_list})
+        try:
+            logs, next_cursor = query_audit_logs(request.GET, statuses=ALERT_STATUSES, default_limit=10)
+        except ValueError as e:
+            return json_response(False, message=f'无效的查询参数: {str(e)}', status=400)
+        
+        return json_response(True, {'logs': [audit_log_to_dict(log) for log in logs], 'next_cursor': next_cursor})
     except Exception as e:
         return json_response(False, message=f'获取警报日志失败: {str(e)}', status=500)
 
+@csrf_exempt
+def audit_stats_api(request):
+    """审计统计API - 从按小时/按天预聚合的计数表读取时间序列、各维度合计和分数分布"""
+    if request.method != 'GET':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    try:
+        try:
+            stats = query_audit_stats(request.GET)
+        except ValueError as e:
+            return json_response(False, message=f'无效的查询参数: {str(e)}', status=400)
+        
+        return json_response(True, {'stats': stats})
+    except Exception as e:
+        return json_response(False, message=f'获取审计统计失败: {str(e)}', status=500)
+
 @csrf_exempt
 def create_admin_api(request):
     """创建管理员API"""
@@ -298,6 +474,50 @@ def create_admin_api(request):
     except Exception as e:
         return json_response(False, message=f'创建管理员失败: {str(e)}', status=500)
 
+@csrf_exempt
+def models_api(request):
+    """模型注册表API - 各类模型的可用版本、当前版本和加载状态 (管理员)"""
+    if request.method != 'GET':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    if not request.user.is_authenticated or not request.user.is_superuser:
+        return json_response(False, message='权限不足', status=403)
+    
+    try:
+        available = {kind: [DEFAULT_VERSION] + list_versions(kind) for kind in MODEL_KINDS}
+        return json_response(True, {
+            'available': available,
+            'versions': get_model_manager().versions_status()
+        })
+    except Exception as e:
+        return json_response(False, message=f'获取模型版本失败: {str(e)}', status=500)
+
+@csrf_exempt
+def models_activate_api(request):
+    """切换模型版本API - 后台加载并预热新版本后原子切换，进行中的会话继续使用原版本 (管理员)"""
+    if request.method != 'POST':
+        return json_response(False, message='Method not allowed', status=405)
+    
+    if not request.user.is_authenticated or not request.user.is_superuser:
+        return json_response(False, message='权限不足', status=403)
+    
+    try:
+        data = json.loads(request.body)
+        kind = data.get('kind')
+        version = data.get('version')
+        if not kind or not version:
+            return json_response(False, message='模型类型和版本不能为空', status=400)
+        
+        try:
+            get_model_manager().activate(kind, version)
+        except ValueError as e:
+            return json_response(False, message=str(e), status=400)
+        return json_response(True, {'kind': kind, 'version': version}, '模型版本正在后台加载', status=202)
+    except json.JSONDecodeError:
+        return json_response(False, message='无效的JSON数据', status=400)
+    except Exception as e:
+        return json_response(False, message=f'切换模型版本失败: {str(e)}', status=500)
+
 @csrf_exempt
 def delete_user(request):
     """删除用户"""
@@ -320,6 +540,8 @@ def delete_user(request):
         user_face_path = os.path.join(settings.BASE_DIR, 'faces_database', f'{username}.jpg')
         if os.path.exists(user_face_path):
             os.remove(user_face_path)
+        delete_identity_embedding(username)
+        get_embedding_index().remove(username)
         
         return JsonResponse({'success': True, 'message': '用户删除成功'})
         
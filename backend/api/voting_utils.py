@@ -0,0 +1,107 @@
+# voting_utils.py
+# 活体检测投票引擎：结果一旦确定就提前结束会话
+#   majority   - 多数投票；通过票已达到要求，或剩余票数不足以达到要求时提前结束
+#   sequential - 基于 real_score 的序贯概率比检验 (SPRT)，分数足够确定时提前结束，
+#                到达 num_votes 仍未确定时退回多数投票
+
+import math
+from django.conf import settings
+
+VOTING = 'voting'
+LIVENESS_PASSED = 'liveness_passed'
+LIVENESS_FAILED = 'liveness_failed'
+
+
+def get_voting_config():
+    """读取投票配置"""
+    return {
+        'mode': getattr(settings, 'LIVENESS_VOTING_MODE', 'majority'),
+        'early_stop': getattr(settings, 'LIVENESS_EARLY_STOP', True),
+        'sprt_p_live': getattr(settings, 'LIVENESS_SPRT_P_LIVE', 0.8),
+        'sprt_p_spoof': getattr(settings, 'LIVENESS_SPRT_P_SPOOF', 0.3),
+        'sprt_alpha': getattr(settings, 'LIVENESS_SPRT_ALPHA', 0.05),
+        'sprt_beta': getattr(settings, 'LIVENESS_SPRT_BETA', 0.05),
+        'sprt_min_votes': getattr(settings, 'LIVENESS_SPRT_MIN_VOTES', 3),
+    }
+
+
+def required_votes(session_data):
+    """多数投票所需的通过票数"""
+    return (session_data['num_votes'] // 2) + 1
+
+
+def record_vote(session_data, real_score):
+    """记录一票；real_score 为 None 表示未检测到人脸 (计为未通过)"""
+    session_data['total_votes'] += 1
+    if real_score is None:
+        return 'failed'
+
+    session_data.setdefault('liveness_scores', []).append(float(real_score))
+    if real_score >= session_data['live_threshold']:
+        session_data['votes_passed'] += 1
+        return 'passed'
+    return 'failed'
+
+
+def sprt_log_likelihood_ratio(scores, p_live, p_spoof):
+    """把每个分数视为软伯努利观测，计算真人/攻击两个假设的对数似然比"""
+    llr = 0.0
+    for score in scores:
+        s = min(max(score, 0.0), 1.0)
+        llr += s * math.log(p_live / p_spoof) + (1.0 - s) * math.log((1.0 - p_live) / (1.0 - p_spoof))
+    return llr
+
+
+def _sequential_decision(session_data, config):
+    scores = session_data.get('liveness_scores', [])
+    if len(scores) < config['sprt_min_votes']:
+        return VOTING
+    upper = math.log((1.0 - config['sprt_beta']) / config['sprt_alpha'])
+    lower = math.log(config['sprt_beta'] / (1.0 - config['sprt_alpha']))
+    llr = sprt_log_likelihood_ratio(scores, config['sprt_p_live'], config['sprt_p_spoof'])
+    session_data['liveness_llr'] = llr
+    if llr >= upper:
+        return LIVENESS_PASSED
+    if llr <= lower:
+        return LIVENESS_FAILED
+    return VOTING
+
+
+def evaluate_votes(session_data):
+    """根据当前票数返回会话状态；结果确定后写入 liveness_decision 且不再改变"""
+    decision = session_data.get('liveness_decision')
+    if decision:
+        return decision
+
+    config = get_voting_config()
+    num_votes = session_data['num_votes']
+    total = session_data['total_votes']
+    passed = session_data['votes_passed']
+    needed = required_votes(session_data)
+
+    status = VOTING
+    if config['mode'] == 'sequential':
+        status = _sequential_decision(session_data, config)
+
+    if status == VOTING and config['early_stop']:
+        if passed >= needed:
+            status = LIVENESS_PASSED
+        elif passed + (num_votes - total) < needed:
+            status = LIVENESS_FAILED
+
+    if status == VOTING and total >= num_votes:
+        status = LIVENESS_PASSED if passed >= needed else LIVENESS_FAILED
+
+    if status != VOTING:
+        session_data['liveness_decision'] = status
+        if total < num_votes:
+            print(f"⏩ 会话 {session_data.get('session_id')} 提前结束: {status} ({passed}/{total})")
+    return status
+
+
+def is_liveness_passed(session_data):
+    """会话的活体检测是否已通过"""
+    decision = session_data.get('liveness_decision')
+    if decision:
+        return decision == LIVENESS_PASSED
+    return session_data['votes_passed'] >= required_votes(session_data)
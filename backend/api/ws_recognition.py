@@ -0,0 +1,104 @@
+# ws_recognition.py
+# 活体检测帧的 WebSocket 通道 (原生 ASGI，无需 channels)
+#
+# 连接: ws://<host>/ws/recognition/?session_id=<recognition/start/ 返回的会话ID>
+# 客户端 -> 服务端:
+#   二进制消息            一帧 JPEG 图像，与 recognition/process_frame/ 的 frame 字段相同
+#   {"action": "finalize"} 立即完成识别 (投票结束时服务端会自动完成)
+# 服务端 -> 客户端 (JSON 文本):
+#   {"type": "frame", "result": {...}, "session_status": "..."}
+#   {"type": "final", "final_result": {...}}   之后服务端关闭连接 (1:N 识别会话为 identify_face 的结果)
+#   {"type": "busy", "retry_after": 1}         推理线程池已满，该帧未处理
+#   {"type": "error", "message": "..."}
+
+import json
+from urllib.parse import parse_qs
+from django.conf import settings
+
+from .async_utils import run_inference, InferenceExecutorSaturated
+from .upload_utils import FrameBuffer
+from .voting_utils import VOTING
+from .utils_recognition import get_recognition_session, process_frame_for_session, finalize_session
+
+WEBSOCKET_PATH = '/ws/recognition/'
+
+# 自定义关闭码 (4000-4999 留给应用使用)
+CLOSE_NORMAL = 1000
+CLOSE_BAD_REQUEST = 4400
+CLOSE_SESSION_NOT_FOUND = 4404
+
+
+async def _send_json(send, payload):
+    await send({'type': 'websocket.send', 'text': json.dumps(payload, ensure_ascii=False)})
+
+
+async def _close(send, code):
+    await send({'type': 'websocket.close', 'code': code})
+
+
+async def _finalize(send, session_id):
+    final_result = await run_inference(finalize_session, session_id)
+    if final_result is None:
+        await _send_json(send, {'type': 'error', 'message': '会话不存在或已过期'})
+        await _close(send, CLOSE_SESSION_NOT_FOUND)
+        return
+    await _send_json(send, {'type': 'final', 'final_result': final_result})
+    await _close(send, CLOSE_NORMAL)
+
+
+async def recognition_websocket(scope, receive, send):
+    """一个识别会话一条连接：逐帧返回投票结果，投票结束后推送最终结果"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    session_id = query.get('session_id', [None])[0]
+    if not session_id:
+        await _close(send, CLOSE_BAD_REQUEST)
+        return
+    if await run_inference(get_recognition_session, session_id) is None:
+        await _close(send, CLOSE_SESSION_NOT_FOUND)
+        return
+
+    await send({'type': 'websocket.accept'})
+    print(f"🔌 识别会话 WebSocket 已连接: {session_id}")
+    retry_after = getattr(settings, 'RECOGNITION_RETRY_AFTER', 1)
+
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            print(f"🔌 识别会话 WebSocket 已断开: {session_id}")
+            return
+        if message['type'] != 'websocket.receive':
+            continue
+
+        try:
+            if message.get('bytes') is not None:
+                frame_file = FrameBuffer(message['bytes'])
+                result = await run_inference(process_frame_for_session, session_id, frame_file)
+                if result is None:
+                    await _send_json(send, {'type': 'error', 'message': '会话不存在或已过期'})
+                    await _close(send, CLOSE_SESSION_NOT_FOUND)
+                    return
+
+                await _send_json(send, {
+                    'type': 'frame',
+                    'result': result['frame_result'],
+                    'session_status': result['session_status']
+                })
+                if result['session_status'] not in (VOTING, 'error'):
+                    await _finalize(send, session_id)
+                    return
+            else:
+                data = json.loads(message.get('text') or '{}')
+                if data.get('action') == 'finalize':
+                    await _finalize(send, session_id)
+                    return
+                await _send_json(send, {'type': 'error', 'message': f"未知的操作: {data.get('action')}"})
+        except InferenceExecutorSaturated:
+            await _send_json(send, {'type': 'busy', 'retry_after': retry_after})
+        except json.JSONDecodeError:
+            await _send_json(send, {'type': 'error', 'message': '无效的JSON数据'})
+        except Exception as e:
+            await _send_json(send, {'type': 'error', 'message': f'处理帧失败: {str(e)}'})
@@ -3,6 +3,9 @@ ASGI config for co_system_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP requests are handled by Django; WebSocket connections to
+``/ws/recognition/`` are routed to the recognition frame stream.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
 """
@@ -13,4 +16,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'co_system_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 必须在 Django 初始化之后导入
+from api.ws_recognition import WEBSOCKET_PATH, recognition_websocket  # noqa: E402
+from api.model_manager import warm_up_on_start  # noqa: E402
+
+# 工作进程启动后在后台加载模型，首个识别请求不必等待冷启动
+warm_up_on_start()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'].rstrip('/') == WEBSOCKET_PATH.rstrip('/'):
+            await recognition_websocket(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await django_application(scope, receive, send)
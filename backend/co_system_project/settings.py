@@ -1,6 +1,5 @@
 from pathlib import Path
 import os
-import cv2
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -131,13 +130,143 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Liveness model path (相对于 BASE_DIR)
 LIVENESS_MODEL_PATH = os.path.join(BASE_DIR, 'anandfinal.hdf5')
-FACE_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+# 活体推理后端: 'keras' | 'tflite' | 'onnx'
+# 导出模型: python manage.py export_liveness_model --format tflite [--int8 --calibration-dir DIR]
+LIVENESS_BACKEND = os.environ.get('LIVENESS_BACKEND', 'keras')
+LIVENESS_TFLITE_MODEL_PATH = os.path.join(BASE_DIR, 'anandfinal.tflite')
+LIVENESS_ONNX_MODEL_PATH = os.path.join(BASE_DIR, 'anandfinal.onnx')
+LIVENESS_INFERENCE_THREADS = None  # tflite/onnx 的推理线程数，None 表示由运行时决定
+LIVENESS_FACE_ROI = True  # 只把检测到的人脸区域 (而不是整帧) 送入活体模型
+LIVENESS_FACE_MARGIN = 0.25  # 人脸区域四周保留的边距比例
+LIVENESS_REJECT_MULTIPLE_FACES = True  # 画面中有多张人脸时该帧不做推理，计为未通过
+
+# 推理前的帧质量检查 (不合格的帧不计票)
+FRAME_QUALITY_ENABLED = True
+FRAME_QUALITY_ANALYSIS_SIDE = 160  # 在长边缩放到该尺寸的灰度图上计算
+FRAME_QUALITY_MIN_SHARPNESS = 30.0  # 拉普拉斯方差低于该值视为模糊
+FRAME_QUALITY_MIN_BRIGHTNESS = 40.0  # 平均亮度下限 (0-255)
+FRAME_QUALITY_MAX_BRIGHTNESS = 220.0  # 平均亮度上限 (0-255)
+FRAME_QUALITY_DHASH_SIZE = 16  # 感知哈希边长 (16 即 256 位)
+FRAME_QUALITY_DUPLICATE_MAX_DISTANCE = 0  # 与上一帧哈希的汉明距离不超过该值视为重复帧
+
+# 跨帧人脸跟踪：下一帧先在上一帧人脸附近的区域内检测，丢失时回退到整帧检测
+FACE_TRACKING_ENABLED = True
+FACE_TRACKING_PADDING = 0.5  # 搜索区域在人脸框四周各扩展的宽高比例
+FACE_TRACKING_REDETECT_EVERY = 5  # 连续跟踪该帧数后做一次整帧检测 (发现新出现的人脸)
+# None 表示使用 OpenCV 自带的 haarcascade_frontalface_default.xml (settings 中不导入 cv2)
+FACE_CASCADE_PATH = None
+
+# 人脸检测后端: 'haar' | 'lbp' | 'yunet' (模型文件不存在时回退到 haar)
+# None 表示根据 FACE_CASCADE_PATH 推断 (文件名含 lbp 时为 lbp，否则为 haar)
+FACE_DETECTOR_BACKEND = os.environ.get('FACE_DETECTOR_BACKEND') or None
+FACE_LBP_CASCADE_PATH = os.path.join(BASE_DIR, 'lbpcascade_frontalface_improved.xml')
+FACE_YUNET_MODEL_PATH = os.path.join(BASE_DIR, 'face_detection_yunet_2023mar.onnx')
+FACE_YUNET_SCORE_THRESHOLD = 0.8
+# 检测前将图像缩放到的最长边 (像素)，0 表示使用原图；
+# 缩小后 FACE_DETECT_MIN_SIZE 的人脸仍不小于检测窗口 (Haar 为 24 像素)，不会因缩小而漏检
+FACE_DETECT_MAX_SIDE = int(os.environ.get('FACE_DETECT_MAX_SIDE', 640))
+FACE_DETECT_SCALE_FACTOR = 1.1
+FACE_DETECT_MIN_NEIGHBORS = 4
+FACE_DETECT_MIN_SIZE = 30  # 原图坐标下的最小人脸尺寸 (调大后大分辨率帧可以缩得更小、检测更快)
+
+# 活体推理微批处理：并发会话的帧合并为一个批次送入模型
+LIVENESS_BATCHING_ENABLED = os.environ.get('LIVENESS_BATCHING_ENABLED', 'True') == 'True'
+LIVENESS_BATCH_MAX_SIZE = int(os.environ.get('LIVENESS_BATCH_MAX_SIZE', 16))
+LIVENESS_BATCH_MAX_WAIT_MS = float(os.environ.get('LIVENESS_BATCH_MAX_WAIT_MS', 5))
+LIVENESS_BATCH_TIMEOUT = 10  # 单个请求等待批处理结果的最长时间 (秒)
+
+# 人脸特征模型：注册时计算的身份特征带有模型名和版本标签，不匹配时自动重新生成
+FACE_MODEL_NAME = 'Facenet'
+FACE_EMBEDDING_VERSION = '1'
+FACE_DISTANCE_METRIC = 'cosine'
+FACE_MATCH_THRESHOLD = 0.40  # 与 DeepFace 中 Facenet/cosine 的默认阈值一致
+
+# 活体投票: 'majority' 多数投票 | 'sequential' 基于 real_score 的序贯概率比检验
+LIVENESS_VOTING_MODE = os.environ.get('LIVENESS_VOTING_MODE', 'majority')
+LIVENESS_EARLY_STOP = True  # 结果确定后提前结束会话 (如 6/6 通过或剩余票数不足)
+LIVENESS_SPRT_P_LIVE = 0.8   # 真人帧的期望分数
+LIVENESS_SPRT_P_SPOOF = 0.3  # 攻击帧的期望分数
+LIVENESS_SPRT_ALPHA = 0.05   # 误接受率上限
+LIVENESS_SPRT_BETA = 0.05    # 误拒绝率上限
+LIVENESS_SPRT_MIN_VOTES = 3
+
+# 投票阶段对每个通过活体检测的帧在后台提取特征并累积均值，识别阶段只需计算一次距离
+RECOGNITION_INCREMENTAL_EMBEDDING = os.environ.get('RECOGNITION_INCREMENTAL_EMBEDDING', 'False') == 'True'
+RECOGNITION_EMBEDDING_WORKERS = 1
+RECOGNITION_EMBEDDING_WAIT_TIMEOUT = 10  # 识别阶段等待未完成特征提取的最长时间 (秒)
+RECOGNITION_EMBEDDING_POLL_INTERVAL = 0.05  # 等待时轮询会话记录的间隔 (秒)，特征提取可能在其他进程完成
+
 FACES_DATABASE_PATH = os.path.join(BASE_DIR, "faces_database")
 FAILED_DIR_PATH = os.path.join(BASE_DIR, "failed_faces")
 
+# 1:N 人脸检索索引 (内存映射特征矩阵)
+FACE_INDEX_PATH = os.path.join(FACES_DATABASE_PATH, "index")
+FACE_IDENTIFY_TOP_K = 5
+RECOGNITION_IDENTIFY_ALLOW_FRAME = False  # 允许 recognition/identify/ 直接上传单帧 (没有活体检测，仅用于调试)
+# 用户数超过阈值后启用 IVF 粗量化，只搜索最近的 NPROBE 个聚类
+FACE_INDEX_IVF_ENABLED = True
+FACE_INDEX_IVF_MIN_SIZE = 100000
+FACE_INDEX_IVF_NLIST = None  # None 表示按 4*sqrt(N) 自动选择
+FACE_INDEX_IVF_NPROBE = 16
+
 # 创建 FAILED_DIR
 os.makedirs(FAILED_DIR_PATH, exist_ok=True)
 
+# 识别会话存储: 'memory' (单进程) | 'sqlite' (同机多进程, WAL) | 'redis' (Redis 兼容服务)
+RECOGNITION_SESSION_BACKEND = os.environ.get('RECOGNITION_SESSION_BACKEND', 'memory')
+RECOGNITION_SESSION_SQLITE_PATH = os.path.join(BASE_DIR, 'recognition_sessions.db')
+RECOGNITION_SESSION_REDIS_URL = os.environ.get('RECOGNITION_SESSION_REDIS_URL', 'redis://127.0.0.1:6379/0')
+RECOGNITION_SESSION_TTL = 1800  # 会话最后一次更新后 30 分钟过期
+RECOGNITION_SESSION_SWEEP_INTERVAL = 60  # 后台清理过期会话的间隔 (秒)
+RECOGNITION_SESSION_LOCK_SHARDS = 64  # 会话锁分片数，不同会话的帧更新互不阻塞
+RECOGNITION_SESSION_CAS_RETRIES = 10  # 跨进程版本冲突时的重试次数
+RECOGNITION_SESSION_MAX_BYTES = 256 * 1024 * 1024  # 全部会话的总字节预算，超出时淘汰最久未使用的会话 (0 为不限制)
+RECOGNITION_FACE_CROP_SIZE = 160  # 会话中保存的人脸裁剪图边长 (像素)
+RECOGNITION_FACE_CROP_MARGIN = 0.2  # 裁剪时在人脸框四周保留的边距比例
+
+# 异步识别接口的推理线程池 (uvicorn 等 ASGI 服务器下一个进程可保持大量连接)
+RECOGNITION_INFERENCE_WORKERS = None  # 推理并发线程数，None 表示 CPU 核数
+RECOGNITION_INFERENCE_QUEUE_SIZE = None  # 等待队列长度，None 表示线程数的 2 倍；队列满时返回 503
+RECOGNITION_RETRY_AFTER = 1  # 503 响应的 Retry-After 秒数
+RECOGNITION_BURST_MAX_FRAMES = 32  # recognition/process_burst/ 单次请求的最大帧数，也是 process_clip/ 解码帧数的上限
+RECOGNITION_BURST_WORKERS = None  # 多帧并行解码/检测的线程数，None 表示 CPU 核数
+RECOGNITION_CLIP_FRAME_STRIDE = 5  # recognition/process_clip/ 抽帧步长 (30fps 的 2 秒视频约取 12 帧)
+RECOGNITION_CLIP_MAX_BYTES = 20 * 1024 * 1024  # 上传视频的大小上限
+RECOGNITION_FRAME_MAX_BYTES = 10 * 1024 * 1024  # 单帧上传的大小上限 (帧保存在内存中，不落盘)
+RECOGNITION_REDUCED_DECODE = False  # 大尺寸帧以一半分辨率解码 (IMREAD_REDUCED_COLOR_2)
+RECOGNITION_REDUCED_DECODE_MIN_BYTES = 256 * 1024  # 帧数据超过该大小才使用一半分辨率解码
+
+# 模型加载：导入时不加载任何模型，首次使用或服务进程启动时的后台预热才加载
+RECOGNITION_WARM_UP_ON_START = True  # runserver / ASGI / WSGI 工作进程启动后在后台线程预热模型
+RECOGNITION_WARM_UP_EMBEDDING = True  # 预热时同时加载 DeepFace 人脸特征模型
+
+# 版本化模型注册表: model_registry/<liveness|embedding>/<版本>/manifest.json
+# 管理员通过 POST /api/models/activate/ 切换版本 (后台加载预热后原子切换，其他进程轮询 active.json 后跟进)
+MODEL_REGISTRY_PATH = os.path.join(BASE_DIR, 'model_registry')
+MODEL_REGISTRY_LIVENESS_VERSION = None  # 没有 active.json 时使用的版本，None 表示 settings 中的默认模型
+MODEL_REGISTRY_EMBEDDING_VERSION = None
+MODEL_REGISTRY_POLL_INTERVAL = 10  # 检查 active.json 的间隔 (秒)
+
+# 模型服务模式：模型只由 run_model_server 启动的推理进程持有，Web 进程通过共享内存传递帧
+RECOGNITION_MODEL_SERVER_ENABLED = os.environ.get('RECOGNITION_MODEL_SERVER_ENABLED', 'False') == 'True'
+RECOGNITION_MODEL_SERVER_ADDRESS = ('127.0.0.1', int(os.environ.get('RECOGNITION_MODEL_SERVER_PORT', 8765)))
+RECOGNITION_MODEL_SERVER_AUTHKEY = os.environ.get('RECOGNITION_MODEL_SERVER_AUTHKEY')  # 必须设置，未设置时模型服务和客户端拒绝启动
+RECOGNITION_MODEL_SERVER_WORKERS = 2  # 推理进程数 (每个进程持有一份模型)
+RECOGNITION_MODEL_SERVER_RING_SLOTS = 8  # 每个 Web 进程的共享内存槽位数 (同时在途的请求数)
+RECOGNITION_MODEL_SERVER_SLOT_BYTES = 4 * 1024 * 1024  # 每个槽位的大小，更大的数据随请求直接发送
+RECOGNITION_MODEL_SERVER_TIMEOUT = 10  # 等待推理结果的最长时间 (秒)
+RECOGNITION_MODEL_SERVER_QUEUE_SIZE = 64  # 模型服务中等待推理进程处理的请求上限，超出时直接返回错误
+
+# 审计日志：请求线程只入队，后台线程按条数或时间批量写入
+AUDIT_LOG_ASYNC = True  # False 时在请求线程中同步写入
+AUDIT_LOG_BATCH_SIZE = 200  # 累积多少条写入一次
+AUDIT_LOG_FLUSH_INTERVAL = 1.0  # 第一条日志入队后最多等待多少秒写入 (秒)
+AUDIT_LOG_QUEUE_SIZE = 10000  # 队列上限，满时请求线程等待后同步写入
+AUDIT_LOG_ENQUEUE_TIMEOUT = 0.5  # 队列满时的最长等待时间 (秒)
+AUDIT_LOG_PAGE_MAX = 500  # audit_logs / alert_logs 每页最多返回的条数
+AUDIT_ROLLUP_ENABLED = True  # 写入日志时同时累加按小时/按天的统计 (供 /api/stats/ 使用)
+AUDIT_ROLLUP_HOURLY_RETENTION_DAYS = 90  # compact_audit_rollups 删除早于该天数的小时统计，按天的统计一直保留
+
 # 简化缓存配置，避免复杂依赖
 CACHES = {
     'default': {
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'co_system_project.settings')
 
 application = get_wsgi_application()
+
+# 工作进程启动后在后台加载模型，首个识别请求不必等待冷启动
+from api.model_manager import warm_up_on_start  # noqa: E402
+
+warm_up_on_start()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 """Django's command-line utility for administrative tasks."""
+import importlib.metadata
+import importlib.util
 import os
 import sys
 
@@ -32,26 +34,20 @@ def main():
     if len(sys.argv) > 1 and sys.argv[1] == 'runserver':
         print("\n🔍 检查AI模型依赖状态:")
         
-        # 检查TensorFlow
-        try:
-            import tensorflow as tf
-            print(f"✅ TensorFlow: {tf.__version__}")
-        except ImportError:
-            print("❌ TensorFlow未安装 - pip install tensorflow")
-        
-        # 检查DeepFace
-        try:
-            from deepface import DeepFace
-            print("✅ DeepFace: 已安装")
-        except ImportError:
-            print("❌ DeepFace未安装 - pip install deepface")
-        
-        # 检查OpenCV
-        try:
-            import cv2
-            print(f"✅ OpenCV: {cv2.__version__}")
-        except ImportError:
-            print("❌ OpenCV未安装 - pip install opencv-python")
+        # 只查找已安装的包和版本号，不导入 (导入 TensorFlow 需要数秒，模型在服务启动后后台预热)
+        distributions = importlib.metadata.packages_distributions()
+        for module, package, label in (('tensorflow', 'tensorflow', 'TensorFlow'),
+                                       ('deepface', 'deepface', 'DeepFace'),
+                                       ('cv2', 'opencv-python', 'OpenCV')):
+            if importlib.util.find_spec(module) is None:
+                print(f"❌ {label}未安装 - pip install {package}")
+                continue
+            try:
+                # opencv-python-headless 等发行包的名称与模块名不同
+                version = importlib.metadata.version(distributions.get(module, [package])[0])
+            except importlib.metadata.PackageNotFoundError:
+                version = '已安装'
+            print(f"✅ {label}: {version}")
         
         # 检查模型文件
         model_path = os.path.join(os.path.dirname(__file__), 'anandfinal.hdf5')
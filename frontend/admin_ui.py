@@ -273,34 +273,118 @@ def show_user_deletion():
     except Exception as e:
         st.error(f"❌ 获取用户信息失败: {str(e)}")
 
+def audit_log_filter_params():
+    """审计日志的过滤条件 (用户名、状态、日期范围)"""
+    col_user, col_status, col_start, col_end = st.columns(4)
+    with col_user:
+        filter_user = st.text_input("用户名", key="audit_filter_user")
+    with col_status:
+        filter_status = st.selectbox("状态", ["全部", "SUCCESS", "FAIL", "ERROR", "IN_PROGRESS"], key="audit_filter_status")
+    with col_start:
+        filter_start = st.date_input("开始日期", value=None, key="audit_filter_start")
+    with col_end:
+        filter_end = st.date_input("结束日期", value=None, key="audit_filter_end")
+    
+    params = {}
+    if filter_user.strip():
+        params['user'] = filter_user.strip()
+    if filter_status != "全部":
+        params['status'] = filter_status
+    if filter_start:
+        params['start'] = filter_start.isoformat()
+    if filter_end:
+        params['end'] = filter_end.isoformat()
+    return params
+
+def show_audit_stats(params):
+    """显示审计统计 (服务端按小时/按天预聚合，不受日志条数影响)"""
+    period_label = st.radio("统计粒度", ["按天 (默认最近 30 天)", "按小时 (默认最近 24 小时)"], horizontal=True, key="audit_stats_period")
+    stats_params = {key: value for key, value in params.items() if key in ('user', 'start', 'end')}
+    stats_params['period'] = 'hour' if '小时' in period_label else 'day'
+    
+    response = st.session_state.requests_session.get(f"{config.DJANGO_API_URL}/stats/", params=stats_params)
+    if response.status_code != 200:
+        st.warning(f"⚠️ 无法获取统计: {response.json().get('message', response.status_code)}")
+        return
+    stats = response.json().get('stats', {})
+    by_status = stats.get('by_status', {})
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("总记录数", stats.get('total', 0))
+    with col2:
+        st.metric("成功识别", by_status.get('SUCCESS', 0))
+    with col3:
+        st.metric("失败/错误", by_status.get('FAIL', 0) + by_status.get('ERROR', 0))
+    with col4:
+        average_score = stats.get('average_score')
+        st.metric("平均分数", f"{average_score:.3f}" if average_score is not None else "-")
+    
+    series = stats.get('series', [])
+    if series:
+        # 按状态堆叠的时间序列
+        df_series = pd.DataFrame([{'时间': point['bucket'], **point['by_status']} for point in series]).set_index('时间').fillna(0)
+        st.bar_chart(df_series)
+        
+        col_hist, col_result = st.columns(2)
+        with col_hist:
+            st.caption("分数分布")
+            df_hist = pd.DataFrame(stats.get('score_histogram', [])).set_index('bin')
+            st.bar_chart(df_hist)
+        with col_result:
+            st.caption("比对结果")
+            df_result = pd.DataFrame(list(stats.get('by_compare_result', {}).items()), columns=['结果', '次数']).set_index('结果')
+            st.bar_chart(df_result)
+    else:
+        st.info("所选时间范围内暂无统计数据")
+
 def show_audit_logs():
-    """显示审计日志"""
+    """显示审计日志 (服务端按时间倒序分页，上一页/下一页通过游标翻页)"""
     st.subheader("📊 审计日志")
     
+    params = audit_log_filter_params()
     try:
-        response = st.session_state.requests_session.get(f"{config.DJANGO_API_URL}/audit_logs/")
+        show_audit_stats(params)
+    except Exception as e:
+        st.warning(f"⚠️ 获取统计失败: {str(e)}")
+    
+    params['limit'] = 50
+    # 过滤条件变化时回到第一页
+    filter_key = json.dumps(params, sort_keys=True)
+    if st.session_state.get('audit_log_filter') != filter_key:
+        st.session_state.audit_log_filter = filter_key
+        st.session_state.audit_log_cursors = []
+    cursors = st.session_state.audit_log_cursors
+    if cursors:
+        params['before'] = cursors[-1]
+    
+    try:
+        response = st.session_state.requests_session.get(f"{config.DJANGO_API_URL}/audit_logs/", params=params)
         
         if response.status_code == 200:
             data = response.json()
             logs = data.get('logs', [])
             
             if logs:
-                # 显示日志统计
-                df = pd.DataFrame(logs)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.metric("总记录数", len(logs))
-                with col2:
-                    success_count = len([log for log in logs if log.get('liveness_status') == 'PASS'])
-                    st.metric("成功识别", success_count)
-                
                 # 显示日志表格
+                df = pd.DataFrame(logs)
                 st.dataframe(df, use_container_width=True)
             else:
                 st.info("暂无审计日志")
+            
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if cursors and st.button("⬅️ 上一页", key="audit_prev_page"):
+                    cursors.pop()
+                    st.rerun()
+            with col_page:
+                st.caption(f"第 {len(cursors) + 1} 页")
+            with col_next:
+                if data.get('next_cursor') and st.button("下一页 ➡️", key="audit_next_page"):
+                    cursors.append(data['next_cursor'])
+                    st.rerun()
         else:
-            st.error("❌ 无法获取审计日志")
+            st.error(f"❌ 无法获取审计日志: {response.json().get('message', response.status_code)}")
     except Exception as e:
         st.error(f"❌ 获取审计日志失败: {str(e)}")
 
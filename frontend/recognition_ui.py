@@ -1,11 +1,29 @@
 import os
 import streamlit as st
 import cv2
+import numpy as np
 import requests
 import time
 import io
+import json
+
+try:
+    import websocket  # websocket-client，可选依赖
+    WEBSOCKET_AVAILABLE = True
+except ImportError:
+    WEBSOCKET_AVAILABLE = False
 
 DJANGO_API_BASE_URL = os.environ.get('DJANGO_API_URL', "http://127.0.0.1:8000/api")
+# 后端以 ASGI (uvicorn) 运行时可通过一条 WebSocket 连接发送全部帧
+USE_WEBSOCKET = os.environ.get('RECOGNITION_USE_WEBSOCKET', '').lower() == 'true'
+
+def get_websocket_url(session_id):
+    """由 API 地址推导识别会话的 WebSocket 地址"""
+    base = DJANGO_API_BASE_URL.rstrip('/')
+    if base.endswith('/api'):
+        base = base[:-len('/api')]
+    base = base.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1)
+    return f"{base}/ws/recognition/?session_id={session_id}"
 
 def get_api_session():
     """获取API会话"""
@@ -33,6 +51,50 @@ def api_request(endpoint, method='GET', data=None, files=None):
         st.error(f"API请求失败: {str(e)}")
         return None
 
+def get_quality_config():
+    """获取后端的帧质量检查配置 (只请求一次；获取失败时不做本地检查)"""
+    if 'quality_config' not in st.session_state:
+        try:
+            response = get_api_session().get(f"{DJANGO_API_BASE_URL}/recognition/quality_config/", timeout=5)
+            data = response.json() if response.status_code == 200 else {}
+            st.session_state.quality_config = data.get('quality'), data.get('reasons', {})
+        except Exception:
+            st.session_state.quality_config = None, {}
+    return st.session_state.quality_config
+
+def check_frame_quality(frame):
+    """上传前按后端相同的规则检查画面质量，返回不合格原因 (合格时返回 None)"""
+    config, reasons = get_quality_config()
+    if not config or not config.get('enabled'):
+        return None
+    
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    side = config['analysis_side']
+    if max(h, w) > side:
+        scale = side / float(max(h, w))
+        gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    
+    brightness = float(gray.mean())
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    size = config['dhash_size']
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    frame_hash = int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), 'big')
+    previous_hash = st.session_state.get('last_frame_hash')
+    
+    reason = None
+    if brightness < config['min_brightness']:
+        reason = 'too_dark'
+    elif brightness > config['max_brightness']:
+        reason = 'overexposed'
+    elif sharpness < config['min_sharpness']:
+        reason = 'blurry'
+    elif previous_hash is not None and bin(frame_hash ^ previous_hash).count('1') <= config['duplicate_max_distance']:
+        reason = 'duplicate_frame'
+    
+    st.session_state.last_frame_hash = frame_hash
+    return reasons.get(reason, reason) if reason else None
+
 def check_backend_connectivity():
     """检查后端连接"""
     try:
@@ -102,6 +164,10 @@ def verify_user_identity(username: str):
 
 def process_video_frames(session_id, username):
     """处理视频帧"""
+    st.session_state.last_frame_hash = None
+    if USE_WEBSOCKET and WEBSOCKET_AVAILABLE:
+        return process_video_frames_ws(session_id, username)
+    
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         st.error("❌ 无法打开摄像头")
@@ -130,6 +196,12 @@ def process_video_frames(session_id, username):
             if frame_count % 8 == 0:
                 status_ph.info("🔍 正在处理帧...")
                 
+                # 上传前本地检查画面质量，不合格的帧不上传
+                quality_issue = check_frame_quality(frame)
+                if quality_issue:
+                    status_ph.warning(f"⚠️ {quality_issue}")
+                    continue
+                
                 # 编码并发送帧
                 _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
                 frame_bytes = io.BytesIO(buffer.tobytes())
@@ -149,11 +221,12 @@ def process_video_frames(session_id, username):
                         status_ph.success(f"{vote_result} 投票 {votes_info} - {liveness_info}")
                         
                         progress.progress(result['total_votes'] / 10)
-                        
-                        if session_status in ['liveness_passed', 'liveness_failed']:
-                            break
                     else:
                         status_ph.warning(f"⚠️ {result['message']}")
+                    
+                    # 未检测到人脸等 success 为 False 的帧也计票，可能正是决定结果的一票
+                    if session_status in ['liveness_passed', 'liveness_failed']:
+                        break
                 else:
                     st.error("❌ 后端处理失败")
                     break
@@ -171,6 +244,95 @@ def process_video_frames(session_id, username):
     if st.session_state.run_live:
         finalize_recognition(session_id, username, status_ph)
 
+def process_video_frames_ws(session_id, username):
+    """通过 WebSocket 发送视频帧，逐帧接收投票结果，投票结束后由服务端推送最终结果"""
+    try:
+        ws = websocket.create_connection(get_websocket_url(session_id), timeout=30)
+    except Exception as e:
+        st.error(f"❌ WebSocket 连接失败: {str(e)}")
+        st.session_state.run_live = False
+        return
+    
+    cap = cv2.VideoCapture(0)
+    if not cap.isOpened():
+        ws.close()
+        st.error("❌ 无法打开摄像头")
+        st.session_state.run_live = False
+        return
+    
+    frame_ph = st.empty()
+    status_ph = st.empty()
+    progress = st.progress(0.0)
+    
+    frame_count = 0
+    final_result = None
+    
+    try:
+        while st.session_state.run_live:
+            ret, frame = cap.read()
+            if not ret:
+                status_ph.warning("⚠️ 无法读取摄像头帧")
+                time.sleep(0.1)
+                continue
+            
+            frame_count += 1
+            display_frame = cv2.flip(frame, 1)
+            frame_ph.image(display_frame, channels="BGR", caption=f"第 {frame_count} 帧")
+            
+            # 每8帧处理一次
+            if frame_count % 8 == 0:
+                quality_issue = check_frame_quality(frame)
+                if quality_issue:
+                    status_ph.warning(f"⚠️ {quality_issue}")
+                    continue
+                
+                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+                ws.send_binary(buffer.tobytes())
+                message = json.loads(ws.recv())
+                
+                if message['type'] == 'frame':
+                    result = message['result']
+                    if result['success']:
+                        votes_info = f"{result['votes_passed']}/{result['total_votes']}"
+                        liveness_info = f"活体分数: {result['liveness_score']:.3f}"
+                        vote_result = "✅" if result['vote_result'] == 'passed' else "❌"
+                        status_ph.success(f"{vote_result} 投票 {votes_info} - {liveness_info}")
+                        progress.progress(result['total_votes'] / 10)
+                    else:
+                        status_ph.warning(f"⚠️ {result['message']}")
+                    
+                    # 投票结束后服务端紧接着推送最终结果
+                    if message['session_status'] in ['liveness_passed', 'liveness_failed']:
+                        status_ph.info("🔄 正在完成识别流程...")
+                        message = json.loads(ws.recv())
+                
+                if message['type'] == 'final':
+                    final_result = message['final_result']
+                    break
+                elif message['type'] == 'busy':
+                    status_ph.warning("⚠️ 服务器繁忙，稍后重试")
+                    time.sleep(message.get('retry_after', 1))
+                elif message['type'] == 'error':
+                    st.error(f"❌ 后端处理失败: {message['message']}")
+                    break
+            
+            time.sleep(0.05)
+    except Exception as e:
+        st.error(f"❌ WebSocket 通信失败: {str(e)}")
+    finally:
+        cap.release()
+        progress.empty()
+        ws.close()
+    
+    if final_result is not None:
+        if final_result['success']:
+            score_info = f"匹配分数: {final_result.get('score', 'N/A')}"
+            st.success(f"✅ 身份验证成功！{score_info}")
+        else:
+            st.error(f"❌ 身份验证失败: {final_result['message']}")
+    
+    st.session_state.run_live = False
+
 def finalize_recognition(session_id, username, status_ph):
     """完成识别流程"""
     status_ph.info("🔄 正在完成识别流程...")
@@ -258,6 +420,7 @@ def process_video_frames_with_callback(session_id, username):
     import time
     import io
     
+    st.session_state.last_frame_hash = None
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         st.error("❌ 无法打开摄像头")
@@ -287,6 +450,12 @@ def process_video_frames_with_callback(session_id, username):
             if frame_count % 8 == 0:
                 status_ph.info("🔍 正在处理帧...")
                 
+                # 上传前本地检查画面质量，不合格的帧不上传
+                quality_issue = check_frame_quality(frame)
+                if quality_issue:
+                    status_ph.warning(f"⚠️ {quality_issue}")
+                    continue
+                
                 # 编码并发送帧
                 _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
                 frame_bytes = io.BytesIO(buffer.tobytes())
@@ -306,12 +475,13 @@ def process_video_frames_with_callback(session_id, username):
                         status_ph.success(f"{vote_result} 投票 {votes_info} - {liveness_info}")
                         
                         progress.progress(result['total_votes'] / 10)
-                        
-                        if session_status in ['liveness_passed', 'liveness_failed']:
-                            verification_completed = True
-                            break
                     else:
                         status_ph.warning(f"⚠️ {result['message']}")
+                    
+                    # 未检测到人脸等 success 为 False 的帧也计票，可能正是决定结果的一票
+                    if session_status in ['liveness_passed', 'liveness_failed']:
+                        verification_completed = True
+                        break
                 else:
                     st.error("❌ 后端处理失败")
                     break